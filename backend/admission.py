@@ -0,0 +1,171 @@
+import math
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.exceptions import HTTPException, ServiceUnavailable, TooManyRequests
+
+import metrics
+
+
+class Overloaded(TooManyRequests):
+    """The inference queue is full; answered with 429 and Retry-After"""
+    description = 'Too many predictions are queued, retry later'
+
+
+class DeadlineExceeded(ServiceUnavailable):
+    """The request's deadline passed before its inference finished"""
+    description = 'The prediction did not finish within the request timeout'
+
+
+class ClientClosedRequest(HTTPException):
+    code = 499
+    description = 'Client closed the request'
+
+
+def client_disconnected(environ):
+    """Whether the client of a WSGI request has closed its connection.
+
+    Peeks at the socket gunicorn or the Werkzeug development server exposes;
+    a readable socket with no data means the peer hung up. Unknown servers
+    are assumed to still be connected.
+    """
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+class InferenceExecutor:
+    """Runs inference on a fixed number of threads behind a bounded queue.
+
+    At most ``max_workers`` calls run at once, so concurrent uploads do not
+    oversubscribe the CPU, and at most ``max_queue`` more wait for a thread.
+    Past that ``submit`` raises Overloaded right away, with a Retry-After
+    estimated from the recent service time, instead of letting requests pile
+    up until the server workers time out. Queued calls whose deadline has
+    passed are skipped, and ``wait`` cancels a call that is still queued when
+    its deadline passes or its client disconnects.
+    """
+
+    def __init__(self, max_workers=2, max_queue=8):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = None
+        self._admitted = 0
+        self._running = 0
+        self._service_seconds = None
+        self._cond = threading.Condition()
+        self.counters = {'completed': 0, 'rejected': 0, 'cancelled': 0, 'expired': 0}
+
+    def _executor(self):
+        # Created lazily so that each forked server process gets its own threads
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='inference')
+        return self._pool
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.max_queue
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up, at least 1"""
+        service = self._service_seconds or 1.0
+        return max(1, math.ceil(service * (self._admitted - self.max_workers + 1) / self.max_workers))
+
+    def check(self):
+        """Raise Overloaded when a new call would be rejected"""
+        with self._cond:
+            if self._admitted >= self.capacity:
+                self.counters['rejected'] += 1
+                raise Overloaded(retry_after=self.retry_after())
+
+    def submit(self, fn, *args, deadline=None, block=False, mission=''):
+        """Queue ``fn(*args)`` and return its Future.
+
+        A full queue raises Overloaded, or with ``block`` waits for a slot
+        (until ``deadline``, a time.monotonic() value). The call runs under
+        the caller's request trace, with its wait recorded as the 'queue' stage.
+        """
+        with self._cond:
+            while self._admitted >= self.capacity:
+                if not block:
+                    self.counters['rejected'] += 1
+                    raise Overloaded(retry_after=self.retry_after())
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    self.counters['expired'] += 1
+                    raise DeadlineExceeded(retry_after=self.retry_after())
+                self._cond.wait(timeout)
+            self._admitted += 1
+            pool = self._executor()
+        future = pool.submit(self._run, fn, args, deadline, metrics.current_trace(),
+                             time.perf_counter(), mission)
+        future.add_done_callback(self._release)
+        return future
+
+    def _run(self, fn, args, deadline, trace, queued_at, mission):
+        with metrics.attach(trace):
+            metrics.record_stage('queue', time.perf_counter() - queued_at, mission)
+            if deadline is not None and time.monotonic() >= deadline:
+                with self._cond:
+                    self.counters['expired'] += 1
+                raise DeadlineExceeded(retry_after=self.retry_after())
+            with self._cond:
+                self._running += 1
+            start = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._cond:
+                    self._running -= 1
+                    self.counters['completed'] += 1
+                    # Moving average of the service time, for Retry-After
+                    previous = self._service_seconds
+                    self._service_seconds = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+
+    def _release(self, future):
+        with self._cond:
+            self._admitted -= 1
+            if future.cancelled():
+                self.counters['cancelled'] += 1
+            self._cond.notify()
+
+    def wait(self, future, deadline=None, disconnected=None, poll_interval=0.1):
+        """Result of a submitted call, cancelling it if the deadline passes or
+        ``disconnected()`` turns true while it waits"""
+        while True:
+            timeout = poll_interval
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    future.cancel()
+                    raise DeadlineExceeded(retry_after=self.retry_after())
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeout:
+                pass
+            if disconnected is not None and disconnected():
+                future.cancel()
+                raise ClientClosedRequest()
+
+    def run(self, fn, *args, deadline=None, disconnected=None, block=False, mission=''):
+        """Submit a call and wait for its result"""
+        future = self.submit(fn, *args, deadline=deadline, block=block, mission=mission)
+        return self.wait(future, deadline=deadline, disconnected=disconnected)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats.update(max_workers=self.max_workers, max_queue=self.max_queue,
+                         running=self._running, queued=self._admitted - self._running,
+                         mean_service_ms=(round(self._service_seconds * 1000, 2)
+                                          if self._service_seconds is not None else None))
+        return stats
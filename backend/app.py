@@ -1,35 +1,190 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, current_app, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import BadRequest, HTTPException, ServiceUnavailable
 import pandas as pd
-import numpy as np
-from model import ExoplanetModel
+import csv
+import functools
+import io
+import itertools
+import json
+import time
+import ingest
+import metrics
+import model_store
+import response_formats
+from model import result_columns, rows_from_columns, training_accuracy
+from similarity import MAX_NEIGHBORS
+from registry import ModelRegistry
+from jobs import JobManager, fail_interrupted
+from batcher import MicroBatcher
+from admission import DeadlineExceeded, InferenceExecutor, client_disconnected
+from dashboard_stats import DashboardStats
+from response_cache import ResponseCache, response_key, upload_digest
 import os
-from werkzeug.utils import secure_filename
+
+UNCAPPED_UPLOADS = {
+    'predict_stream': 'STREAM_MAX_CONTENT_LENGTH',
+    'submit_job': 'JOB_MAX_CONTENT_LENGTH'
+}
+
+class ExoQuestRequest(Request):
+    @property
+    def max_content_length(self):
+        # Streamed and job uploads never sit in memory as a whole, so the
+        # in-memory upload cap does not apply to them
+        if self.url_rule is not None and self.url_rule.endpoint in UNCAPPED_UPLOADS:
+            return current_app.config[UNCAPPED_UPLOADS[self.url_rule.endpoint]]
+        return super().max_content_length
 
 app = Flask(__name__)
+app.request_class = ExoQuestRequest
 CORS(app)
 
 UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'csv'}
+ALLOWED_EXTENSIONS = set(ingest.EXTENSIONS)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['STREAM_MAX_CONTENT_LENGTH'] = None  # no limit on streamed uploads
+app.config['STREAM_CHUNK_ROWS'] = 5000
+app.config['BATCH_MAX_ROWS'] = int(os.environ.get('EXOQUEST_BATCH_MAX_ROWS', 256))
+app.config['BATCH_MAX_WAIT_MS'] = float(os.environ.get('EXOQUEST_BATCH_MAX_WAIT_MS', 5))
+app.config['JOB_MAX_CONTENT_LENGTH'] = None  # job uploads are spooled to disk
+app.config['JOB_WORKERS'] = int(os.environ.get('EXOQUEST_JOB_WORKERS', 2))
+app.config['MODEL_MEMORY_BUDGET_MB'] = int(os.environ.get('EXOQUEST_MODEL_MEMORY_MB', 0))
+app.config['PRELOAD_MODELS'] = os.environ.get('EXOQUEST_PRELOAD_MODELS', '0') == '1'
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('EXOQUEST_SLOW_REQUEST_MS', 0))  # 0 disables the log
+app.config['MODEL_POLL_SECONDS'] = float(os.environ.get('EXOQUEST_MODEL_POLL_SECONDS', 5))
+app.config['ADMIN_TOKEN'] = os.environ.get('EXOQUEST_ADMIN_TOKEN')  # unset disables the admin endpoints
+# Inference runs on a bounded pool: at most INFERENCE_WORKERS calls at once and
+# INFERENCE_QUEUE more waiting, beyond which requests get a 429
+app.config['INFERENCE_WORKERS'] = int(os.environ.get('EXOQUEST_INFERENCE_WORKERS', 2))
+app.config['INFERENCE_QUEUE'] = int(os.environ.get('EXOQUEST_INFERENCE_QUEUE', 8))
+app.config['REQUEST_TIMEOUT_S'] = float(os.environ.get('EXOQUEST_REQUEST_TIMEOUT_S', 30))
+# Dashboard aggregates, shared by all processes and kept across restarts; empty keeps them in memory
+app.config['STATS_PATH'] = os.environ.get('EXOQUEST_STATS_PATH', os.path.join(UPLOAD_FOLDER, 'dashboard_stats.sqlite'))
+# Encoded /api/predict responses per upload: in-memory budget per process (0
+# disables it) and an optional SQLite tier shared by all processes
+app.config['RESPONSE_CACHE_MB'] = float(os.environ.get('EXOQUEST_RESPONSE_CACHE_MB', 64))
+app.config['RESPONSE_CACHE_DIR'] = os.environ.get('EXOQUEST_RESPONSE_CACHE_DIR')
+app.config['RESPONSE_CACHE_DISK_MB'] = float(os.environ.get('EXOQUEST_RESPONSE_CACHE_DISK_MB', 1024))
 
-# Initialize models
-models = {
-    'kepler': ExoplanetModel('kepler'),
-    'k2': ExoplanetModel('k2'),
-    'tess': ExoplanetModel('tess')
-}
+dashboard_stats = DashboardStats(app.config['STATS_PATH'] or None)
+
+responses = ResponseCache(
+    max_bytes=int(app.config['RESPONSE_CACHE_MB'] * 1024 * 1024),
+    disk_path=(os.path.join(app.config['RESPONSE_CACHE_DIR'], 'responses.sqlite')
+               if app.config['RESPONSE_CACHE_DIR'] else None),
+    max_disk_bytes=int(app.config['RESPONSE_CACHE_DISK_MB'] * 1024 * 1024))
+
+# Models are loaded on first use; set EXOQUEST_PRELOAD_MODELS=1 together with
+# gunicorn's preload_app to load them once in the master and share them
+models = ModelRegistry(memory_budget=app.config['MODEL_MEMORY_BUDGET_MB'] * 1024 * 1024,
+                       poll_interval=app.config['MODEL_POLL_SECONDS'],
+                       stats=dashboard_stats)
+if app.config['PRELOAD_MODELS']:
+    models.preload()
+
+inference = InferenceExecutor(max_workers=app.config['INFERENCE_WORKERS'],
+                              max_queue=app.config['INFERENCE_QUEUE'])
+
+batcher = MicroBatcher(models.get,
+                       max_batch_rows=app.config['BATCH_MAX_ROWS'],
+                       max_wait_ms=app.config['BATCH_MAX_WAIT_MS'],
+                       run=functools.partial(inference.run, block=True))
+
+jobs = JobManager(os.path.join(UPLOAD_FOLDER, 'jobs'),
+                  max_workers=app.config['JOB_WORKERS'],
+                  chunk_rows=app.config['STREAM_CHUNK_ROWS'],
+                  stats_path=app.config['STATS_PATH'] or None)
+
+# Exceptions caused by the uploaded data rather than by the server
+CLIENT_ERRORS = (KeyError, ValueError, UnicodeDecodeError)
+
+def error_response(e):
+    """JSON error response for a failed prediction, naming the stage that failed"""
+    if isinstance(e, HTTPException):
+        status = e.code
+    else:
+        status = 400 if isinstance(e, CLIENT_ERRORS) else 500
+    body = {'error': str(e)}
+    current = metrics.current_trace()
+    if current is not None and current.failed_stage:
+        body['stage'] = current.failed_stage
+    headers = {}
+    if getattr(e, 'retry_after', None) is not None:
+        headers['Retry-After'] = str(e.retry_after)
+    return jsonify(body), status, headers
+
+def parse_similar(value):
+    """Number of similar confirmed objects requested per row, 0 for none"""
+    try:
+        k = int(value or 0)
+    except (TypeError, ValueError):
+        raise BadRequest('similar must be an integer')
+    if not 0 <= k <= MAX_NEIGHBORS:
+        raise BadRequest(f'similar must be between 0 and {MAX_NEIGHBORS}')
+    return k
+
+def parse_early_exit(value):
+    """Minimum confidence (0-1) of the early-exit mode, None when it is off.
 
-def make_serializable(obj):
-    if isinstance(obj, (np.integer, np.int64)):
-        return int(obj)
-    elif isinstance(obj, (np.floating, np.float64)):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    return obj
+    Given like the 'Porbability Score', in percent; 'true' stops rows as soon
+    as their label is certain.
+    """
+    if value is None or value == '':
+        return None
+    if str(value).lower() == 'true':
+        return 0.0
+    try:
+        bound = float(value)
+    except (TypeError, ValueError):
+        raise BadRequest('early_exit must be true or a score between 0 and 100')
+    if not 0 <= bound <= 100:
+        raise BadRequest('early_exit must be true or a score between 0 and 100')
+    return bound / 100
+
+def request_deadline():
+    return time.monotonic() + app.config['REQUEST_TIMEOUT_S']
+
+def instrumented(view):
+    """Record latency, rows, errors and the stage breakdown of a prediction endpoint"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        with metrics.trace() as current:
+            response = app.make_response(view(*args, **kwargs))
+        endpoint, state = request.endpoint, g._get_current_object()
+
+        def finish():
+            elapsed = time.perf_counter() - start
+            mission, rows = state.get('mission', ''), state.get('rows')
+            metrics.request_seconds.observe(elapsed, endpoint=endpoint, mission=mission,
+                                            status=response.status_code)
+            if rows is not None:
+                metrics.request_rows.observe(rows, endpoint=endpoint, mission=mission)
+            # A streamed response reports a failure in-band, after its 200
+            if response.status_code >= 400 or (response.is_streamed and current.failed_stage):
+                metrics.request_errors.inc(endpoint=endpoint, mission=mission,
+                                           stage=current.failed_stage or 'validation')
+
+            slow_ms = app.config['SLOW_REQUEST_MS']
+            if slow_ms and elapsed * 1000 >= slow_ms:
+                app.logger.warning('Slow request %s mission=%s rows=%s status=%s total=%.1fms %s',
+                                   endpoint, mission, rows, response.status_code,
+                                   elapsed * 1000, current.summary())
+
+        if response.is_streamed:
+            # The body is produced after the view returns, record the request once it is sent
+            response.call_on_close(finish)
+        else:
+            finish()
+        return response
+    return wrapper
+
+def format_results(model, df, columns, start=0):
+    """Assemble the per-row response dicts from the prediction columns"""
+    return rows_from_columns(result_columns(model, df, columns, start))
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -39,13 +194,17 @@ def health_check():
     return jsonify({'status': 'healthy', 'message': 'ExoQuest API is running'})
 
 @app.route('/api/predict', methods=['POST'])
+@instrumented
 def predict():
     try:
-        if 'file' not in request.files:
+        with metrics.stage('upload'):
+            files, form = request.files, request.form
+
+        if 'file' not in files:
             return jsonify({'error': 'No file uploaded'}), 400
         
-        file = request.files['file']
-        model_type = request.form.get('model')
+        file = files['file']
+        model_type = form.get('model')
 
         if not model_type:
             return jsonify({'error': 'Model type not provided'}), 400
@@ -54,95 +213,515 @@ def predict():
             return jsonify({'error': 'No file selected'}), 400
         
         if not allowed_file(file.filename):
-            return jsonify({'error': 'Only CSV files are allowed'}), 400
+            return jsonify({'error': 'Only CSV, Parquet and Feather files are allowed'}), 400
+
+        upload_fmt = ingest.upload_format(file.filename)
+        if not ingest.available(upload_fmt):
+            return jsonify({'error': f'{upload_fmt.capitalize()} uploads require pyarrow, which is not installed'}), 501
         
         if model_type not in models:
             return jsonify({'error': 'Invalid model type'}), 400
+
+        output_format = form.get('format', request.args.get('format', 'json'))
+        if output_format != 'json' and output_format not in response_formats.FORMATS:
+            return jsonify({'error': 'Format must be json, ' + ', '.join(response_formats.FORMATS)}), 400
+
+        if not response_formats.available(output_format):
+            return jsonify({'error': f'Format {output_format} requires pyarrow, which is not installed'}), 501
+
+        similar = parse_similar(form.get('similar', request.args.get('similar', 0)))
+        if similar and output_format != 'json':
+            return jsonify({'error': 'similar is only supported with the json format'}), 400
+
+        early_exit = parse_early_exit(form.get('early_exit', request.args.get('early_exit')))
+
+        if not models.is_available(model_type):
+            return jsonify({'error': f'Model {model_type} is not available'}), 503
+        g.mission = model_type
+
+        # A repeated upload is answered from its digest: 304 when the client
+        # already holds the response, the cached bytes otherwise. Responses
+        # are keyed by the release, model, preprocessing artifacts and input
+        # dtype, so a new model or scaler never serves old ones.
+        options = (upload_fmt, output_format, similar, early_exit)
+        with metrics.stage('cache', model_type):
+            digest = upload_digest(file.stream)
+            version = models.version(model_type)
+            if version is not None:
+                etag = response_key(digest, model_type, version, options)
+                if request.if_none_match.contains_weak(etag):
+                    responses.not_modified()
+                    return Response(status=304, headers={'ETag': f'"{etag}"'})
+                cached = responses.get(etag, model_type, version) if responses.enabled else None
+                if cached is not None:
+                    body, mimetype, g.rows = cached
+                    return Response(body, mimetype=mimetype, headers={'ETag': f'"{etag}"'})
+
+        def score():
+            with metrics.stage('load', model_type):
+                model = models.get(model_type)
+
+            if similar and model.similar is None:
+                raise ServiceUnavailable(f'No similarity index for {model_type}, build it with similarity.py')
+
+            # Read only the columns the model uses
+            with metrics.stage('parse', model_type):
+                df = ingest.read_upload(file.stream, upload_fmt, model)
+            # Bulk formats are encoded straight from the result arrays
+            return model, df, model.predict_columns(df, numeric=output_format != 'json', similar=similar,
+                                                    early_exit=early_exit)
+
+        # Parsing and scoring run on the bounded inference pool; a full queue
+        # is a 429, and the work is dropped if the client goes away first
+        environ = request.environ
+        model, df, columns = inference.run(score, deadline=request_deadline(), mission=model_type,
+                                           disconnected=lambda: client_disconnected(environ))
+        g.rows = len(df)
         
-        # Read CSV file
-        df = pd.read_csv(file)
-        
+        # Early-exit scores are lower bounds, which would skew the shadow comparison
+        shadow = early_exit is None
+
         # Get predictions
-        model = models[model_type]
-        predictions = model.predict(df)
-        
-        if model_type == 'tess':
-            star_ids = ('TIC ' + df['tid'].fillna('').astype(str)).tolist()
-            important_features = ['Planet radius', 'Transit duration', 'Planet orbital period']
-        elif model_type == 'kepler':
-            star_ids = ('KIC ' + df['kepid'].fillna('').astype(str)).tolist()
-            important_features = ['Planet orbital period', 'Planet Radius', 'Transit Depth']
-        elif model_type == 'k2':
-            star_ids = (df['hostname'].fillna('').astype(str)).tolist()
-            important_features = ['Planet radius', 'Transit duration', 'Planet orbital period']
+        if output_format != 'json':
+            columns = result_columns(model, df, columns)
+            if shadow:
+                models.shadow.offer(model_type, df, columns)
+            with metrics.stage('serialize', model_type):
+                body, mimetype = response_formats.encode(columns, output_format, {
+                    'success': True,
+                    'total': len(df),
+                    'model_used': model_type
+                })
+            response = Response(body, mimetype=mimetype)
         else:
-            star_ids = {f"KIC-{10000000 + idx * 12345}" for idx in range(df)}
-            important_features = ['orbital_period', 'planet_radius', 'transit_depth']
-        
+            if shadow:
+                models.shadow.offer(model_type, df, columns)
+            with metrics.stage('format', model_type):
+                results = format_results(model, df, columns)
 
+            with metrics.stage('serialize', model_type):
+                response = jsonify({
+                    'success': True,
+                    'results': results,
+                    'total': len(results),
+                    'model_used': model_type
+                })
 
-        # Format results
-        results = []
-        for idx, pred in enumerate(predictions):
-            results_dict = {'id': idx + 1,
-                'star_id': star_ids[idx],
-                'classification': pred['classification'],
-                'Porbability Score': pred['Porbability Score']}
-            for each in important_features:
-                results_dict[each] = pred.get(each, 'N/A')
-            results.append(results_dict)
-        
-        return jsonify({
-            'success': True,
-            'results': [ {k: make_serializable(v) for k, v in r.items()} for r in results ],
-            'total': len(results),
-            'model_used': model_type
-        })
+        # Keyed by the version of the model that actually scored the upload
+        version = model.response_version
+        etag = response_key(digest, model_type, version, options)
+        response.set_etag(etag)
+        if responses.enabled:
+            with metrics.stage('cache', model_type):
+                responses.put(etag, model_type, version, response.get_data(), response.mimetype, len(df))
+        return response
     
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/api/predict/rows', methods=['POST'])
+@instrumented
+def predict_rows():
+    """Score rows sent as JSON, batched together with concurrent requests"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+
+    model_type = payload.get('model')
+    records = payload.get('rows')
+    if records is None and 'row' in payload:
+        records = [payload['row']]
+
+    if not model_type:
+        return jsonify({'error': 'Model type not provided'}), 400
+
+    if model_type not in models:
+        return jsonify({'error': 'Invalid model type'}), 400
+
+    if not isinstance(records, list) or not records or not all(isinstance(r, dict) for r in records):
+        return jsonify({'error': 'Provide "row" as an object or "rows" as a non-empty list of objects'}), 400
+
+    if not models.is_available(model_type):
+        return jsonify({'error': f'Model {model_type} is not available'}), 503
+
+    g.mission, g.rows = model_type, len(records)
+    try:
+        inference.check()
+        with metrics.stage('batch', model_type):
+            df, columns = batcher.predict(model_type, records, timeout=app.config['REQUEST_TIMEOUT_S'])
+        with metrics.stage('format', model_type):
+            results = format_results(models.get(model_type), df, columns)
+        with metrics.stage('serialize', model_type):
+            return jsonify({
+                'success': True,
+                'results': results,
+                'total': len(results),
+                'model_used': model_type
+            })
+    except TimeoutError:
+        return error_response(DeadlineExceeded(retry_after=inference.retry_after()))
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/api/similar', methods=['POST'])
+@instrumented
+def similar_objects():
+    """The nearest confirmed objects of JSON rows in the mission's model feature space"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+
+    model_type = payload.get('model')
+    records = payload.get('rows')
+    if records is None and 'row' in payload:
+        records = [payload['row']]
+
+    if not model_type:
+        return jsonify({'error': 'Model type not provided'}), 400
+
+    if model_type not in models:
+        return jsonify({'error': 'Invalid model type'}), 400
+
+    if not isinstance(records, list) or not records or not all(isinstance(r, dict) for r in records):
+        return jsonify({'error': 'Provide "row" as an object or "rows" as a non-empty list of objects'}), 400
+
+    if not models.is_available(model_type):
+        return jsonify({'error': f'Model {model_type} is not available'}), 503
+
+    g.mission, g.rows = model_type, len(records)
+    try:
+        k = parse_similar(payload.get('k', 5)) or 5
+        with metrics.stage('load', model_type):
+            model = models.get(model_type)
+        if model.similar is None:
+            return jsonify({'error': f'No similarity index for {model_type}, build it with similarity.py'}), 503
+
+        def search():
+            df = pd.DataFrame.from_records(records)
+            with metrics.stage('preprocess', model_type):
+                X = model.preprocess_data(df)
+            return df, model.similar_to(X, k)
+
+        environ = request.environ
+        df, neighbors = inference.run(search, deadline=request_deadline(), mission=model_type,
+                                      disconnected=lambda: client_disconnected(environ))
+        with metrics.stage('format', model_type):
+            results = format_results(model, df, {'similar': neighbors})
+        with metrics.stage('serialize', model_type):
+            return jsonify({
+                'success': True,
+                'results': results,
+                'total': len(results),
+                'model_used': model_type,
+                'catalog_size': model.similar.size
+            })
+    except Exception as e:
+        return error_response(e)
+
+def stream_results(model, reader, output_format, trace):
+    """Yield encoded results for each chunk of rows read from the upload.
+
+    The stages of every chunk are recorded into the request's ``trace``.
+    """
+    mission = model.model_type
+    start = 0
+    try:
+        while True:
+            with metrics.attach(trace):
+                with metrics.stage('parse', mission):
+                    chunk = next(reader, None)
+                if chunk is None:
+                    break
+                chunk = chunk.reset_index(drop=True)
+                # Later chunks wait for a free inference slot rather than fail mid-stream
+                columns = inference.run(model.predict_columns, chunk, block=True, mission=mission)
+                with metrics.stage('format', mission):
+                    rows = format_results(model, chunk, columns, start)
+                start += len(chunk)
+                g.rows = start
+                with metrics.stage('serialize', mission):
+                    if output_format == 'csv':
+                        buffer = io.StringIO()
+                        writer = csv.DictWriter(buffer, fieldnames=list(rows[0]) if rows else [])
+                        if start == len(chunk) and rows:
+                            writer.writeheader()
+                        writer.writerows(rows)
+                        body = buffer.getvalue()
+                    else:
+                        body = ''.join(json.dumps(row) + '\n' for row in rows)
+            yield body
+    except Exception as e:
+        if trace is not None and trace.failed_stage is None:
+            # Raised by the inference pool itself (overload, deadline)
+            trace.failed_stage = 'inference'
+        # The status line has already been sent, report the failure in-band
+        if output_format == 'csv':
+            yield f'# error after {start} rows: {e}\n'
+        else:
+            yield json.dumps({'error': str(e), 'rows_processed': start}) + '\n'
+
+@app.route('/api/predict/stream', methods=['POST'])
+@instrumented
+def predict_stream():
+    """Score a raw CSV request body chunk by chunk, streaming results back"""
+    model_type = request.args.get('model')
+    output_format = request.args.get('format', 'ndjson')
+
+    if not model_type:
+        return jsonify({'error': 'Model type not provided'}), 400
+
+    if model_type not in models:
+        return jsonify({'error': 'Invalid model type'}), 400
+
+    if output_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Format must be ndjson or csv'}), 400
+
+    if not models.is_available(model_type):
+        return jsonify({'error': f'Model {model_type} is not available'}), 503
+    g.mission = model_type
+
+    try:
+        chunk_rows = int(request.args.get('chunksize', app.config['STREAM_CHUNK_ROWS']))
+    except ValueError:
+        return jsonify({'error': 'chunksize must be an integer'}), 400
+    if chunk_rows <= 0:
+        return jsonify({'error': 'chunksize must be positive'}), 400
+
+    try:
+        inference.check()
+    except HTTPException as e:
+        return error_response(e)
+
+    with metrics.stage('load', model_type):
+        model = models.get(model_type)
+    try:
+        with metrics.stage('parse', model_type):
+            reader = pd.read_csv(request.stream, chunksize=chunk_rows, **ingest.csv_options(model))
+            # The body cannot be rewound, so check the columns of the first chunk
+            first = next(reader, None)
+        if first is None:
+            return jsonify({'error': 'Empty upload'}), 400
+        ingest.select_columns(model, first.columns)
+    except pd.errors.EmptyDataError:
+        return jsonify({'error': 'Empty upload'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    reader = itertools.chain([first], reader)
+
+    mimetype = 'text/csv' if output_format == 'csv' else 'application/x-ndjson'
+    results = stream_results(model, reader, output_format, metrics.current_trace())
+    return Response(stream_with_context(results), mimetype=mimetype)
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a CSV for background scoring and return the job id"""
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    file = request.files['file']
+    model_type = request.form.get('model')
+
+    if not model_type:
+        return jsonify({'error': 'Model type not provided'}), 400
+
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+
+    # Jobs read their input in chunks, which only CSV supports
+    if ingest.upload_format(file.filename) != 'csv':
+        return jsonify({'error': 'Only CSV files are allowed'}), 400
+
+    if model_type not in models:
+        return jsonify({'error': 'Invalid model type'}), 400
+
+    if not models.is_available(model_type):
+        return jsonify({'error': f'Model {model_type} is not available'}), 503
+
+    try:
+        status = jobs.submit(file, model_type)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    return jsonify(status), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        return jsonify(jobs.status(job_id))
+    except KeyError:
+        return jsonify({'error': 'Job not found'}), 404
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def get_job_results(job_id):
+    try:
+        status = jobs.status(job_id)
+    except KeyError:
+        return jsonify({'error': 'Job not found'}), 404
+
+    if status['status'] != 'done':
+        return jsonify({'error': f"Job is {status['status']}", 'status': status}), 409
+
+    return send_file(jobs.results_path(job_id), mimetype='text/csv', as_attachment=True,
+                     download_name=f'exoquest_{job_id}.csv')
+
+def _loaded_model_stats():
+    return [(mission, stats) for mission, stats in models.stats()['missions'].items() if stats['loaded']]
+
+metrics.registry.register(metrics.Gauge(
+    'exoquest_model_loaded', 'Whether a mission model is loaded in this process', ('mission',),
+    lambda: [((m,), int(s['loaded'])) for m, s in models.stats()['missions'].items()]))
+metrics.registry.register(metrics.Gauge(
+    'exoquest_model_resident_bytes', 'Resident size attributed to each loaded model', ('mission',),
+    lambda: [((m,), s['size_bytes']) for m, s in _loaded_model_stats()]))
+metrics.registry.register(metrics.Gauge(
+    'exoquest_cache_lookups_total', 'Prediction cache lookups by outcome', ('mission', 'result'),
+    lambda: [((m, result), s['cache'][key]) for m, s in _loaded_model_stats() if s['cache']
+             for result, key in (('hit', 'hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses'))],
+    kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'exoquest_cache_entries', 'Rows held in the in-memory prediction cache', ('mission',),
+    lambda: [((m,), s['cache']['entries']) for m, s in _loaded_model_stats() if s['cache']]))
+metrics.registry.register(metrics.Gauge(
+    'exoquest_batcher_pending_requests', 'Requests waiting in the micro-batcher queue', ('mission',),
+    lambda: [((m,), n) for m, n in batcher.stats()['pending'].items()]))
+metrics.registry.register(metrics.Gauge(
+    'exoquest_batcher_batches_total', 'Batches scored by the micro-batcher', (),
+    lambda: [((), batcher.stats()['batches'])], kind='counter'))
+
+metrics.registry.register(metrics.Gauge(
+    'exoquest_shadow_rows_total', 'Rows scored by shadow candidates, by agreement with the live model',
+    ('mission', 'release', 'result'),
+    lambda: [((m, s['release'], result), n) for m, s in models.stats()['shadow']['missions'].items()
+             for result, n in (('agreed', s['agreed_rows']), ('disagreed', s['rows'] - s['agreed_rows']))],
+    kind='counter'))
+
+metrics.registry.register(metrics.Gauge(
+    'exoquest_inference_running', 'Calls running on the inference pool', (),
+    lambda: [((), inference.stats()['running'])]))
+metrics.registry.register(metrics.Gauge(
+    'exoquest_inference_queued', 'Calls waiting for an inference thread', (),
+    lambda: [((), inference.stats()['queued'])]))
+metrics.registry.register(metrics.Gauge(
+    'exoquest_inference_calls_total', 'Inference pool calls by outcome', ('result',),
+    lambda: [((result,), n) for result, n in inference.stats().items()
+             if result in ('completed', 'rejected', 'cancelled', 'expired')],
+    kind='counter'))
+
+metrics.registry.register(metrics.Gauge(
+    'exoquest_response_cache_lookups_total', 'Whole-upload response cache lookups by outcome', ('result',),
+    lambda: [((result,), responses.stats()[key]) for result, key in
+             (('hit', 'hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses'), ('not_modified', 'not_modified'))],
+    kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'exoquest_response_cache_bytes', 'Size of the response bodies held in memory', (),
+    lambda: [((), responses.stats()['size_bytes'])]))
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/models', methods=['GET'])
 def get_models():
     model_info = []
-    for name, model in models.items():
+    for name in models.missions:
+        if models.is_loaded(name):
+            status = 'ready'
+        elif models.is_available(name):
+            status = 'available'
+        else:
+            status = 'unavailable'
         model_info.append({
             'name': name,
-            'accuracy': model.get_accuracy(),
-            'status': 'ready'
+            'accuracy': training_accuracy(name, model_store.active_dir(name)),
+            'status': status
         })
     return jsonify(model_info)
 
+@app.route('/api/models/stats', methods=['GET'])
+def get_model_stats():
+    return jsonify(dict(models.stats(), responses=responses.stats()))
+
+def admin_only(view):
+    """Require the EXOQUEST_ADMIN_TOKEN bearer token; disabled when it is unset"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = app.config['ADMIN_TOKEN']
+        if not token:
+            return jsonify({'error': 'Admin endpoints are disabled, set EXOQUEST_ADMIN_TOKEN'}), 403
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return jsonify({'error': 'Invalid admin token'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def release_info(mission):
+    return {
+        'releases': model_store.list_releases(mission),
+        'current': model_store.current_release(mission),
+        'shadow': model_store.shadow_config(mission)
+    }
+
+@app.route('/api/models/<mission>/releases', methods=['GET'])
+def get_releases(mission):
+    if mission not in models:
+        return jsonify({'error': 'Invalid model type'}), 400
+    return jsonify(release_info(mission))
+
+@app.route('/api/models/<mission>/activate', methods=['POST'])
+@admin_only
+def activate_release(mission):
+    """Make a release current and swap it in; other workers follow on their next poll"""
+    payload = request.get_json(silent=True) or {}
+    if mission not in models:
+        return jsonify({'error': 'Invalid model type'}), 400
+    try:
+        model_store.activate_release(mission, payload.get('release'))
+    except KeyError:
+        return jsonify({'error': 'Release not found'}), 404
+    models.reload(mission)
+    return jsonify(release_info(mission)), 202
+
+@app.route('/api/models/<mission>/shadow', methods=['PUT', 'DELETE'])
+@admin_only
+def configure_shadow(mission):
+    """Start or stop scoring a sample of live traffic with a candidate release"""
+    if mission not in models:
+        return jsonify({'error': 'Invalid model type'}), 400
+    if request.method == 'DELETE':
+        model_store.clear_shadow(mission)
+        models.shadow.clear(mission)
+        return jsonify(release_info(mission))
+
+    payload = request.get_json(silent=True) or {}
+    try:
+        sample_rate = float(payload.get('sample_rate', 0.1))
+        model_store.set_shadow(mission, payload.get('release'), sample_rate)
+    except KeyError:
+        return jsonify({'error': 'Release not found'}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    models.start_shadow(mission, payload['release'], sample_rate)
+    return jsonify(release_info(mission)), 202
+
 @app.route('/api/dashboard/stats', methods=['GET'])
 def get_dashboard_stats():
+    """Aggregates of everything scored so far, kept up to date as rows are scored"""
     try:
-        stats = {
-            'training_accuracy': {
-                'kepler': [92.1, 93.5, 94.8, 95.2, 96.1, 96.8],
-                'k2': [90.5, 91.8, 93.2, 94.1, 94.9, 95.3],
-                'tess': [94.2, 95.1, 96.3, 96.8, 97.0, 97.2]
-            },
-            'testing_accuracy': {
-                'kepler': [91.5, 92.8, 93.9, 94.5, 95.3, 96.2],
-                'k2': [89.8, 90.9, 92.1, 93.2, 94.0, 94.8],
-                'tess': [93.5, 94.3, 95.5, 96.0, 96.5, 96.9]
-            },
-            'classification_distribution': [
-                {'name': 'Confirmed', 'value': 5234},
-                {'name': 'Candidate', 'value': 8956},
-                {'name': 'False Positive', 'value': 3421}
-            ],
-            'feature_importance': [
-                {'feature': 'Transit Depth', 'importance': 0.28},
-                {'feature': 'Orbital Period', 'importance': 0.24},
-                {'feature': 'Planet Radius', 'importance': 0.19},
-                {'feature': 'Transit Duration', 'importance': 0.15},
-                {'feature': 'Equilibrium Temp', 'importance': 0.14}
-            ]
-        }
-        return jsonify(stats)
+        missions = dashboard_stats.snapshot(models.missions)
+        totals = {}
+        for name, mission in missions.items():
+            mission['accuracy'] = training_accuracy(name, model_store.active_dir(name))
+            # Importances come from the loaded ensemble, computed once per model
+            mission['feature_importance'] = (models.get(name).feature_importances()
+                                             if models.is_loaded(name) else None)
+            for label, count in mission['classification_distribution'].items():
+                totals[label] = totals.get(label, 0) + count
+        return jsonify({
+            'classification_distribution': [{'name': label.title(), 'value': count}
+                                             for label, count in sorted(totals.items())],
+            'missions': missions
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    fail_interrupted(jobs.folder)
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,286 @@
+"""
+Score large catalogs offline, without going through the web server.
+
+Each input (CSV, Parquet or Feather) is cut into shards: byte ranges of about
+``--shard-mb`` ending on a line break for CSV, row groups for Parquet, the
+whole file for Feather. The shards are scored by a process pool with one
+ExoplanetModel per worker and every finished shard is written as its own part
+file, ``<output-dir>/<input name>/part-00000.parquet`` (or ``.csv``), in input
+order. ``_checkpoint.json`` in the same directory records the finished
+shards, so re-running the same command after an interruption only scores the
+shards that are missing. ``--merge`` concatenates the parts into one file at
+the end.
+
+CSV shards assume no quoted field spans several lines, which holds for the
+NASA archive exports; lines starting with '#' before the header are skipped.
+
+Usage:
+    python batch_score.py kepler data/kepler_full.csv --output-dir scored
+    python batch_score.py tess archive/*.parquet --output-dir scored --format csv --workers 8
+    python batch_score.py k2 data/k2.csv --output-dir scored --merge
+"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import ingest
+import model_store
+from model import ExoplanetModel, model_version
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+MISSIONS = ['kepler', 'k2', 'tess']
+FORMATS = ['parquet', 'csv']
+
+# Per-process model of the pool workers
+_worker_model = None
+
+
+def _init_worker(mission, threads):
+    global _worker_model
+    _worker_model = ExoplanetModel(mission, model_store.active_dir(mission))
+    # Every row is new, so the prediction cache would only cost memory
+    _worker_model.cache = None
+    # Leave the cores to the other workers rather than oversubscribe them
+    estimator = getattr(_worker_model.model, 'native', _worker_model.model)
+    if 'n_jobs' in getattr(estimator, 'get_params', dict)():
+        estimator.set_params(n_jobs=threads)
+
+
+def csv_shards(path, shard_bytes):
+    """(header line, [(start, end)]) byte ranges that each end on a line break"""
+    with open(path, 'rb') as f:
+        header = f.readline()
+        while header.startswith(b'#'):
+            header = f.readline()
+        offsets = [f.tell()]
+        size = os.fstat(f.fileno()).st_size
+        while offsets[-1] < size:
+            f.seek(min(offsets[-1] + shard_bytes, size))
+            if f.tell() < size:
+                f.readline()
+            offsets.append(f.tell())
+    return header, list(zip(offsets, offsets[1:]))
+
+
+def plan_shards(path, upload_fmt, shard_bytes):
+    """The shards of one input, as arguments for score_shard"""
+    if upload_fmt == 'csv':
+        header, ranges = csv_shards(path, shard_bytes)
+        return [('csv', header, start, end) for start, end in ranges]
+    if upload_fmt == 'parquet':
+        return [('parquet', None, group, None) for group in range(pq.ParquetFile(path).num_row_groups)]
+    return [('feather', None, None, None)]
+
+
+def read_shard(model, path, shard):
+    kind, header, start, end = shard
+    if kind == 'csv':
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return ingest.read_upload(io.BytesIO(header + f.read(end - start)), 'csv', model)
+    if kind == 'parquet':
+        return ingest.read_row_group(pq.ParquetFile(path), start, model)
+    with open(path, 'rb') as f:
+        return ingest.read_upload(f, 'feather', model)
+
+
+def write_atomic(df, path, output_format):
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    if output_format == 'parquet':
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def score_shard(path, shard, part_path, output_format):
+    """Score one shard in a pool worker and write its part file; returns (rows, seconds)"""
+    start = time.perf_counter()
+    model = _worker_model
+    df = read_shard(model, path, shard)
+    columns = model.predict_columns(df, numeric=True)
+    write_atomic(pd.DataFrame({'star_id': model.star_ids(df), **columns}), part_path, output_format)
+    return len(df), time.perf_counter() - start
+
+
+def fingerprint(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class Checkpoint:
+    """Finished shards of one input, kept in <output>/_checkpoint.json
+
+    Only a folder that is empty, missing or holds a checkpoint is used, and
+    ``restart`` only removes the part files and the checkpoint in it.
+    """
+
+    def __init__(self, folder, identity, n_shards, restart=False):
+        self.path = os.path.join(folder, '_checkpoint.json')
+        self.state = None
+        if os.path.exists(self.path):
+            if restart:
+                self._discard(folder)
+            else:
+                with open(self.path) as f:
+                    state = json.load(f)
+                if state['identity'] != identity or state['shards'] != n_shards:
+                    raise ValueError(f'{folder} holds results of another input, model or shard size; '
+                                     'pass --restart to discard them')
+                self.state = state
+        elif os.path.isdir(folder) and os.listdir(folder):
+            raise ValueError(f'{folder} is not empty and holds no batch_score checkpoint; '
+                             'choose another --output-dir')
+        if self.state is None:
+            os.makedirs(folder, exist_ok=True)
+            self.state = {'identity': identity, 'shards': n_shards, 'done': {}}
+            self._save()
+
+    def _discard(self, folder):
+        for name in os.listdir(folder):
+            if name.startswith('part-'):
+                os.remove(os.path.join(folder, name))
+        os.remove(self.path)
+
+    @property
+    def done(self):
+        return {int(shard) for shard in self.state['done']}
+
+    @property
+    def rows(self):
+        return sum(self.state['done'].values())
+
+    def mark(self, shard, rows):
+        self.state['done'][str(shard)] = rows
+        self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+
+def merge_parts(part_paths, target, output_format):
+    """Concatenate the part files, in order, into one file"""
+    tmp_path = target + '.tmp'
+    if output_format == 'parquet':
+        writer = None
+        for part in part_paths:
+            table = pq.read_table(part)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+    else:
+        with open(tmp_path, 'wb') as out:
+            for i, part in enumerate(part_paths):
+                with open(part, 'rb') as src:
+                    if i:
+                        src.readline()
+                    shutil.copyfileobj(src, out)
+    os.replace(tmp_path, target)
+
+
+def output_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score catalogs offline with a process pool')
+    parser.add_argument('mission', choices=MISSIONS)
+    parser.add_argument('inputs', nargs='+', help='CSV, Parquet or Feather files')
+    parser.add_argument('--output-dir', required=True)
+    parser.add_argument('--format', choices=FORMATS, default='parquet' if pq is not None else 'csv')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads-per-worker', type=int, default=1,
+                        help='LightGBM threads in each worker (default 1)')
+    parser.add_argument('--shard-mb', type=float, default=64, help='CSV shard size (default 64)')
+    parser.add_argument('--merge', action='store_true', help='also write one <input name>.<format> file')
+    parser.add_argument('--restart', action='store_true', help='discard earlier results and start over')
+    args = parser.parse_args(argv)
+
+    formats = {path: ingest.upload_format(path) for path in args.inputs}
+    for path, upload_fmt in formats.items():
+        if upload_fmt is None:
+            parser.error(f'{path}: not a CSV, Parquet or Feather file')
+        if not ingest.available(upload_fmt) or (args.format == 'parquet' and pq is None):
+            parser.error('Parquet and Feather need pyarrow, which is not installed')
+    if len({output_name(path) for path in args.inputs}) < len(args.inputs):
+        parser.error('inputs must have distinct file names')
+
+    version = model_version(args.mission, model_store.active_dir(args.mission))
+    shard_bytes = int(args.shard_mb * 1024 * 1024)
+
+    work, checkpoints, parts = [], {}, {}
+    for path in args.inputs:
+        folder = os.path.join(args.output_dir, output_name(path))
+        shards = plan_shards(path, formats[path], shard_bytes)
+        identity = {'input': fingerprint(path), 'mission': args.mission, 'model_version': version,
+                    'format': args.format, 'shard_bytes': shard_bytes}
+        try:
+            checkpoint = checkpoints[path] = Checkpoint(folder, identity, len(shards), args.restart)
+        except ValueError as e:
+            parser.error(str(e))
+        parts[path] = [os.path.join(folder, f'part-{i:05d}.{args.format}') for i in range(len(shards))]
+        work += [(path, i, shard) for i, shard in enumerate(shards) if i not in checkpoint.done]
+        if checkpoint.done:
+            print(f'{path}: resuming, {len(checkpoint.done)}/{len(shards)} shards already scored')
+
+    total_shards = len(work)
+    print(f'Scoring {total_shards} shard(s) of {len(args.inputs)} input(s) with {args.workers} worker(s), '
+          f'{args.mission} model {version}')
+    start = time.perf_counter()
+    rows_done = shards_done = failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(args.mission, args.threads_per_worker)) as pool:
+        futures = {pool.submit(score_shard, path, shard, parts[path][i], args.format): (path, i)
+                   for path, i, shard in work}
+        for future in as_completed(futures):
+            path, i = futures[future]
+            try:
+                rows, seconds = future.result()
+            except Exception as e:
+                failed += 1
+                print(f'{path} shard {i} failed: {e}')
+                continue
+            checkpoints[path].mark(i, rows)
+            rows_done += rows
+            shards_done += 1
+            elapsed = time.perf_counter() - start
+            print(f'[{shards_done}/{total_shards}] {os.path.basename(path)} shard {i}: {rows} rows in '
+                  f'{seconds:.1f}s, {rows_done / elapsed:,.0f} rows/s overall')
+
+    elapsed = time.perf_counter() - start
+    print(f'Scored {rows_done:,} rows in {elapsed:.1f}s '
+          f'({rows_done / elapsed if elapsed else 0:,.0f} rows/s)')
+    if failed:
+        print(f'{failed} shard(s) failed; run the same command again to retry them')
+        return 1
+
+    if args.merge:
+        for path in args.inputs:
+            target = os.path.join(args.output_dir, f'{output_name(path)}.{args.format}')
+            if not parts[path]:
+                print(f'{path}: no rows, nothing to merge')
+                continue
+            merge_parts(parts[path], target, args.format)
+            print(f'{target}: {checkpoints[path].rows:,} rows')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import pandas as pd
+
+import ingest
+
+
+class _Request:
+    __slots__ = ('records', 'columns', 'future')
+
+    def __init__(self, records):
+        self.records = records
+        # Every key of any of its rows, as a DataFrame of the request alone would have
+        self.columns = frozenset(key for record in records for key in record)
+        self.future = Future()
+
+
+class MicroBatcher:
+    """Coalesces concurrent small prediction requests into one batch per mission.
+
+    Each mission has a background thread that takes the first waiting
+    request, keeps collecting requests until ``max_batch_rows`` rows are
+    queued or ``max_wait_ms`` has passed, and scores them all with a single
+    ``predict_columns`` call. Rows are projected to the columns the mission
+    reads (its features and id column), as uploads are, and only requests
+    with the same projected columns are scored together: merging never turns
+    a column a request left out into imputed values, while fields the model
+    ignores do not keep requests apart. A request missing a required column
+    fails with MissingColumnsError as it would alone. Every caller receives
+    the result columns for its own rows only. ``run(fn, *args)``, when given,
+    runs the scoring call, e.g. on an InferenceExecutor; a request that times
+    out while still queued is dropped from the batch.
+    """
+
+    def __init__(self, get_model, max_batch_rows=256, max_wait_ms=5, run=None):
+        self.get_model = get_model
+        self.run = run or (lambda fn, *args: fn(*args))
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000.0
+        self._queues = {}
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'rows': 0, 'batches': 0}
+
+    def _queue(self, mission):
+        with self._lock:
+            q = self._queues.get(mission)
+            if q is None:
+                q = self._queues[mission] = queue.Queue()
+                threading.Thread(target=self._run, args=(mission, q), daemon=True,
+                                 name=f'batcher-{mission}').start()
+            return q
+
+    def submit(self, mission, records):
+        """Queue a list of row dicts; returns a Future of (DataFrame, columns)"""
+        request = _Request(records)
+        self._queue(mission).put(request)
+        return request.future
+
+    def predict(self, mission, records, timeout=30):
+        future = self.submit(mission, records)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise
+
+    def _collect(self, q):
+        batch = []
+        while not batch:
+            request = q.get()
+            if request.future.set_running_or_notify_cancel():
+                batch.append(request)
+        rows = len(batch[0].records)
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            batch.append(request)
+            rows += len(request.records)
+        return batch
+
+    def _run(self, mission, q):
+        while True:
+            batch = self._collect(q)
+            try:
+                self._score(mission, batch)
+            except Exception:
+                # One bad request should not fail its neighbours; score each
+                # separately so the error reaches only the caller that sent it
+                for request in batch:
+                    if not request.future.done():
+                        try:
+                            self._score(mission, [request])
+                        except Exception as e:
+                            request.future.set_exception(e)
+
+    def _score(self, mission, batch):
+        model = self.get_model(mission)
+        required = ingest.required_columns(model)
+        read = list(ingest.column_dtypes(model))
+        groups = {}
+        for request in batch:
+            missing = [col for col in required if col not in request.columns]
+            if missing:
+                request.future.set_exception(ingest.MissingColumnsError(missing))
+            else:
+                columns = tuple(col for col in read if col in request.columns)
+                groups.setdefault(columns, []).append(request)
+        for columns, group in groups.items():
+            self._score_group(model, group, columns)
+
+    def _score_group(self, model, batch, columns):
+        records = [record for request in batch for record in request.records]
+        df = pd.DataFrame.from_records(records, columns=list(columns))
+        results = self.run(model.predict_columns, df)
+
+        with self._lock:
+            self.counters['requests'] += len(batch)
+            self.counters['rows'] += len(records)
+            self.counters['batches'] += 1
+
+        start = 0
+        for request in batch:
+            end = start + len(request.records)
+            part = df.iloc[start:end].reset_index(drop=True)
+            request.future.set_result((part, {name: values[start:end] for name, values in results.items()}))
+            start = end
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['pending'] = {m: q.qsize() for m, q in self._queues.items()}
+        stats['mean_batch_rows'] = round(stats['rows'] / stats['batches'], 2) if stats['batches'] else None
+        return stats
@@ -0,0 +1,209 @@
+"""
+Benchmark the ExoQuest serving path on synthetic catalogs.
+
+For each mission a synthetic catalog is generated from the model's own
+column lists and fitted preprocessing parameters, then every stage of a
+/api/predict request is timed separately: CSV parse, preprocessing, ensemble
+inference, result formatting and JSON serialization.
+
+Usage:
+    python benchmark.py                                  # all missions, 1 to 1M rows
+    python benchmark.py --missions tess --sizes 1 100 10000
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json   # exit 1 on regression
+"""
+
+import argparse
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from flask import Flask
+
+import ingest
+from model import ExoplanetModel, model_available, result_columns, rows_from_columns
+
+MISSIONS = ['kepler', 'k2', 'tess']
+DEFAULT_SIZES = [1, 10, 100, 1000, 10000, 100000, 1000000]
+STAGES = ['parse', 'preprocess', 'inference', 'format', 'serialize']
+
+# The JSON provider /api/predict serializes with, from a bare app: importing
+# the server would start its pools and caches and record dashboard stats
+_json = Flask(__name__).json
+
+
+def generate_catalog(model, n_rows, nan_rate=0.05, seed=0):
+    """Generate a catalog shaped like the mission's NASA archive export.
+
+    Numeric columns are drawn from a normal distribution with the training
+    mean and standard deviation seen by the scaler (mapped back through
+    expm1 for log-transformed columns), categorical columns from the
+    encoder's categories, and each value is blanked out with ``nan_rate``.
+    """
+    rng = np.random.default_rng(seed)
+    plan = model.plan
+    data = {}
+
+    ids = rng.integers(1000000, 99999999, n_rows)
+    data[model.id_column] = ids if model.id_prefix else np.array([f'EXO-{i}' for i in ids], dtype=object)
+
+    log_index = set(plan.log_index.tolist())
+    for j, col in enumerate(plan.num_cols):
+        mean, scale = plan.mean[j], plan.scale[j]
+        if not np.isfinite(mean):
+            mean = plan.medians[j] if np.isfinite(plan.medians[j]) else 0.0
+        if not np.isfinite(scale) or scale <= 0:
+            scale = 1.0
+        values = rng.normal(mean, scale, n_rows)
+        if j in log_index:
+            values = np.expm1(np.clip(values, None, 50))
+        values[rng.random(n_rows) < nan_rate] = np.nan
+        data[col] = values
+
+    for col, (known, _, missing) in zip(plan.cat_cols, plan.categories):
+        values = rng.choice(np.asarray(known, dtype=object), n_rows)
+        blank = rng.random(n_rows) < (nan_rate if missing is not None else 0)
+        values[blank] = None
+        data[col] = values
+
+    return pd.DataFrame(data)
+
+
+def _measure(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def run_once(model, csv_bytes):
+    """Time each stage of one request; returns {stage: seconds}"""
+    timings = {}
+    df, timings['parse'] = _measure(lambda: ingest.read_upload(io.BytesIO(csv_bytes), 'csv', model))
+    X, timings['preprocess'] = _measure(lambda: model.preprocess_data(df))
+    proba, timings['inference'] = _measure(lambda: model.model.predict_proba(X))
+
+    def format_results():
+        return rows_from_columns(result_columns(model, df, model.format_columns(df, proba)))
+
+    results, timings['format'] = _measure(format_results)
+    _, timings['serialize'] = _measure(lambda: _json.dumps({
+        'success': True, 'results': results, 'total': len(results), 'model_used': model.model_type
+    }))
+    return timings
+
+
+def peak_memory(model, csv_bytes):
+    """Peak traced allocation, in MB, of one full request"""
+    tracemalloc.start()
+    try:
+        run_once(model, csv_bytes)
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_mission(mission, sizes, nan_rate, min_time, max_repeats):
+    model = ExoplanetModel(mission)
+    # Time the ensemble itself, not the prediction cache
+    model.cache = None
+
+    report = {}
+    for size in sizes:
+        df = generate_catalog(model, size, nan_rate=nan_rate, seed=size)
+        csv_bytes = df.to_csv(index=False).encode()
+        del df
+
+        runs = []
+        start = time.perf_counter()
+        while len(runs) < max_repeats and (not runs or time.perf_counter() - start < min_time):
+            runs.append(run_once(model, csv_bytes))
+
+        entry = {'rows': size, 'repeats': len(runs), 'stages': {}}
+        for stage in STAGES + ['total']:
+            if stage == 'total':
+                samples = np.array([sum(r.values()) for r in runs])
+            else:
+                samples = np.array([r[stage] for r in runs])
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            entry['stages'][stage] = {
+                'p50_ms': round(p50 * 1000, 3),
+                'p95_ms': round(p95 * 1000, 3),
+                'p99_ms': round(p99 * 1000, 3),
+                'rows_per_s': round(size / p50, 1) if p50 > 0 else None
+            }
+        entry['peak_mb'] = round(peak_memory(model, csv_bytes), 2)
+        report[str(size)] = entry
+
+        total = entry['stages']['total']
+        print(f"{mission:>6} {size:>8} rows  p50 {total['p50_ms']:>10.2f}ms  p99 {total['p99_ms']:>10.2f}ms  "
+              f"{total['rows_per_s'] or 0:>12.0f} rows/s  peak {entry['peak_mb']:>8.1f}MB  "
+              + '  '.join(f"{s} {entry['stages'][s]['p50_ms']:.2f}" for s in STAGES))
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """List the stages whose p50 latency regressed beyond the tolerance"""
+    regressions = []
+    for mission, sizes in baseline.get('results', {}).items():
+        for size, entry in sizes.items():
+            current = report.get(mission, {}).get(size)
+            if current is None:
+                continue
+            for stage, stats in entry['stages'].items():
+                before = stats['p50_ms']
+                after = current['stages'].get(stage, {}).get('p50_ms')
+                # Ignore sub-millisecond stages, their noise dwarfs any change
+                if after is None or before < 1.0:
+                    continue
+                if after > before * (1 + tolerance):
+                    regressions.append(f'{mission} {size} rows {stage}: {before:.2f}ms -> {after:.2f}ms')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ExoQuest serving path')
+    parser.add_argument('--missions', nargs='+', default=MISSIONS, choices=MISSIONS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--nan-rate', type=float, default=0.05)
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help='keep repeating a size for at least this many seconds')
+    parser.add_argument('--max-repeats', type=int, default=50)
+    parser.add_argument('--output', help='write the report as JSON')
+    parser.add_argument('--save-baseline', help='write the report as a baseline file')
+    parser.add_argument('--baseline', help='fail when a stage regresses against this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative p50 slowdown before failing (default 0.2)')
+    args = parser.parse_args(argv)
+
+    report = {}
+    for mission in args.missions:
+        if not model_available(mission):
+            print(f'Skipping {mission} - no model file')
+            continue
+        report[mission] = benchmark_mission(mission, args.sizes, args.nan_rate,
+                                            args.min_time, args.max_repeats)
+
+    document = {'created_at': time.time(), 'results': report}
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(document, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print('\nRegressions against baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print('\nNo regressions against baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
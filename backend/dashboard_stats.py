@@ -0,0 +1,173 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# Confidence ('Porbability Score') histogram: 20 bins of 5 points over 0-100
+CONFIDENCE_BIN_WIDTH = 5
+CONFIDENCE_BINS = 100 // CONFIDENCE_BIN_WIDTH
+
+# Rows scored per time window: name -> (bucket seconds, buckets kept)
+WINDOWS = {
+    'minute': (60, 60),
+    'hour': (3600, 48),
+    'day': (86400, 30),
+}
+
+
+class DashboardStats:
+    """Running per-mission aggregates of everything the server has scored.
+
+    ``record`` folds one scored batch into the class counts, the confidence
+    histogram of each class and the rows-per-window counters; its cost depends
+    on the batch, never on how much was scored before, and ``snapshot`` reads
+    a fixed number of counters. Updates accumulate in memory and are added to
+    a SQLite file at most every ``flush_interval`` seconds, so the aggregates
+    survive restarts and combine the counts of every server process. Without
+    ``path`` they live in memory only.
+    """
+
+    def __init__(self, path=None, flush_interval=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._counters = {}
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._flushed_at = time.monotonic()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # A throwaway connection, so a process forked after this (gunicorn
+            # preload_app) does not inherit an open one
+            db = sqlite3.connect(path, timeout=5)
+            with db:
+                db.execute('CREATE TABLE IF NOT EXISTS counters (mission TEXT, name TEXT, key TEXT, '
+                           'value INTEGER, PRIMARY KEY (mission, name, key))')
+                db.execute('CREATE TABLE IF NOT EXISTS windows (mission TEXT, window TEXT, bucket INTEGER, '
+                           'rows INTEGER, PRIMARY KEY (mission, window, bucket))')
+            db.close()
+            atexit.register(self.flush)
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    def record(self, mission, labels, scores, now=None):
+        """Add a batch of predicted labels and their 'Porbability Score' values"""
+        n = len(labels)
+        if not n:
+            return
+        now = time.time() if now is None else now
+        labels = np.asarray(labels).astype(str)
+        bins = np.clip(np.asarray(scores, dtype=float) // CONFIDENCE_BIN_WIDTH, 0, CONFIDENCE_BINS - 1)
+        bins = bins.astype(np.intp)
+        classes, codes = np.unique(labels, return_inverse=True)
+        # One bincount over (class, bin) pairs builds every class histogram at once
+        histograms = np.bincount(codes * CONFIDENCE_BINS + bins,
+                                 minlength=len(classes) * CONFIDENCE_BINS).reshape(len(classes), -1)
+
+        with self._lock:
+            counters = self._counters
+            self._add(counters, (mission, 'rows', ''), n)
+            self._add(counters, (mission, 'requests', ''), 1)
+            for label, histogram in zip(classes, histograms):
+                self._add(counters, (mission, 'class', label), int(histogram.sum()))
+                for b in np.flatnonzero(histogram):
+                    self._add(counters, (mission, 'confidence', f'{label}|{b}'), int(histogram[b]))
+            for window, (seconds, _) in WINDOWS.items():
+                self._add(self._windows, (mission, window, int(now // seconds)), n)
+            due = self.path and time.monotonic() - self._flushed_at >= self.flush_interval
+        if due:
+            self.flush()
+
+    @staticmethod
+    def _add(table, key, value):
+        table[key] = table.get(key, 0) + value
+
+    def flush(self):
+        """Add the pending updates to the SQLite file"""
+        if not self.path:
+            return
+        with self._lock:
+            counters, windows = self._counters, self._windows
+            self._counters, self._windows = {}, {}
+            self._flushed_at = time.monotonic()
+        if not counters and not windows:
+            return
+        try:
+            db = self._connection()
+            with db:
+                db.executemany('INSERT INTO counters VALUES (?, ?, ?, ?) ON CONFLICT (mission, name, key) '
+                               'DO UPDATE SET value = value + excluded.value',
+                               [key + (value,) for key, value in counters.items()])
+                db.executemany('INSERT INTO windows VALUES (?, ?, ?, ?) ON CONFLICT (mission, window, bucket) '
+                               'DO UPDATE SET rows = rows + excluded.rows',
+                               [key + (value,) for key, value in windows.items()])
+                now = time.time()
+                for window, (seconds, kept) in WINDOWS.items():
+                    db.execute('DELETE FROM windows WHERE window = ? AND bucket <= ?',
+                               (window, int(now // seconds) - kept))
+        except sqlite3.Error:
+            # Keep the updates for the next attempt rather than losing them
+            with self._lock:
+                for key, value in counters.items():
+                    self._add(self._counters, key, value)
+                for key, value in windows.items():
+                    self._add(self._windows, key, value)
+
+    def _totals(self):
+        """Persisted counters plus this process's pending updates"""
+        counters, windows = {}, {}
+        if self.path:
+            try:
+                db = self._connection()
+                counters = {(m, n, k): v for m, n, k, v in db.execute('SELECT * FROM counters')}
+                windows = {(m, w, b): r for m, w, b, r in db.execute('SELECT * FROM windows')}
+            except sqlite3.Error:
+                pass
+        with self._lock:
+            for key, value in self._counters.items():
+                self._add(counters, key, value)
+            for key, value in self._windows.items():
+                self._add(windows, key, value)
+        return counters, windows
+
+    def snapshot(self, missions, now=None):
+        """Aggregates per mission, in a fixed amount of work"""
+        now = time.time() if now is None else now
+        counters, windows = self._totals()
+        result = {}
+        for mission in missions:
+            classes = {k: v for (m, n, k), v in counters.items() if m == mission and n == 'class'}
+            histograms = {label: [0] * CONFIDENCE_BINS for label in classes}
+            for (m, n, k), v in counters.items():
+                if m == mission and n == 'confidence':
+                    label, b = k.rsplit('|', 1)
+                    histograms.setdefault(label, [0] * CONFIDENCE_BINS)[int(b)] += v
+
+            per_window = {}
+            for window, (seconds, kept) in WINDOWS.items():
+                current = int(now // seconds)
+                per_window[window] = [{'start': bucket * seconds,
+                                       'rows': windows.get((mission, window, bucket), 0)}
+                                      for bucket in range(current - kept + 1, current + 1)]
+
+            result[mission] = {
+                'rows_scored': counters.get((mission, 'rows', ''), 0),
+                'requests': counters.get((mission, 'requests', ''), 0),
+                'classification_distribution': classes,
+                'confidence_histogram': {
+                    'bin_edges': list(range(0, 101, CONFIDENCE_BIN_WIDTH)),
+                    'counts': histograms
+                },
+                'rows_per_window': per_window
+            }
+        return result
@@ -0,0 +1,11 @@
+import os
+
+# Import the app (and, with EXOQUEST_PRELOAD_MODELS=1, the models) once in the
+# master so workers share the loaded models copy-on-write
+preload_app = os.environ.get('EXOQUEST_PRELOAD_MODELS', '0') == '1'
+
+
+def on_starting(server):
+    # Jobs left queued or running died with the previous server's workers
+    from jobs import fail_interrupted
+    fail_interrupted(os.path.join('uploads', 'jobs'))
@@ -0,0 +1,115 @@
+"""
+Column-projected reading of uploaded catalogs.
+
+The NASA archive exports carry hundreds of columns, but a mission only needs
+its model features and its id column. The header is read first so an upload
+missing a required column is rejected before anything is parsed, then only
+the needed columns are parsed, with fixed dtypes instead of type inference.
+Parquet and Feather uploads need the optional ``pyarrow`` package, which also
+speeds up CSV parsing when installed.
+"""
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pa_csv = feather = pq = None
+
+# File extension -> upload format
+EXTENSIONS = {'csv': 'csv', 'parquet': 'parquet', 'pq': 'parquet', 'feather': 'feather', 'arrow': 'feather'}
+
+
+class MissingColumnsError(ValueError):
+    def __init__(self, missing):
+        self.missing = list(missing)
+        super().__init__('Missing required columns: ' + ', '.join(self.missing))
+
+
+def upload_format(filename):
+    return EXTENSIONS.get(filename.rsplit('.', 1)[-1].lower()) if '.' in filename else None
+
+
+def available(upload_fmt):
+    return upload_fmt == 'csv' or pa is not None
+
+
+def required_columns(model):
+    return model.plan.num_cols + model.plan.cat_cols
+
+
+def column_dtypes(model):
+    """Parse dtype of every column a mission reads; the id column is optional"""
+    dtypes = {model.id_column: str}
+    dtypes.update({col: object for col in model.plan.cat_cols})
+    # float32 in compact mode (see ExoplanetModel), parsed straight into the plan's dtype
+    dtypes.update({col: model.plan.dtype.name for col in model.plan.num_cols})
+    return dtypes
+
+
+def select_columns(model, header):
+    """Columns to read from an upload with this header, or MissingColumnsError"""
+    header = set(header)
+    missing = [col for col in required_columns(model) if col not in header]
+    if missing:
+        raise MissingColumnsError(missing)
+    return [col for col in column_dtypes(model) if col in header]
+
+
+def csv_options(model):
+    """read_csv keyword arguments that project and type a mission's columns.
+
+    For uploads that cannot be rewound, such as a streamed request body; check
+    the first chunk with ``select_columns``.
+    """
+    dtypes = column_dtypes(model)
+    return {'usecols': lambda col: col in dtypes, 'dtype': dtypes}
+
+
+def _arrow_types(model):
+    types = {model.id_column: pa.string()}
+    types.update({col: pa.string() for col in model.plan.cat_cols})
+    types.update({col: pa.from_numpy_dtype(model.plan.dtype) for col in model.plan.num_cols})
+    return types
+
+
+def _from_arrow(model, table):
+    """Cast the projected columns to their mission dtypes and convert to a DataFrame"""
+    types = _arrow_types(model)
+    table = pa.table({col: table.column(col).cast(types[col]) for col in table.column_names})
+    return table.to_pandas()
+
+
+def read_row_group(parquet, group, model):
+    """Read the columns a mission needs from one row group of a ParquetFile"""
+    columns = select_columns(model, parquet.schema_arrow.names)
+    return _from_arrow(model, parquet.read_row_group(group, columns=columns))
+
+
+def read_upload(source, upload_fmt, model):
+    """Read the columns a mission needs from a seekable file object"""
+    if upload_fmt == 'csv':
+        header = pd.read_csv(source, nrows=0).columns
+        columns = select_columns(model, header)
+        source.seek(0)
+        if pa is None:
+            return pd.read_csv(source, usecols=columns, dtype=column_dtypes(model))
+        # Arrow's multi-threaded reader converts only the included columns
+        types = _arrow_types(model)
+        options = pa_csv.ConvertOptions(include_columns=columns, strings_can_be_null=True,
+                                        column_types={col: types[col] for col in columns})
+        return _from_arrow(model, pa_csv.read_csv(source, convert_options=options))
+
+    # Arrow reads from an in-memory buffer are zero-copy
+    data = pa.py_buffer(source.read())
+    if upload_fmt == 'parquet':
+        parquet = pq.ParquetFile(pa.BufferReader(data))
+        columns = select_columns(model, parquet.schema_arrow.names)
+        return _from_arrow(model, parquet.read(columns=columns))
+    if upload_fmt == 'feather':
+        columns = select_columns(model, pa.ipc.open_file(pa.BufferReader(data)).schema.names)
+        return _from_arrow(model, feather.read_table(pa.BufferReader(data), columns=columns))
+    raise ValueError(f'Unsupported upload format {upload_fmt}')
@@ -0,0 +1,170 @@
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import ingest
+import model_store
+from dashboard_stats import DashboardStats
+from model import result_columns
+from registry import ModelRegistry
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Per-process registry of the pool workers, so each worker loads a mission's
+# model once and reuses it for every job it runs
+_worker_models = None
+
+
+def _init_worker(stats_path=None):
+    global _worker_models
+    _worker_models = ModelRegistry(stats=DashboardStats(stats_path) if stats_path else None)
+
+
+def _write_status(job_dir, **fields):
+    """Merge fields into the job's status file, replacing it atomically"""
+    path = os.path.join(job_dir, 'status.json')
+    try:
+        with open(path) as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        status = {}
+    status.update(fields, updated_at=time.time())
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, path)
+    return status
+
+
+def run_job(job_dir, mission, chunk_rows):
+    """Score a persisted upload chunk by chunk, writing results incrementally"""
+    input_path = os.path.join(job_dir, 'input.csv')
+    output_path = os.path.join(job_dir, 'results.csv')
+    partial_path = output_path + '.part'
+
+    _write_status(job_dir, status='running', started_at=time.time())
+    try:
+        model = _worker_models.get(mission)
+        # Workers outlive releases: score with the one being served now
+        if model.release != model_store.current_release(mission):
+            _worker_models.reload(mission, wait=True)
+            model = _worker_models.get(mission)
+        total_bytes = os.path.getsize(input_path) or 1
+        rows_done = 0
+        with open(input_path, 'rb') as src, open(partial_path, 'w', newline='') as dst:
+            for chunk in pd.read_csv(src, chunksize=chunk_rows, **ingest.csv_options(model)):
+                if rows_done == 0:
+                    ingest.select_columns(model, chunk.columns)
+                chunk = chunk.reset_index(drop=True)
+                columns = result_columns(model, chunk, model.predict_columns(chunk), rows_done)
+                pd.DataFrame(columns).to_csv(dst, header=rows_done == 0, index=False)
+                rows_done += len(chunk)
+                _write_status(job_dir, rows_processed=rows_done,
+                              progress=round(min(src.tell() / total_bytes, 1.0), 4))
+        os.replace(partial_path, output_path)
+        if model.stats is not None:
+            model.stats.flush()
+    except Exception as e:
+        _write_status(job_dir, status='failed', error=str(e), finished_at=time.time())
+        return
+    _write_status(job_dir, status='done', progress=1.0, rows_processed=rows_done,
+                  finished_at=time.time())
+
+
+def fail_interrupted(folder):
+    """Mark jobs a previous server left queued or running as failed.
+
+    Their worker processes died with that server, so run this once at startup,
+    before any worker takes jobs. Returns the number of jobs marked.
+    """
+    failed = 0
+    for job_id in os.listdir(folder) if os.path.isdir(folder) else ():
+        job_dir = os.path.join(folder, job_id)
+        try:
+            with open(os.path.join(job_dir, 'status.json')) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if status.get('status') in ('queued', 'running'):
+            _write_status(job_dir, status='failed', error='Interrupted by a server restart',
+                          finished_at=time.time())
+            failed += 1
+    return failed
+
+
+class JobManager:
+    """Runs batch scoring jobs in a process pool, persisting them on disk.
+
+    Each job lives in ``<folder>/<job_id>/`` with the uploaded ``input.csv``,
+    a ``status.json`` and, once done, ``results.csv``. Because state is on
+    disk, any server process can report on or serve a job. With
+    ``stats_path`` the scored rows are added to the dashboard statistics.
+    """
+
+    def __init__(self, folder, max_workers=2, chunk_rows=5000, stats_path=None):
+        self.folder = folder
+        self.max_workers = max_workers
+        self.chunk_rows = chunk_rows
+        self.stats_path = stats_path
+        self._pool = None
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # Spawned, not forked: the server process runs threads (the
+                # inference pool, batcher, pollers) whose locks a fork could copy held
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker,
+                                                 initargs=(self.stats_path,))
+            return self._pool
+
+    def job_dir(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id):
+            raise KeyError(job_id)
+        return os.path.join(self.folder, job_id)
+
+    def submit(self, file, mission):
+        """Persist an uploaded file and queue it for scoring; returns the status"""
+        job_id = uuid.uuid4().hex
+        job_dir = self.job_dir(job_id)
+        os.makedirs(job_dir)
+        file.save(os.path.join(job_dir, 'input.csv'))
+        status = _write_status(job_dir, id=job_id, model=mission, status='queued',
+                               progress=0.0, rows_processed=0, created_at=time.time())
+
+        future = self._executor().submit(run_job, job_dir, mission, self.chunk_rows)
+        future.add_done_callback(lambda f: self._on_done(job_dir, f))
+        return status
+
+    def _on_done(self, job_dir, future):
+        # run_job records its own failures, this only catches a dead worker
+        error = future.exception()
+        if error is not None:
+            _write_status(job_dir, status='failed', error=str(error), finished_at=time.time())
+
+    def status(self, job_id):
+        path = os.path.join(self.job_dir(job_id), 'status.json')
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(job_id)
+
+    def results_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), 'results.csv')
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,198 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format.
+
+Each server process keeps its own values; scrape every worker (or run a
+single worker per container) to aggregate them.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                     for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labels, k)} {v}' for k, v in items]
+
+
+class Gauge(_Metric):
+    """A metric whose samples are read from a callback at scrape time.
+
+    ``collect`` returns ``(label_values, value)`` pairs. Pass
+    ``kind='counter'`` for totals that are kept elsewhere, such as cache hits.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), collect=None, kind=None):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+        if kind:
+            self.kind = kind
+
+    def render(self):
+        samples = self.collect() if self.collect else []
+        return self.header() + [f'{self.name}{_format_labels(self.labels, k)} {v}'
+                                for k, v in sorted(samples, key=lambda s: s[0]) if v is not None]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((k, (list(c), t)) for k, (c, t) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels + ("le",), key + (le,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.register(Histogram(
+    'exoquest_stage_seconds', 'Time spent in each stage of a prediction', ('mission', 'stage')))
+request_seconds = registry.register(Histogram(
+    'exoquest_request_seconds', 'End-to-end prediction request latency', ('endpoint', 'mission', 'status')))
+request_rows = registry.register(Histogram(
+    'exoquest_request_rows', 'Rows scored per prediction request', ('endpoint', 'mission'), buckets=ROW_BUCKETS))
+request_errors = registry.register(Counter(
+    'exoquest_request_errors_total', 'Failed prediction requests by failing stage', ('endpoint', 'mission', 'stage')))
+model_load_seconds = registry.register(Histogram(
+    'exoquest_model_load_seconds', 'Time to load a mission model', ('mission',)))
+
+_local = threading.local()
+
+
+class Trace:
+    """Stage timings of one request, plus the stage that raised, if any"""
+
+    def __init__(self):
+        self.stages = {}
+        self.failed_stage = None
+
+    @property
+    def total(self):
+        return sum(self.stages.values())
+
+    def summary(self):
+        return ' '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in self.stages.items())
+
+
+@contextmanager
+def stage(name, mission=''):
+    """Time a block as one stage, recording it in the current request trace"""
+    current = getattr(_local, 'trace', None)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if current is not None and current.failed_stage is None:
+            current.failed_stage = name
+        raise
+    finally:
+        _record(current, name, time.perf_counter() - start, mission)
+
+
+def record_stage(name, seconds, mission=''):
+    """Record a stage timed elsewhere, such as time spent waiting in a queue"""
+    _record(getattr(_local, 'trace', None), name, seconds, mission)
+
+
+def _record(current, name, seconds, mission):
+    stage_seconds.observe(seconds, mission=mission, stage=name)
+    if current is not None:
+        current.stages[name] = current.stages.get(name, 0.0) + seconds
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def attach(current):
+    """Record the stages of a request's work running on another thread into its trace"""
+    previous = getattr(_local, 'trace', None)
+    _local.trace = current
+    try:
+        yield current
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def trace():
+    """Collect the stage timings of the enclosed request"""
+    previous = getattr(_local, 'trace', None)
+    _local.trace = current = Trace()
+    try:
+        yield current
+    finally:
+        _local.trace = previous
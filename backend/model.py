@@ -1,70 +1,251 @@
 import numpy as np
-import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler
+import hashlib
 import joblib
+import json
 import os
+import metrics
+from preprocessing import PreprocessingPlan
+from prediction_cache import PredictionCache
+from similarity import load_index
+from tree_engine import EarlyExit, FlatTreeEnsemble, HybridEstimator, ensemble_dir, export_ensemble, file_sha256
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_DIR = os.path.join(BASE_DIR, 'models')
 
-class ExoplanetModel:
-    def __init__(self, model_type='kepler'):
+# 'auto' serves batches of up to FLAT_ENGINE_MAX_ROWS rows from an exported
+# flat ensemble (when it matches the pickled model) and unpickles the native
+# estimator for larger ones; 'flat' always uses the export and 'native'
+# always the pickled estimator
+TREE_ENGINE = os.environ.get('EXOQUEST_TREE_ENGINE', 'auto')
+FLAT_ENGINE_MAX_ROWS = int(os.environ.get('EXOQUEST_FLAT_ENGINE_MAX_ROWS', 32))
+
+# Compact mode: preprocessing and flat ensembles in float32, halving the
+# size of the feature matrices and of the ensemble thresholds and leaves
+COMPACT = os.environ.get('EXOQUEST_COMPACT', '0') == '1'
+
+# Row-level prediction cache, off by default: it hashes every row, which only
+# pays off when the same rows come back. Rows kept in memory per mission and
+# an optional SQLite tier shared by all processes
+CACHE_ROWS = int(os.environ.get('EXOQUEST_CACHE_ROWS', 0))
+CACHE_DIR = os.environ.get('EXOQUEST_CACHE_DIR')
+CACHE_DISK_ROWS = int(os.environ.get('EXOQUEST_CACHE_DISK_ROWS', 1000000))
+
+# Number of stages the early-exit mode splits the ensemble into
+EARLY_EXIT_STAGES = int(os.environ.get('EXOQUEST_EARLY_EXIT_STAGES', 20))
+
+ACCURACY_MAP = {
+    'kepler': 87,
+    'k2': 92,
+    'tess': 77
+}
+
+# Model inputs of each mission, shared by the server and train_models.py
+TESS_FEATURES = [
+    'st_pmra', 'st_pmdec', 'pl_orbper', 'pl_trandurh', 'pl_trandep',
+    'pl_rade', 'pl_insol', 'pl_eqt', 'st_tmag', 'st_dist',
+    'st_teff', 'st_logg', 'st_rad', 'pl_pnum'
+]
+TESS_LOG_FEATURES = [
+    'pl_orbper', 'pl_trandurh', 'pl_trandep',
+    'pl_rade', 'pl_insol', 'pl_eqt',
+    'st_dist', 'st_rad'
+]
+KEPLER_NUM_COLS = [
+    'koi_period', 'koi_eccen', 'koi_longp', 'koi_impact', 'koi_duration', 'koi_ingress', 'koi_depth', 'koi_ror',
+    'koi_srho', 'koi_prad', 'koi_sma', 'koi_incl', 'koi_teq', 'koi_insol', 'koi_dor', 'koi_ldm_coeff4',
+    'koi_ldm_coeff3', 'koi_ldm_coeff2', 'koi_ldm_coeff1', 'koi_max_sngle_ev', 'koi_max_mult_ev', 'koi_model_snr', 'koi_count',
+    'koi_num_transits', 'koi_tce_plnt_num', 'koi_bin_oedp_sig', 'koi_model_dof',
+    'koi_model_chisq', 'koi_steff', 'koi_slogg', 'koi_smet', 'koi_srad', 'koi_smass', 'koi_sage',
+    'ra', 'dec', 'koi_kepmag', 'koi_gmag', 'koi_rmag', 'koi_imag', 'koi_zmag', 'koi_jmag', 'koi_hmag', 'koi_kmag', 'koi_fwm_stat_sig',
+    'koi_fwm_sra', 'koi_fwm_sdec', 'koi_fwm_srao', 'koi_fwm_sdeco', 'koi_fwm_prao', 'koi_fwm_pdeco', 'koi_dicco_mra', 'koi_dicco_mdec',
+    'koi_dicco_msky', 'koi_dikco_mra', 'koi_dikco_mdec', 'koi_dikco_msky'
+]
+KEPLER_CAT_COLS = ['koi_fittype', 'koi_parm_prov', 'koi_tce_delivname', 'koi_sparprov']
+K2_FEATURES = [
+    'st_dens','pl_cmasse','sy_kepmag','st_radv','pl_orbsmax','pl_dens','pl_massj','pl_insol','pl_bmasse','ra','pl_trandep','st_logg','sy_bmag','st_age','pl_occdep',
+    'pl_orbeccen','sy_jmag','sy_kmag','elat','dec','sy_w1mag','st_rad','pl_rvamp','pl_bmassj','pl_orblper','pl_tranmid','sy_gmag','elon','sy_imag','st_rotp','pl_msinij',
+    'pl_orbtper','sy_pm','st_teff','pl_orbper','sy_plx','sy_umag','pl_cmassj','pl_eqt','sy_gaiamag','st_mass','pl_masse','sy_rmag','sy_dist','sy_zmag','pl_orbincl',
+    'sy_pmdec','st_met','glat','sy_w4mag','pl_imppar','ttv_flag','pl_projobliq','st_lum','sy_pmra','pl_trueobliq','pl_ratror','sy_icmag','pl_rade','pl_trandur',
+    'sy_hmag','glon','pl_radj','st_vsin','sy_w2mag','sy_vmag','pl_msinie','sy_tmag','pl_ratdor','sy_w3mag'
+]
+
+def model_available(model_type, model_dir=None):
+    """Whether a mission's classifier exists on disk in either form"""
+    model_dir = model_dir or MODEL_DIR
+    return (os.path.exists(os.path.join(model_dir, f'{model_type}_model.pkl')) or
+            os.path.exists(os.path.join(ensemble_dir(model_dir, model_type), 'meta.json')))
+
+def load_estimator(model_type, model_dir=None, compact=False):
+    """Load a mission's classifier, preferring its memory-mapped flat export
+
+    With ``compact`` the flat export is converted to float32; the native
+    estimator keeps its own precision but is fed float32 inputs.
+    """
+    model_dir = model_dir or MODEL_DIR
+    path = os.path.join(model_dir, f'{model_type}_model.pkl')
+    flat_dir = ensemble_dir(model_dir, model_type)
+    if TREE_ENGINE != 'native' and os.path.exists(os.path.join(flat_dir, 'meta.json')):
+        ensemble = FlatTreeEnsemble.load(flat_dir)
+        if compact:
+            ensemble = ensemble.compacted()
+        if TREE_ENGINE == 'flat' or not os.path.exists(path):
+            return ensemble
+        # In auto mode ignore an export that is stale for the pickled model
+        if ensemble.meta.get('source_sha256') == file_sha256(path):
+            return HybridEstimator(ensemble, lambda: joblib.load(path), FLAT_ENGINE_MAX_ROWS)
+    return joblib.load(path)
+
+def model_version(model_type, model_dir=None):
+    """Short content hash identifying the mission's trained classifier"""
+    model_dir = model_dir or MODEL_DIR
+    path = os.path.join(model_dir, f'{model_type}_model.pkl')
+    if os.path.exists(path):
+        return file_sha256(path)[:12]
+    flat = FlatTreeEnsemble.load(ensemble_dir(model_dir, model_type))
+    return flat.meta.get('source_sha256', 'unknown')[:12]
+
+def artifacts_version(model_type, model_dir=None):
+    """Short content hash of the mission's preprocessing artifacts and similarity index"""
+    model_dir = model_dir or MODEL_DIR
+    digests = []
+    for name in ('scaler', 'medians', 'encoder', 'similar'):
+        path = os.path.join(model_dir, f'{model_type}_{name}.pkl')
+        if os.path.exists(path):
+            digests.append(f'{name}:{file_sha256(path)}')
+    return hashlib.sha256('|'.join(digests).encode()).hexdigest()[:12]
+
+def model_metrics(model_type, model_dir=None):
+    """Held-out test metrics written by train_models.py, or None"""
+    model_dir = model_dir or MODEL_DIR
+    try:
+        with open(os.path.join(model_dir, f'{model_type}_metrics.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def training_accuracy(model_type, model_dir=None):
+    """Test accuracy in percent, measured by train_models.py when it trained the model"""
+    measured = model_metrics(model_type, model_dir)
+    if measured and 'accuracy' in measured:
+        return round(measured['accuracy'] * 100, 2)
+    return ACCURACY_MAP.get(model_type, 95.0)
+
+def make_cache():
+    """Build a prediction cache from the EXOQUEST_CACHE_* settings"""
+    if not CACHE_ROWS and not CACHE_DIR:
+        return None
+    disk_path = os.path.join(CACHE_DIR, 'predictions.sqlite') if CACHE_DIR else None
+    return PredictionCache(max_rows=CACHE_ROWS, disk_path=disk_path, max_disk_rows=CACHE_DISK_ROWS)
+
+def rows_from_columns(columns):
+    """Turn a dict of equal-length result arrays into a list of row dicts"""
+    keys = list(columns)
+    # tolist() converts NumPy scalars to native Python values in one pass
+    values = [col.tolist() if isinstance(col, np.ndarray) else list(col) for col in columns.values()]
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+def result_columns(model, df, columns, start=0):
+    """Prepend the row number and star id columns to the prediction columns"""
+    return {
+        'id': np.arange(start + 1, start + len(df) + 1),
+        'star_id': model.star_ids(df),
+        **columns
+    }
 
-        self.accuracy_map = {
-                'kepler': 87,
-                'k2': 92,
-                'tess': 77
-            }
+class ExoplanetModel:
+    def __init__(self, model_type='kepler', model_dir=None, compact=COMPACT):
+
+        # model_dir is a release directory (see model_store.py) or MODEL_DIR
+        model_dir = model_dir or MODEL_DIR
+        self.model_dir = model_dir
+        self.compact = compact
+        dtype = np.float32 if compact else np.float64
+        self.accuracy_map = ACCURACY_MAP
+        self.cache = None
+        # Set by the registry to a DashboardStats for the served models
+        self.stats = None
+        self._importances = None
+        self._early_exit = None
+        # Nearest confirmed objects, when similarity.py has built an index
+        self.similar = None
+        # Set by the registry to the release the model was loaded from
+        self.release = None
         
         self.model_type = model_type
 
         if model_type == 'tess':
 
-            self.scaler = joblib.load(os.path.join(MODEL_DIR, 'tess_scaler.pkl'))
-            self.model = joblib.load(os.path.join(MODEL_DIR, 'tess_model.pkl'))
-            self.medians = joblib.load(os.path.join(MODEL_DIR, 'tess_medians.pkl')) 
-
-            self.feature_columns = [
-                'st_pmra', 'st_pmdec', 'pl_orbper', 'pl_trandurh', 'pl_trandep',
-                'pl_rade', 'pl_insol', 'pl_eqt', 'st_tmag', 'st_dist',
-                'st_teff', 'st_logg', 'st_rad', 'pl_pnum'
-            ] 
-            self.log_features = [
-                'pl_orbper', 'pl_trandurh', 'pl_trandep',
-                'pl_rade', 'pl_insol', 'pl_eqt',
-                'st_dist', 'st_rad'
+            self.scaler = joblib.load(os.path.join(model_dir, 'tess_scaler.pkl'))
+            self.model = load_estimator('tess', model_dir, compact)
+            self.version = model_version('tess', model_dir)
+            self.artifacts_version = artifacts_version('tess', model_dir)
+            self.cache = make_cache()
+            self.medians = joblib.load(os.path.join(model_dir, 'tess_medians.pkl')) 
+
+            self.feature_columns = list(TESS_FEATURES)
+            self.log_features = list(TESS_LOG_FEATURES)
+
+            self.plan = PreprocessingPlan.from_artifacts(
+                self.feature_columns, self.medians, self.scaler, log_features=self.log_features, dtype=dtype)
+            self.similar = load_index('tess', model_dir, self.plan.num_cols)
+
+            self.id_column, self.id_prefix = 'tid', 'TIC '
+            self.display_features = [
+                ('Planet radius', 'pl_rade', 3),
+                ('Transit duration', 'pl_trandurh', 2),
+                ('Planet orbital period', 'pl_orbper', 2)
             ]
         
         elif model_type == 'kepler':
 
-            self.scaler = joblib.load(os.path.join(MODEL_DIR, 'kepler_scaler.pkl'))
-            self.model = joblib.load(os.path.join(MODEL_DIR, 'kepler_model.pkl'))
-            self.medians = joblib.load(os.path.join(MODEL_DIR, 'kepler_medians.pkl')) 
-            self.encoder = joblib.load(os.path.join(MODEL_DIR, 'kepler_encoder.pkl')) 
-
-            self.num_cols = [ 'koi_period', 'koi_eccen', 'koi_longp', 'koi_impact', 'koi_duration', 'koi_ingress', 'koi_depth', 'koi_ror',
-                'koi_srho', 'koi_prad', 'koi_sma', 'koi_incl', 'koi_teq', 'koi_insol', 'koi_dor', 'koi_ldm_coeff4',
-                'koi_ldm_coeff3', 'koi_ldm_coeff2', 'koi_ldm_coeff1', 'koi_max_sngle_ev', 'koi_max_mult_ev', 'koi_model_snr', 'koi_count',
-                'koi_num_transits', 'koi_tce_plnt_num', 'koi_bin_oedp_sig', 'koi_model_dof',
-                'koi_model_chisq', 'koi_steff', 'koi_slogg', 'koi_smet', 'koi_srad', 'koi_smass', 'koi_sage',
-                'ra', 'dec', 'koi_kepmag', 'koi_gmag', 'koi_rmag', 'koi_imag', 'koi_zmag', 'koi_jmag', 'koi_hmag', 'koi_kmag', 'koi_fwm_stat_sig',
-                'koi_fwm_sra', 'koi_fwm_sdec', 'koi_fwm_srao', 'koi_fwm_sdeco', 'koi_fwm_prao', 'koi_fwm_pdeco', 'koi_dicco_mra', 'koi_dicco_mdec',
-                'koi_dicco_msky', 'koi_dikco_mra', 'koi_dikco_mdec', 'koi_dikco_msky']
+            self.scaler = joblib.load(os.path.join(model_dir, 'kepler_scaler.pkl'))
+            self.model = load_estimator('kepler', model_dir, compact)
+            self.version = model_version('kepler', model_dir)
+            self.artifacts_version = artifacts_version('kepler', model_dir)
+            self.cache = make_cache()
+            self.medians = joblib.load(os.path.join(model_dir, 'kepler_medians.pkl')) 
+            self.encoder = joblib.load(os.path.join(model_dir, 'kepler_encoder.pkl')) 
+
+            self.num_cols = list(KEPLER_NUM_COLS)
             
-            self.cat_cols = ['koi_fittype', 'koi_parm_prov', 'koi_tce_delivname', 'koi_sparprov']
+            self.cat_cols = list(KEPLER_CAT_COLS)
+
+            self.plan = PreprocessingPlan.from_artifacts(
+                self.num_cols, self.medians, self.scaler, cat_cols=self.cat_cols, encoder=self.encoder,
+                dtype=dtype)
+            self.feature_names = self.plan.num_cols + list(self.encoder.get_feature_names_out(self.cat_cols))
+            self.similar = load_index('kepler', model_dir, self.plan.num_cols)
+
+            self.id_column, self.id_prefix = 'kepid', 'KIC '
+            self.display_features = [
+                ('Planet orbital period', 'koi_period', 3),
+                ('Planet Radius', 'koi_prad', 2),
+                ('Transit Depth', 'koi_depth', 2)
+            ]
 
         elif model_type == 'k2':
 
-            self.scaler = joblib.load(os.path.join(MODEL_DIR, 'k2_scaler.pkl'))
-            self.model = joblib.load(os.path.join(MODEL_DIR, 'k2_model.pkl'))
-            self.medians = joblib.load(os.path.join(MODEL_DIR, 'k2_medians.pkl')) 
+            self.scaler = joblib.load(os.path.join(model_dir, 'k2_scaler.pkl'))
+            self.model = load_estimator('k2', model_dir, compact)
+            self.version = model_version('k2', model_dir)
+            self.artifacts_version = artifacts_version('k2', model_dir)
+            self.cache = make_cache()
+            self.medians = joblib.load(os.path.join(model_dir, 'k2_medians.pkl')) 
+
+            self.feature_columns = list(K2_FEATURES)
 
-            self.feature_columns = ['st_dens','pl_cmasse','sy_kepmag','st_radv','pl_orbsmax','pl_dens','pl_massj','pl_insol','pl_bmasse','ra','pl_trandep','st_logg','sy_bmag','st_age','pl_occdep',
-                'pl_orbeccen','sy_jmag','sy_kmag','elat','dec','sy_w1mag','st_rad','pl_rvamp','pl_bmassj','pl_orblper','pl_tranmid','sy_gmag','elon','sy_imag','st_rotp','pl_msinij',
-                'pl_orbtper','sy_pm','st_teff','pl_orbper','sy_plx','sy_umag','pl_cmassj','pl_eqt','sy_gaiamag','st_mass','pl_masse','sy_rmag','sy_dist','sy_zmag','pl_orbincl',
-                'sy_pmdec','st_met','glat','sy_w4mag','pl_imppar','ttv_flag','pl_projobliq','st_lum','sy_pmra','pl_trueobliq','pl_ratror','sy_icmag','pl_rade','pl_trandur',
-                'sy_hmag','glon','pl_radj','st_vsin','sy_w2mag','sy_vmag','pl_msinie','sy_tmag','pl_ratdor','sy_w3mag']
+            self.plan = PreprocessingPlan.from_artifacts(self.feature_columns, self.medians, self.scaler,
+                                                         dtype=dtype)
+            self.similar = load_index('k2', model_dir, self.plan.num_cols)
+
+            self.id_column, self.id_prefix = 'hostname', ''
+            self.display_features = [
+                ('Planet radius', 'pl_rade', 3),
+                ('Transit duration', 'pl_trandur', 2),
+                ('Planet orbital period', 'pl_orbper', 2)
+            ]
 
         else:
             self.scaler = StandardScaler()
@@ -75,6 +256,12 @@ class ExoplanetModel:
             
             self._initialize_model()
     
+    @property
+    def response_version(self):
+        """Everything a /api/predict response depends on besides the upload and
+        the options: release, classifier, preprocessing artifacts and input dtype"""
+        return f'{self.release}:{self.version}:{self.artifacts_version}:{self.plan.dtype.name}'
+
     def _initialize_model(self):
         """Initialize or load pre-trained model"""
         model_path = f'models/{self.model_type}_model.pkl'
@@ -99,40 +286,8 @@ class ExoplanetModel:
         """Preprocess input data"""
 
 
-        if self.model_type == 'tess':
-            
-            X = df[self.feature_columns]
-
-            X[self.feature_columns].fillna(self.medians, inplace=True)
-
-            for col in self.log_features:
-                X.loc[:, col] = np.log1p(X.loc[:, col])
-
-            X_final = self.scaler.transform(X.values) 
-
-        elif self.model_type == 'k2':
-            
-            X = df[self.feature_columns]
-
-            X[self.feature_columns].fillna(self.medians, inplace=True)
-
-            X_final = self.scaler.transform(X.values)    
-
-        elif self.model_type == 'kepler':      
-
-            X = df[self.num_cols+self.cat_cols]
-
-            X[self.num_cols].fillna(self.medians, inplace=True)
-
-            X_test_cat = self.encoder.transform(X[self.cat_cols])
-
-            X_test_cat = pd.DataFrame(X_test_cat, columns=self.encoder.get_feature_names_out(self.cat_cols), index=X.index)
-
-            X_ohe = pd.concat([X[self.num_cols], X_test_cat], axis=1)
-
-            X_final = self.scaler.transform(X_ohe)
-
-            self.feature_names = X_ohe.columns.tolist()
+        if self.model_type in ('tess', 'k2', 'kepler'):
+            X_final = self.plan.transform(df)
 
         else:
             # Handle missing columns
@@ -146,63 +301,156 @@ class ExoplanetModel:
         
         return X_final
     
-    def predict(self, df):
-        """Make predictions on input data"""
-
-        if self.model_type == 'tess':
+    def star_ids(self, df):
+        """Build the display id of every row from the mission's id column"""
+        if self.id_column not in df:
+            return np.full(len(df), '', dtype=object)
+        return (self.id_prefix + df[self.id_column].fillna('').astype(str)).to_numpy()
+
+    def predict_proba(self, X):
+        """Class probabilities for preprocessed rows, served from the cache when possible"""
+        if len(X) == 0:
+            # Estimators reject empty input; a header-only upload scores no rows
+            return np.empty((0, len(self.model.classes_)))
+        if self.cache is None:
+            with metrics.stage('inference', self.model_type):
+                return self.model.predict_proba(X)
+
+        with metrics.stage('cache', self.model_type):
+            keys = self.cache.keys(f'{self.model_type}:{self.version}', X)
+            probabilities, missing = self.cache.lookup(keys, len(self.model.classes_))
+        if len(missing):
+            with metrics.stage('inference', self.model_type):
+                computed = self.model.predict_proba(X[missing])
+            probabilities[missing] = computed
+            with metrics.stage('cache', self.model_type):
+                self.cache.store([keys[i] for i in missing], computed)
+        return probabilities
+
+    def early_exit_engine(self):
+        """The staged evaluator of the ensemble, or None for models early
+        exit does not support (random forests)"""
+        if self._early_exit is None:
+            estimator = self.model
+            try:
+                if isinstance(estimator, HybridEstimator):
+                    engine = EarlyExit(estimator.flat, EARLY_EXIT_STAGES, lambda: estimator.native,
+                                       estimator.max_flat_rows)
+                elif isinstance(estimator, FlatTreeEnsemble):
+                    engine = EarlyExit(estimator, EARLY_EXIT_STAGES)
+                else:
+                    # The export only provides the leaf bounds; stages run natively
+                    engine = EarlyExit(export_ensemble(estimator), EARLY_EXIT_STAGES, lambda: estimator)
+            except NotImplementedError:
+                engine = False
+            self._early_exit = engine
+        return self._early_exit or None
+
+    def predict_proba_early_exit(self, X, min_confidence=0.0):
+        """Class probabilities with early exit, whether each row exited early
+        and the lower bound on each row's full 'Porbability Score' (0-1)
+
+        Cached rows keep their full probabilities. Only the rows that went
+        through the whole ensemble are added to the cache, since the others
+        hold estimates.
+        """
+        engine = self.early_exit_engine()
+        exited = np.zeros(len(X), dtype=bool)
+        if engine is None or len(X) == 0:
+            probabilities = self.predict_proba(X)
+            return probabilities, exited, probabilities.max(axis=1, initial=0.0)
+
+        keys = probabilities = None
+        missing = np.arange(len(X))
+        if self.cache is not None:
+            with metrics.stage('cache', self.model_type):
+                keys = self.cache.keys(f'{self.model_type}:{self.version}', X)
+                probabilities, missing = self.cache.lookup(keys, len(self.model.classes_))
+        floor = np.empty(len(X))
+        if probabilities is not None:
+            floor[:] = probabilities.max(axis=1)
+        if len(missing):
+            with metrics.stage('inference', self.model_type):
+                computed, trees, bound = engine.predict_proba(X[missing], min_confidence)
+            if probabilities is None:
+                probabilities = computed
+            else:
+                probabilities[missing] = computed
+            exited[missing] = trees < engine.n_trees
+            floor[missing] = bound
+            if keys is not None:
+                full = missing[trees == engine.n_trees]
+                with metrics.stage('cache', self.model_type):
+                    self.cache.store([keys[i] for i in full], probabilities[full])
+        return probabilities, exited, floor
+
+    def format_columns(self, df, probabilities, numeric=False):
+        """Build the output columns from the class probabilities of each row
+
+        Missing display values are "" unless ``numeric`` is set, which keeps
+        the display columns as float arrays with NaN for the columnar formats.
+        """
+        # The label is the argmax of the probabilities, exactly as the
+        # estimators' own predict() derives it
+        best = np.argmax(probabilities, axis=1)
+
+        columns = {
+            'classification': np.asarray(self.model.classes_)[best],
+            'Porbability Score': np.round(probabilities[np.arange(len(best)), best] * 100, 2)
+        }
+        for name, col, decimals in self.display_features:
+            values = df[col].to_numpy(dtype=float)
+            if numeric:
+                columns[name] = np.round(values, decimals)
+                continue
+            display = np.round(values, decimals).astype(object)
+            display[np.isnan(values)] = ""
+            columns[name] = display
+        return columns
+
+    def similar_to(self, X, k):
+        """The k nearest confirmed catalog objects of each preprocessed row"""
+        if self.similar is None:
+            raise LookupError(f'No similarity index for {self.model_type}')
+        with metrics.stage('similar', self.model_type):
+            return self.similar.neighbors(X, k)
+
+    def predict_columns(self, df, numeric=False, similar=0, early_exit=None):
+        """Make predictions on input data, returned as one array per output field
+
+        With ``similar`` set, a 'similar' column lists that many nearest
+        confirmed objects for each row. With ``early_exit`` set to a minimum
+        confidence (0-1, 0 to stop as soon as the label is certain), rows
+        stop once their label can no longer change and the lower bound on
+        their 'Porbability Score' is at least that confidence (see
+        EarlyExit). Their 'Porbability Score' is then an estimate of the full
+        one; an 'early_exit' column tells which rows stopped and 'Score lower
+        bound' gives the bound. Early-exit results are left out of the
+        dashboard statistics.
+        """
+        with metrics.stage('preprocess', self.model_type):
             X = self.preprocess_data(df)
-            
-            predictions = self.model.predict(X)
-            probabilities = self.model.predict_proba(X)
-
-            results = []
-            for idx, (pred, proba) in enumerate(zip(predictions, probabilities)):
-                confidence = float(np.max(proba) * 100)
-
-                results.append({
-                    'classification': pred,
-                    'Porbability Score': round(confidence, 2),
-                    'Planet radius': round(float(df.loc[idx, 'pl_rade']), 3) if pd.notna(df.loc[idx, 'pl_rade']) else "",
-                    'Transit duration': round(float(df.loc[idx, 'pl_trandurh']), 2) if pd.notna(df.loc[idx, 'pl_trandurh']) else "",
-                    'Planet orbital period': round(float(df.loc[idx, 'pl_orbper']), 2) if pd.notna(df.loc[idx, 'pl_orbper']) else ""
-                })
-
-        elif self.model_type == 'k2':
-            X = self.preprocess_data(df)
-            
-            predictions = self.model.predict(X)
-            probabilities = self.model.predict_proba(X)
-
-            results = []
-            for idx, (pred, proba) in enumerate(zip(predictions, probabilities)):
-                confidence = float(np.max(proba) * 100)
-
-                results.append({
-                    'classification': pred,
-                    'Porbability Score': round(confidence, 2),
-                    'Planet radius': round(float(df.loc[idx, 'pl_rade']), 3) if pd.notna(df.loc[idx, 'pl_rade']) else "",
-                    'Transit duration': round(float(df.loc[idx, 'pl_trandur']), 2) if pd.notna(df.loc[idx, 'pl_trandur']) else "",
-                    'Planet orbital period': round(float(df.loc[idx, 'pl_orbper']), 2) if pd.notna(df.loc[idx, 'pl_orbper']) else ""
-                })
-
-        elif self.model_type == 'kepler':  
-            X = self.preprocess_data(df)
-            
-            predictions = self.model.predict(X)
-            probabilities = self.model.predict_proba(X)
-
-            results = []
-            for idx, (pred, proba) in enumerate(zip(predictions, probabilities)):
-                confidence = float(np.max(proba) * 100)
-
-                results.append({
-                    'classification': pred,
-                    'Porbability Score': round(confidence, 2),
-                    'Planet orbital period': round(float(df.loc[idx, 'koi_period']), 3) if pd.notna(df.loc[idx, 'koi_period']) else "",
-                    'Planet Radius': round(float(df.loc[idx, 'koi_prad']), 2) if pd.notna(df.loc[idx, 'koi_prad']) else "",
-                    'Transit Depth': round(float(df.loc[idx, 'koi_depth']), 2) if pd.notna(df.loc[idx, 'koi_depth']) else ""
-                })
+        # A single pass over the ensemble for both labels and scores
+        if early_exit is None:
+            probabilities = self.predict_proba(X)
+        else:
+            probabilities, exited, floor = self.predict_proba_early_exit(X, early_exit)
+        with metrics.stage('format', self.model_type):
+            columns = self.format_columns(df, probabilities, numeric=numeric)
+        if early_exit is not None:
+            columns['early_exit'] = exited
+            columns['Score lower bound'] = np.round(floor * 100, 2)
+        if similar:
+            columns['similar'] = self.similar_to(X, similar)
+        if self.stats is not None and early_exit is None:
+            self.stats.record(self.model_type, columns['classification'], columns['Porbability Score'])
+        return columns
+
+    def predict(self, df, early_exit=None):
+        """Make predictions on input data"""
 
+        if self.model_type in ('tess', 'k2', 'kepler'):
+            return rows_from_columns(self.predict_columns(df, early_exit=early_exit))
 
         else:
             X = self.preprocess_data(df)
@@ -215,9 +463,6 @@ class ExoplanetModel:
             for idx, (pred, proba) in enumerate(zip(predictions, probabilities)):
                 confidence = float(np.max(proba) * 100)
                 
-                # Extract features from input
-                row = df.iloc[idx] if idx < len(df) else {}
-                
                 results.append({
                     'classification': pred,
                     'Porbability Score': round(confidence, 2),
@@ -229,8 +474,32 @@ class ExoplanetModel:
         return results
     
     def get_accuracy(self):
-        """Return model accuracy"""
-        return self.accuracy_map.get(self.model_type, 95.0)
+        """Return model accuracy, in percent, from the training metrics when available"""
+        return training_accuracy(self.model_type, self.model_dir)
+
+    def feature_importances(self):
+        """Share of the ensemble's splits on each input column, most used first
+
+        Computed once per loaded model. The one-hot columns of a categorical
+        input are added back together under the input's name.
+        """
+        if self._importances is None:
+            estimator = getattr(self.model, 'flat', self.model)
+            if isinstance(estimator, FlatTreeEnsemble):
+                counts = estimator.split_counts(self.plan.n_features).astype(float)
+            else:
+                counts = np.asarray(estimator.feature_importances_, dtype=float)
+
+            names = list(self.plan.num_cols)
+            values = list(counts[:len(names)])
+            for col, (known, index, missing) in zip(self.plan.cat_cols, self.plan.categories):
+                names.append(col)
+                values.append(counts[index].sum() + (counts[missing] if missing is not None else 0.0))
+            total = sum(values) or 1.0
+            ranked = sorted(zip(names, values), key=lambda item: -item[1])
+            self._importances = [{'feature': name, 'importance': round(value / total, 4)}
+                                 for name, value in ranked]
+        return self._importances
     
     def save_model(self, path=None):
         """Save trained model"""
@@ -0,0 +1,196 @@
+"""
+Versioned releases of the mission models.
+
+A release is a directory ``models/releases/<mission>/<release>/`` holding the
+same files ExoplanetModel loads from ``models/`` (scaler, medians, encoder,
+model and optionally the flat ensemble). ``models/releases/<mission>/CURRENT``
+names the release to serve and ``SHADOW`` optionally names a candidate that
+scores a sample of live traffic. Both files are replaced atomically and every
+server process polls them (see ModelRegistry), so activating a release rolls
+all workers forward without a restart. A mission without a CURRENT file is
+served from the flat files in ``models/``.
+
+Usage:
+    python model_store.py list tess
+    python model_store.py publish tess --from models       # new release, activated
+    python model_store.py publish tess --from models --no-activate
+    python model_store.py activate tess 20240101-120000-0123456789ab
+    python model_store.py shadow tess 20240101-120000-0123456789ab --sample-rate 0.1
+    python model_store.py unshadow tess
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+import model as model_module
+from tree_engine import ensemble_dir, file_sha256
+
+RELEASE_PATTERN = re.compile(r'^[0-9A-Za-z][0-9A-Za-z._-]*$')
+
+
+def releases_dir(mission):
+    return os.path.join(model_module.MODEL_DIR, 'releases', mission)
+
+
+def release_dir(mission, release):
+    if not RELEASE_PATTERN.match(release or ''):
+        raise KeyError(release)
+    return os.path.join(releases_dir(mission), release)
+
+
+def list_releases(mission):
+    folder = releases_dir(mission)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name for name in os.listdir(folder)
+                  if RELEASE_PATTERN.match(name) and os.path.isdir(os.path.join(folder, name)))
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_atomic(path, text):
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def current_release(mission):
+    """Name of the release being served, or None for the flat models/ files"""
+    return _read(os.path.join(releases_dir(mission), 'CURRENT'))
+
+
+def active_dir(mission, release=None):
+    """Directory ExoplanetModel should load a release (default: the current one) from"""
+    release = release or current_release(mission)
+    return release_dir(mission, release) if release else model_module.MODEL_DIR
+
+
+def pointer_mtime(mission):
+    """Latest change to the CURRENT or SHADOW pointers, for cheap polling"""
+    mtimes = []
+    for name in ('CURRENT', 'SHADOW'):
+        try:
+            mtimes.append(os.stat(os.path.join(releases_dir(mission), name)).st_mtime_ns)
+        except FileNotFoundError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def _release_files(mission, source_dir):
+    names = [name for name in os.listdir(source_dir)
+             if name.startswith(mission + '_') and (name.endswith('.pkl') or name.endswith('.json'))]
+    flat_dir = ensemble_dir(source_dir, mission)
+    if os.path.isdir(flat_dir):
+        names.append(os.path.basename(flat_dir))
+    return names
+
+
+def publish(mission, source_dir, activate=True):
+    """Copy a mission's artifacts from ``source_dir`` into a new release"""
+    model_path = os.path.join(source_dir, f'{mission}_model.pkl')
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(model_path)
+
+    release = f"{time.strftime('%Y%m%d-%H%M%S')}-{file_sha256(model_path)[:12]}"
+    target = release_dir(mission, release)
+    tmp_target = f'{target}.tmp{os.getpid()}'
+    os.makedirs(tmp_target)
+    for name in _release_files(mission, source_dir):
+        source = os.path.join(source_dir, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(tmp_target, name))
+        else:
+            shutil.copy2(source, os.path.join(tmp_target, name))
+    os.replace(tmp_target, target)
+
+    if activate:
+        activate_release(mission, release)
+    return release
+
+
+def activate_release(mission, release):
+    if not os.path.isdir(release_dir(mission, release)):
+        raise KeyError(release)
+    _write_atomic(os.path.join(releases_dir(mission), 'CURRENT'), release)
+
+
+def shadow_config(mission):
+    """The shadow candidate as {'release', 'sample_rate'}, or None"""
+    text = _read(os.path.join(releases_dir(mission), 'SHADOW'))
+    if not text:
+        return None
+    try:
+        config = json.loads(text)
+        return {'release': config['release'], 'sample_rate': float(config['sample_rate'])}
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def set_shadow(mission, release, sample_rate):
+    if not os.path.isdir(release_dir(mission, release)):
+        raise KeyError(release)
+    if not 0 < sample_rate <= 1:
+        raise ValueError('sample_rate must be in (0, 1]')
+    _write_atomic(os.path.join(releases_dir(mission), 'SHADOW'),
+                  json.dumps({'release': release, 'sample_rate': sample_rate}))
+
+
+def clear_shadow(mission):
+    try:
+        os.remove(os.path.join(releases_dir(mission), 'SHADOW'))
+    except FileNotFoundError:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage versioned ExoQuest model releases')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('list').add_argument('mission')
+    publish_cmd = commands.add_parser('publish')
+    publish_cmd.add_argument('mission')
+    publish_cmd.add_argument('--from', dest='source', default=model_module.MODEL_DIR,
+                             help='directory with the <mission>_*.pkl files (default models/)')
+    publish_cmd.add_argument('--no-activate', action='store_true')
+    activate_cmd = commands.add_parser('activate')
+    activate_cmd.add_argument('mission')
+    activate_cmd.add_argument('release')
+    shadow_cmd = commands.add_parser('shadow')
+    shadow_cmd.add_argument('mission')
+    shadow_cmd.add_argument('release')
+    shadow_cmd.add_argument('--sample-rate', type=float, default=0.1)
+    commands.add_parser('unshadow').add_argument('mission')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        current, shadow = current_release(args.mission), shadow_config(args.mission)
+        for release in list_releases(args.mission):
+            marks = [m for m, on in (('current', release == current),
+                                     ('shadow', shadow and release == shadow['release'])) if on]
+            print(release + (f"  ({', '.join(marks)})" if marks else ''))
+    elif args.command == 'publish':
+        release = publish(args.mission, args.source, activate=not args.no_activate)
+        print(f"Published {args.mission} release {release}{'' if args.no_activate else ' (current)'}")
+    elif args.command == 'activate':
+        activate_release(args.mission, args.release)
+    elif args.command == 'shadow':
+        set_shadow(args.mission, args.release, args.sample_rate)
+    elif args.command == 'unshadow':
+        clear_shadow(args.mission)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# SQLite's default limit on bound parameters is 999
+_SQL_BATCH = 500
+
+# Counting the disk rows is a full scan, so the size limit is only enforced
+# every this many writes
+_TRIM_EVERY = 20
+
+
+class PredictionCache:
+    """Caches class probabilities per row, keyed by the row's model input.
+
+    Keys are a 128-bit BLAKE2b digest of a namespace (mission, model version
+    and input dtype) followed by the bytes of the preprocessed feature vector,
+    so a row hits the cache whenever the same values are scored by the same
+    model, whatever file it came from. The in-process tier is an LRU of up to
+    ``max_rows`` entries; with ``disk_path`` set a SQLite file (shared by all
+    server processes) holds up to ``max_disk_rows`` more.
+    """
+
+    def __init__(self, max_rows=100000, disk_path=None, max_disk_rows=1000000):
+        self.max_rows = max_rows
+        self.disk_path = disk_path
+        self.max_disk_rows = max_disk_rows
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            # A throwaway connection, so a process forked after this (gunicorn
+            # preload_app) does not inherit an open one
+            db = sqlite3.connect(disk_path, timeout=5)
+            with db:
+                db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                           '(key BLOB PRIMARY KEY, proba BLOB, used REAL)')
+                db.execute('CREATE INDEX IF NOT EXISTS predictions_used ON predictions (used)')
+            db.close()
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.disk_path, timeout=5)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def keys(namespace, X):
+        """Digest every row of a C-contiguous matrix under a namespace"""
+        X = np.ascontiguousarray(X)
+        prefix = hashlib.blake2b(f'{namespace}|{X.dtype.str}|{X.shape[1]}|'.encode(), digest_size=16)
+        keys = []
+        for row in X:
+            h = prefix.copy()
+            h.update(row)
+            keys.append(h.digest())
+        return keys
+
+    def lookup(self, keys, n_classes):
+        """Return (probabilities, indices of rows that were not cached)"""
+        proba = np.empty((len(keys), n_classes))
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self._entries.get(key)
+                if value is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    proba[i] = value
+            self.counters['hits'] += len(keys) - len(missing)
+
+        if missing and self.disk_path:
+            found = self._disk_lookup([keys[i] for i in missing])
+            if found:
+                still_missing = []
+                promoted = {}
+                for i in missing:
+                    value = found.get(keys[i])
+                    if value is None:
+                        still_missing.append(i)
+                    else:
+                        proba[i] = value
+                        promoted[keys[i]] = value
+                self._remember(promoted)
+                with self._lock:
+                    self.counters['disk_hits'] += len(missing) - len(still_missing)
+                missing = still_missing
+
+        with self._lock:
+            self.counters['misses'] += len(missing)
+        return proba, np.asarray(missing, dtype=np.intp)
+
+    def store(self, keys, proba):
+        entries = dict(zip(keys, np.asarray(proba, dtype=np.float64)))
+        self._remember(entries)
+        if self.disk_path and entries:
+            self._disk_store(entries)
+
+    def _remember(self, entries):
+        if not self.max_rows:
+            return
+        with self._lock:
+            for key, value in entries.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            overflow = len(self._entries) - self.max_rows
+            for _ in range(max(overflow, 0)):
+                self._entries.popitem(last=False)
+            self.counters['evictions'] += max(overflow, 0)
+
+    def _disk_lookup(self, keys):
+        found = {}
+        try:
+            db = self._connection()
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start:start + _SQL_BATCH]
+                rows = db.execute('SELECT key, proba FROM predictions WHERE key IN (%s)'
+                                  % ','.join('?' * len(batch)), batch).fetchall()
+                for key, blob in rows:
+                    found[bytes(key)] = np.frombuffer(blob, dtype=np.float64)
+            if found:
+                with db:
+                    db.executemany('UPDATE predictions SET used = ? WHERE key = ?',
+                                   [(time.time(), key) for key in found])
+        except sqlite3.Error:
+            # The disk tier is best effort, a locked or broken file is a miss
+            return {}
+        return found
+
+    def _disk_store(self, entries):
+        now = time.time()
+        try:
+            db = self._connection()
+            with db:
+                db.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)',
+                               [(key, value.tobytes(), now) for key, value in entries.items()])
+                self._writes += 1
+                if self._writes % _TRIM_EVERY:
+                    return
+                count = db.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+                if count > self.max_disk_rows:
+                    db.execute('DELETE FROM predictions WHERE key IN '
+                               '(SELECT key FROM predictions ORDER BY used LIMIT ?)',
+                               (count - self.max_disk_rows,))
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, entries=len(self._entries), max_rows=self.max_rows)
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['disk_hits']) / lookups, 4) if lookups else None
+        stats['disk_path'] = self.disk_path
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+
+class PreprocessingPlan:
+    """A mission's preprocessing steps compiled into flat NumPy arrays.
+
+    The plan reproduces, in order: log1p of the log features, median
+    imputation, one-hot encoding of the categorical columns (unknown values
+    encode as all zeros, like ``OneHotEncoder(handle_unknown='ignore')``) and
+    standard scaling. ``transform`` writes a batch straight into one
+    contiguous matrix without building intermediate DataFrames.
+
+    The medians are applied after the log transform because the training
+    notebooks computed them on the already transformed columns.
+    """
+
+    def __init__(self, num_cols, medians, mean, scale, log_features=(),
+                 cat_cols=(), categories=(), dtype=np.float64):
+        self.num_cols = list(num_cols)
+        self.cat_cols = list(cat_cols)
+        self.dtype = np.dtype(dtype)
+
+        self.medians = np.asarray(medians, dtype=self.dtype)
+        self.log_index = np.array([i for i, col in enumerate(self.num_cols) if col in set(log_features)],
+                                  dtype=np.intp)
+        self.mean = np.asarray(mean, dtype=self.dtype)
+        self.scale = np.asarray(scale, dtype=self.dtype)
+
+        # Per categorical column: the known (non-missing) categories, the
+        # output column of each, and the output column for missing values
+        self.categories = []
+        offset = len(self.num_cols)
+        for cats in categories:
+            known = [c for c in cats if not pd.isna(c)]
+            missing = [i for i, c in enumerate(cats) if pd.isna(c)]
+            index = np.array([offset + i for i, c in enumerate(cats) if not pd.isna(c)], dtype=np.intp)
+            self.categories.append((pd.Index(known), index, offset + missing[0] if missing else None))
+            offset += len(cats)
+        self.n_features = offset
+
+        if len(self.mean) != self.n_features:
+            raise ValueError(f'Scaler expects {len(self.mean)} features, plan produces {self.n_features}')
+
+    @classmethod
+    def from_artifacts(cls, num_cols, medians, scaler, log_features=(), cat_cols=(),
+                       encoder=None, dtype=np.float64):
+        """Compile a plan from the fitted medians, scaler and optional encoder
+
+        The scaler's mean and scale pair with the plan's columns by position,
+        as in the ``scaler.transform(X.values)`` the served models were
+        trained on, whatever column names the scaler recorded.
+        """
+        n = scaler.n_features_in_
+        mean = scaler.mean_ if scaler.with_mean and scaler.mean_ is not None else np.zeros(n)
+        scale = scaler.scale_ if scaler.with_std and scaler.scale_ is not None else np.ones(n)
+        return cls(
+            num_cols,
+            medians.reindex(num_cols).to_numpy(dtype=float),
+            mean,
+            scale,
+            log_features=log_features,
+            cat_cols=cat_cols,
+            categories=encoder.categories_ if encoder is not None else (),
+            dtype=dtype
+        )
+
+    def transform(self, df):
+        """Turn a batch of raw rows into the scaled model input matrix"""
+        n = len(df)
+        n_num = len(self.num_cols)
+        X = np.zeros((n, self.n_features), dtype=self.dtype)
+
+        num = X[:, :n_num]
+        for j, col in enumerate(self.num_cols):
+            num[:, j] = df[col].to_numpy(dtype=self.dtype, na_value=np.nan)
+
+        if len(self.log_index):
+            num[:, self.log_index] = np.log1p(num[:, self.log_index])
+        np.copyto(num, self.medians, where=np.isnan(num))
+
+        rows = np.arange(n)
+        for col, (known, index, missing) in zip(self.cat_cols, self.categories):
+            values = df[col]
+            codes = known.get_indexer(values)
+            hit = codes >= 0
+            X[rows[hit], index[codes[hit]]] = 1
+            if missing is not None:
+                X[values.isna().to_numpy(), missing] = 1
+
+        X -= self.mean
+        X /= self.scale
+        return X
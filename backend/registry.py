@@ -0,0 +1,282 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import model as model_module
+import model_store
+from model import ExoplanetModel
+from shadow import ShadowScorer
+
+MISSIONS = ('kepler', 'k2', 'tess')
+
+
+def _rss_bytes():
+    """Return the resident set size of this process, or None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _artifact_paths(mission, model_dir):
+    paths = [os.path.join(model_dir, name)
+             for name in sorted(os.listdir(model_dir))
+             if name.startswith(mission + '_') and name.endswith('.pkl')]
+    flat_dir = model_module.ensemble_dir(model_dir, mission)
+    if os.path.isdir(flat_dir):
+        paths += [os.path.join(flat_dir, name) for name in sorted(os.listdir(flat_dir))]
+    return paths
+
+
+class ModelRegistry:
+    """Loads mission models on first use and keeps them under a memory budget.
+
+    Missions are loaded lazily by ``get``. ``preload`` loads them eagerly, which
+    is meant to run in the gunicorn master (``preload_app``) so forked workers
+    share the model pages copy-on-write. When ``memory_budget`` (bytes) is set,
+    the least recently used missions are evicted once the resident size of the
+    loaded models exceeds it.
+
+    Models are loaded from the mission's current release (see model_store.py).
+    With ``poll_interval`` (seconds) set, ``get`` checks the release pointers
+    at most that often; when the current release changes the new one is loaded
+    on a background thread and swapped in, while requests keep being served by
+    the old one, and a shadow candidate is loaded into ``shadow``.
+
+    Served models record what they score into ``stats`` (a DashboardStats),
+    shadow candidates do not.
+    """
+
+    def __init__(self, missions=MISSIONS, memory_budget=None, poll_interval=0, stats=None):
+        self.missions = tuple(missions)
+        self.memory_budget = memory_budget or None
+        self.poll_interval = poll_interval
+        self.dashboard_stats = stats
+        self.shadow = ShadowScorer()
+        self._models = OrderedDict()
+        self._stats = {m: {'loads': 0, 'evictions': 0, 'reloads': 0, 'load_time_ms': None,
+                           'size_bytes': None, 'last_used': None, 'reload_error': None}
+                       for m in self.missions}
+        self._lock = threading.RLock()
+        self._load_locks = {m: threading.Lock() for m in self.missions}
+        self._polled = {m: (0.0, None) for m in self.missions}
+        self._reloading = set()
+
+    def __contains__(self, mission):
+        return mission in self.missions
+
+    def is_available(self, mission):
+        """Whether the serialized model for a mission exists on disk"""
+        try:
+            return model_module.model_available(mission, model_store.active_dir(mission))
+        except KeyError:
+            return False
+
+    def is_loaded(self, mission):
+        return mission in self._models
+
+    def get(self, mission):
+        """Return the model for a mission, loading it if necessary"""
+        if mission not in self.missions:
+            raise KeyError(f'Unknown model type: {mission}')
+
+        if self.poll_interval:
+            self._poll(mission)
+
+        with self._lock:
+            model = self._models.get(mission)
+            if model is not None:
+                self._touch(mission)
+                return model
+
+        # Per-mission lock so a slow load does not block the other missions
+        with self._load_locks[mission]:
+            with self._lock:
+                model = self._models.get(mission)
+                if model is not None:
+                    self._touch(mission)
+                    return model
+            model = self._load(mission)
+            with self._lock:
+                self._models[mission] = model
+                self._touch(mission)
+                self._evict(keep=mission)
+            return model
+
+    def version(self, mission):
+        """Response version (see ExoplanetModel.response_version) of the model
+        serving a mission, or None while none is loaded.
+
+        Checks the release pointers like ``get`` but never loads a model.
+        """
+        if self.poll_interval:
+            self._poll(mission)
+        with self._lock:
+            model = self._models.get(mission)
+        return model.response_version if model is not None else None
+
+    def reload(self, mission, release=None, wait=False):
+        """Load a release (default: the current one) and swap it in atomically.
+
+        Runs on a background thread unless ``wait`` is set; requests keep
+        being served by the previous model until the new one is ready.
+        Returns False when a reload of the mission is already running.
+        """
+        with self._lock:
+            if mission in self._reloading:
+                return False
+            self._reloading.add(mission)
+
+        def run():
+            try:
+                model = self._load(mission, release)
+            except Exception as e:
+                with self._lock:
+                    self._stats[mission]['reload_error'] = str(e)
+                return
+            finally:
+                with self._lock:
+                    self._reloading.discard(mission)
+            with self._lock:
+                self._models[mission] = model
+                self._touch(mission)
+                self._stats[mission]['reloads'] += 1
+                self._stats[mission]['reload_error'] = None
+                self._evict(keep=mission)
+
+        if wait:
+            run()
+        else:
+            threading.Thread(target=run, daemon=True, name=f'reload-{mission}').start()
+        return True
+
+    def start_shadow(self, mission, release, sample_rate, wait=False):
+        """Load a candidate release and start scoring sampled traffic with it.
+
+        Loads on a background thread unless ``wait`` is set.
+        """
+        def run():
+            try:
+                model = self._load(mission, release, record=False)
+            except Exception as e:
+                with self._lock:
+                    self._stats[mission]['reload_error'] = f'shadow {release}: {e}'
+                return
+            self.shadow.configure(mission, model, release, sample_rate)
+
+        if wait:
+            run()
+        else:
+            threading.Thread(target=run, daemon=True, name=f'shadow-load-{mission}').start()
+
+    def _poll(self, mission):
+        now = time.monotonic()
+        with self._lock:
+            checked_at, seen = self._polled[mission]
+            if now - checked_at < self.poll_interval:
+                return
+            self._polled[mission] = (now, seen)
+        pointers = model_store.pointer_mtime(mission)
+        if pointers == seen:
+            return
+        with self._lock:
+            self._polled[mission] = (now, pointers)
+            loaded = self._models.get(mission)
+
+        current = model_store.current_release(mission)
+        if loaded is not None and getattr(loaded, 'release', None) != current:
+            self.reload(mission)
+
+        config = model_store.shadow_config(mission)
+        if config is None:
+            self.shadow.clear(mission)
+        elif (config['release'], config['sample_rate']) != self.shadow.current(mission):
+            self.start_shadow(mission, config['release'], config['sample_rate'])
+
+    def preload(self, missions=None):
+        """Eagerly load missions, skipping those without artifacts on disk"""
+        for mission in missions or self.missions:
+            if self.is_available(mission):
+                self.get(mission)
+        # Keep the loaded objects out of the collector's generations so that
+        # workers forked from this process do not dirty the shared pages
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def evict(self, mission):
+        """Drop a loaded mission; it is reloaded on its next use"""
+        with self._lock:
+            if self._models.pop(mission, None) is not None:
+                self._stats[mission]['evictions'] += 1
+                return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            resident = sum(self._stats[m]['size_bytes'] or 0 for m in self._models)
+            missions = {}
+            for m, s in self._stats.items():
+                model = self._models.get(m)
+                cache = getattr(model, 'cache', None)
+                missions[m] = dict(s, loaded=model is not None, available=self.is_available(m),
+                                   version=getattr(model, 'version', None),
+                                   release=getattr(model, 'release', None),
+                                   reloading=m in self._reloading,
+                                   cache=cache.stats() if cache is not None else None)
+            return {
+                'memory_budget_bytes': self.memory_budget,
+                'resident_bytes': resident,
+                'missions': missions,
+                'shadow': self.shadow.stats()
+            }
+
+    def _touch(self, mission):
+        self._models.move_to_end(mission)
+        self._stats[mission]['last_used'] = time.time()
+
+    def _load(self, mission, release=None, record=True):
+        release = release or model_store.current_release(mission)
+        model_dir = model_store.active_dir(mission, release)
+        rss_before = _rss_bytes()
+        start = time.perf_counter()
+        model = ExoplanetModel(mission, model_dir)
+        model.release = release
+        elapsed = time.perf_counter() - start
+        rss_after = _rss_bytes()
+        if not record:
+            return model
+        model.stats = self.dashboard_stats
+        metrics.model_load_seconds.observe(elapsed, mission=mission)
+
+        size = None
+        if rss_before is not None and rss_after is not None:
+            size = rss_after - rss_before
+        if not size or size <= 0:
+            # RSS did not grow (pages reused from an evicted model), fall back
+            # to the on-disk size of the artifacts
+            size = sum(os.path.getsize(p) for p in _artifact_paths(mission, model_dir))
+
+        with self._lock:
+            stats = self._stats[mission]
+            stats['loads'] += 1
+            stats['load_time_ms'] = round(elapsed * 1000, 2)
+            stats['size_bytes'] = size
+        return model
+
+    def _evict(self, keep):
+        if not self.memory_budget:
+            return
+        resident = sum(self._stats[m]['size_bytes'] or 0 for m in self._models)
+        for mission in list(self._models):
+            if resident <= self.memory_budget:
+                break
+            if mission == keep:
+                continue
+            self._models.pop(mission)
+            self._stats[mission]['evictions'] += 1
+            resident -= self._stats[mission]['size_bytes'] or 0
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def upload_digest(stream, chunk_size=1 << 20):
+    """BLAKE2b digest of an upload's bytes; the stream is rewound afterwards"""
+    h = hashlib.blake2b(digest_size=16)
+    for block in iter(lambda: stream.read(chunk_size), b''):
+        h.update(block)
+    stream.seek(0)
+    return h.digest()
+
+
+def response_key(digest, mission, version, options):
+    """Key (and ETag) of a response: upload digest, mission, model version and request options"""
+    h = hashlib.blake2b(digest, digest_size=16)
+    h.update(f'|{mission}|{version}|{options!r}'.encode())
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """Encoded /api/predict responses keyed by the upload and the model that scored it.
+
+    The key covers the upload bytes, the mission, the model version and the
+    request options, so a repeated upload is answered with one hash and one
+    lookup, and a response can never be served for another model version.
+    In-process entries of older versions are also dropped as soon as a
+    mission is seen with a new one. The in-process tier is an LRU bounded by
+    ``max_bytes`` of response bodies; with ``disk_path`` set a SQLite file
+    shared by all server processes holds up to ``max_disk_bytes`` more, the
+    least recently used entries going first.
+    """
+
+    def __init__(self, max_bytes=64 << 20, disk_path=None, max_disk_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            # A throwaway connection, so a process forked after this (gunicorn
+            # preload_app) does not inherit an open one
+            db = sqlite3.connect(disk_path, timeout=5)
+            with db:
+                db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, mission TEXT, '
+                           'version TEXT, mimetype TEXT, rows INTEGER, body BLOB, size INTEGER, used REAL)')
+                db.execute('CREATE INDEX IF NOT EXISTS responses_used ON responses (used)')
+            db.close()
+
+    @property
+    def enabled(self):
+        return bool(self.max_bytes or self.disk_path)
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.disk_path, timeout=5)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    def not_modified(self):
+        with self._lock:
+            self.counters['not_modified'] += 1
+
+    def _check_version(self, mission, version):
+        """Drop this process's entries of a mission's previous model once a new
+        version shows up. The shared disk tier is left to its size bound: other
+        workers may still serve the previous version during a rollout, and the
+        version is part of every key anyway."""
+        with self._lock:
+            previous = self._versions.get(mission)
+            self._versions[mission] = version
+            if previous is None or previous == version:
+                return
+            stale = [key for key, entry in self._entries.items()
+                     if entry[0] == mission and entry[1] != version]
+            for key in stale:
+                self._size -= len(self._entries.pop(key)[4])
+
+    def get(self, key, mission, version):
+        """(body, mimetype, rows) of a cached response, or None"""
+        self._check_version(mission, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return entry[4], entry[2], entry[3]
+
+        if self.disk_path:
+            try:
+                db = self._connection()
+                row = db.execute('SELECT mimetype, rows, body FROM responses WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    with db:
+                        db.execute('UPDATE responses SET used = ? WHERE key = ?', (time.time(), key))
+            except sqlite3.Error:
+                # The disk tier is best effort, a locked or broken file is a miss
+                row = None
+            if row is not None:
+                mimetype, rows, body = row[0], row[1], bytes(row[2])
+                self._remember(key, mission, version, mimetype, rows, body)
+                with self._lock:
+                    self.counters['disk_hits'] += 1
+                return body, mimetype, rows
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, key, mission, version, body, mimetype, rows):
+        self._check_version(mission, version)
+        self._remember(key, mission, version, mimetype, rows, body)
+        if self.disk_path and len(body) <= self.max_disk_bytes:
+            self._disk_store(key, mission, version, mimetype, rows, body)
+
+    def _remember(self, key, mission, version, mimetype, rows, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[4])
+            self._entries[key] = (mission, version, mimetype, rows, body)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, entry = self._entries.popitem(last=False)
+                self._size -= len(entry[4])
+                self.counters['evictions'] += 1
+
+    def _disk_store(self, key, mission, version, mimetype, rows, body):
+        try:
+            db = self._connection()
+            with db:
+                db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (key, mission, version, mimetype, rows, body, len(body), time.time()))
+                # Responses are large and few, so the total is checked on every write
+                total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+                if total > self.max_disk_bytes:
+                    excess = total - self.max_disk_bytes
+                    victims, freed = [], 0
+                    for victim, size in db.execute('SELECT key, size FROM responses ORDER BY used'):
+                        if freed >= excess:
+                            break
+                        victims.append((victim,))
+                        freed += size
+                    db.executemany('DELETE FROM responses WHERE key = ?', victims)
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, entries=len(self._entries), size_bytes=self._size,
+                         max_bytes=self.max_bytes)
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['disk_hits']) / lookups, 4) if lookups else None
+        stats['disk_path'] = self.disk_path
+        return stats
@@ -0,0 +1,92 @@
+"""
+Encoders for the bulk response formats of /api/predict.
+
+Each encoder takes the result columns (one NumPy array per output field, with
+missing display values as NaN) and writes them out in one pass per column,
+without building a dict per row. Arrow and Parquet need the optional
+``pyarrow`` package.
+"""
+
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Formats handled here; 'json' (one object per row) stays in app.py
+FORMATS = ('columnar', 'csv', 'arrow', 'parquet')
+BINARY_FORMATS = ('arrow', 'parquet')
+
+MIMETYPES = {
+    'columnar': 'application/json',
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def available(output_format):
+    return output_format not in BINARY_FORMATS or pa is not None
+
+
+def _json_array(values):
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        # tolist() and the C JSON encoder do the per-value work; NaN and
+        # infinities are the only non-JSON tokens a float array can produce
+        text = json.dumps(values.tolist())
+        if not np.isfinite(values).all():
+            text = text.replace('NaN', 'null').replace('-Infinity', 'null').replace('Infinity', 'null')
+        return text
+    return json.dumps(values.tolist())
+
+
+def encode_columnar(columns, header):
+    """JSON object with the ``header`` fields and one array per result column"""
+    fields = ','.join(f'{json.dumps(name)}:{_json_array(values)}' for name, values in columns.items())
+    head = json.dumps(header)[:-1] + (',' if header else '')
+    return f'{head}"columns":{{{fields}}}}}'
+
+
+def encode_csv(columns):
+    return pd.DataFrame(columns, copy=False).to_csv(index=False, na_rep='')
+
+
+def _table(columns):
+    return pa.table({name: pa.array(values, from_pandas=True) for name, values in columns.items()})
+
+
+def encode_arrow(columns):
+    """Arrow IPC stream with a single record batch"""
+    table = _table(columns)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_parquet(columns):
+    buffer = io.BytesIO()
+    pq.write_table(_table(columns), buffer)
+    return buffer.getvalue()
+
+
+def encode(columns, output_format, header):
+    """Encode result columns; returns (body, mimetype)"""
+    if output_format == 'columnar':
+        body = encode_columnar(columns, header)
+    elif output_format == 'csv':
+        body = encode_csv(columns)
+    elif output_format == 'arrow':
+        body = encode_arrow(columns)
+    elif output_format == 'parquet':
+        body = encode_parquet(columns)
+    else:
+        raise ValueError(f'Unknown format {output_format}')
+    return body, MIMETYPES[output_format]
@@ -0,0 +1,115 @@
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+
+
+class ShadowScorer:
+    """Scores a sample of live requests with a candidate model, off the response path.
+
+    ``offer`` is called after a request has been scored by the live model.
+    With probability ``sample_rate`` it queues the request's rows and the live
+    labels and scores, and returns immediately; a background thread rescores
+    them with the candidate and records how often the two models agree. When
+    the queue is full the sample is dropped rather than delaying the response.
+    """
+
+    def __init__(self, max_queue=16):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._candidates = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def configure(self, mission, model, release, sample_rate):
+        """Start (or replace) the candidate for a mission, resetting its statistics"""
+        with self._lock:
+            self._candidates[mission] = (model, release, sample_rate)
+            self._stats[mission] = {
+                'release': release, 'sample_rate': sample_rate, 'started_at': time.time(),
+                'requests': 0, 'rows': 0, 'agreed_rows': 0, 'dropped': 0, 'errors': 0,
+                'score_abs_diff_sum': 0.0, 'shadow_seconds': 0.0, 'confusion': {}
+            }
+
+    def clear(self, mission):
+        with self._lock:
+            self._candidates.pop(mission, None)
+            self._stats.pop(mission, None)
+
+    def current(self, mission):
+        """(release, sample_rate) of the mission's candidate, or None"""
+        with self._lock:
+            candidate = self._candidates.get(mission)
+            return candidate[1:] if candidate else None
+
+    def offer(self, mission, df, live_columns):
+        """Queue a scored request for shadow scoring if it is sampled; never blocks"""
+        with self._lock:
+            candidate = self._candidates.get(mission)
+            if candidate is None or not len(df) or random.random() >= candidate[2]:
+                return False
+            self._ensure_thread()
+        try:
+            self._queue.put_nowait((mission, candidate, df, live_columns['classification'],
+                                    live_columns['Porbability Score']))
+            return True
+        except queue.Full:
+            with self._lock:
+                if mission in self._stats:
+                    self._stats[mission]['dropped'] += 1
+            return False
+
+    def _ensure_thread(self):
+        # Started lazily so that each forked server process gets its own thread
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True, name='shadow-scorer')
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            mission, candidate, df, live_labels, live_scores = self._queue.get()
+            model = candidate[0]
+            start = time.perf_counter()
+            try:
+                columns = model.predict_columns(df)
+            except Exception:
+                with self._lock:
+                    if self._candidates.get(mission) is candidate:
+                        self._stats[mission]['errors'] += 1
+                continue
+            self._record(mission, candidate, live_labels, live_scores, columns,
+                         time.perf_counter() - start)
+
+    def _record(self, mission, candidate, live_labels, live_scores, columns, elapsed):
+        shadow_labels = columns['classification']
+        agreed = int(np.count_nonzero(shadow_labels == live_labels))
+        score_diff = float(np.abs(columns['Porbability Score'] - live_scores).sum())
+        pairs, counts = np.unique(np.stack([live_labels.astype(str), shadow_labels.astype(str)]),
+                                  axis=1, return_counts=True)
+        with self._lock:
+            # Results for a candidate that has since been replaced are discarded
+            if self._candidates.get(mission) is not candidate:
+                return
+            stats = self._stats[mission]
+            stats['requests'] += 1
+            stats['rows'] += len(live_labels)
+            stats['agreed_rows'] += agreed
+            stats['score_abs_diff_sum'] += score_diff
+            stats['shadow_seconds'] += elapsed
+            for (live, shadow), count in zip(pairs.T, counts):
+                confusion = stats['confusion'].setdefault(live, {})
+                confusion[shadow] = confusion.get(shadow, 0) + int(count)
+
+    def stats(self):
+        with self._lock:
+            missions = {}
+            for mission, s in self._stats.items():
+                s = dict(s, confusion={k: dict(v) for k, v in s['confusion'].items()})
+                rows = s['rows']
+                s['agreement'] = round(s['agreed_rows'] / rows, 4) if rows else None
+                s['mean_score_abs_diff'] = round(s.pop('score_abs_diff_sum') / rows, 4) if rows else None
+                s['mean_shadow_ms'] = round(s.pop('shadow_seconds') * 1000 / s['requests'], 2) if s['requests'] else None
+                missions[mission] = s
+            return {'pending': self._queue.qsize(), 'missions': missions}
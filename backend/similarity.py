@@ -0,0 +1,185 @@
+"""
+Nearest confirmed objects in a mission's model feature space.
+
+For each mission a KD-tree (a ball tree for wide feature spaces, where KD-trees
+degrade) is built over the CONFIRMED rows of its training catalog, transformed
+by the same PreprocessingPlan the model is served with, and saved next to the
+model as ``<mission>_similar.pkl``. train_models.py builds it after training;
+for models trained elsewhere run:
+
+    python similarity.py [kepler k2 tess] [--data-dir data]
+
+The server memory-maps the tree's arrays, so the index costs no load time and
+is shared between workers, and queries a whole batch in one call. How much of
+the catalog a query visits depends on the dimension: the trees prune well in
+the narrow TESS space, but in the 70-plus scaled dimensions of Kepler and K2
+a query can come close to a scan of the catalog.
+"""
+
+import argparse
+import os
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree, KDTree
+
+import ingest
+from tree_engine import file_sha256
+
+# Catalog column with a readable name for each confirmed object
+NAME_COLUMNS = {'kepler': 'kepler_name', 'k2': 'pl_name', 'tess': 'toi'}
+
+# KD-trees lose their edge over brute force in more dimensions than this
+KD_TREE_MAX_DIMS = 20
+
+MAX_NEIGHBORS = 50
+
+
+def index_path(model_dir, mission):
+    return os.path.join(model_dir, f'{mission}_similar.pkl')
+
+
+def _finite(X):
+    # Values the plan leaves missing (a column with no median) sit at the
+    # scaled mean, which is 0
+    return np.nan_to_num(np.asarray(X, dtype=np.float64), nan=0.0, posinf=0.0, neginf=0.0)
+
+
+class SimilarityIndex:
+    """A spatial tree over catalog rows plus the id and name of each row"""
+
+    def __init__(self, tree, star_ids, names, meta=None):
+        self.tree = tree
+        self.star_ids = star_ids
+        self.names = names
+        self.meta = meta or {}
+
+    @property
+    def size(self):
+        return len(self.star_ids)
+
+    @classmethod
+    def build(cls, X, star_ids, names, meta=None, leaf_size=40):
+        X = np.ascontiguousarray(_finite(X))
+        tree_cls = KDTree if X.shape[1] <= KD_TREE_MAX_DIMS else BallTree
+        return cls(tree_cls(X, leaf_size=leaf_size), np.asarray(star_ids, dtype=object),
+                   np.asarray(names, dtype=object), meta)
+
+    def save(self, path):
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        # Uncompressed, so that load() can memory-map the tree arrays
+        joblib.dump({'tree': self.tree, 'star_ids': self.star_ids, 'names': self.names,
+                     'meta': self.meta}, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        state = joblib.load(path, mmap_mode='r')
+        return cls(state['tree'], state['star_ids'], state['names'], state['meta'])
+
+    def neighbors(self, X, k):
+        """The k nearest catalog rows of every row of X, one list of dicts per row"""
+        if len(X) == 0:
+            return np.empty(0, dtype=object)
+        k = max(1, min(int(k), MAX_NEIGHBORS, self.size))
+        # One call queries the whole batch
+        distances, indices = self.tree.query(_finite(X), k=k)
+        star_ids = self.star_ids.take(indices).tolist()
+        names = self.names.take(indices).tolist()
+        distances = np.round(distances, 4).tolist()
+        result = np.empty(len(indices), dtype=object)
+        for i, row in enumerate(zip(star_ids, names, distances)):
+            result[i] = [{'star_id': s, 'name': n, 'distance': d} for s, n, d in zip(*row)]
+        return result
+
+
+def load_index(mission, model_dir, num_cols=None):
+    """The mission's index, or None when it is missing or was built for another
+    scaler or, given ``num_cols``, another column order"""
+    path = index_path(model_dir, mission)
+    if not os.path.exists(path):
+        return None
+    index = SimilarityIndex.load(path)
+    scaler_path = os.path.join(model_dir, f'{mission}_scaler.pkl')
+    if index.meta.get('scaler_sha256') != file_sha256(scaler_path):
+        return None
+    if num_cols is not None and index.meta.get('num_cols') != list(num_cols):
+        return None
+    return index
+
+
+def read_confirmed(model, spec, filepath):
+    """The CONFIRMED rows of a training catalog, with the columns the index needs"""
+    name_column = NAME_COLUMNS.get(model.model_type)
+    dtypes = ingest.column_dtypes(model)
+    dtypes.update({spec['target']: str, name_column: str})
+    header = pd.read_csv(filepath, nrows=0, comment='#').columns
+    ingest.select_columns(model, header)
+    columns = [col for col in dtypes if col in header]
+    df = pd.read_csv(filepath, usecols=columns, dtype={col: dtypes[col] for col in columns}, comment='#')
+
+    labels = df[spec['target']].str.strip()
+    if 'labels' in spec:
+        labels = labels.map(spec['labels'])
+    return df[(labels == 'CONFIRMED').to_numpy()].reset_index(drop=True)
+
+
+def build_index(model, spec, filepath, confirmed=None):
+    """Index the confirmed objects of ``filepath`` in ``model``'s feature space.
+
+    ``confirmed`` is an already parsed ``(rows, X)`` pair, the id and name
+    columns of the CONFIRMED rows and their preprocessed features (as cached
+    by train_models.py); without it the catalog is read here.
+    """
+    if confirmed is None:
+        df = read_confirmed(model, spec, filepath)
+        X = model.preprocess_data(df)
+    else:
+        df, X = confirmed
+    if df.empty:
+        raise ValueError(f'No CONFIRMED rows in {filepath}')
+    name_column = NAME_COLUMNS.get(model.model_type)
+    names = (df[name_column].fillna('').to_numpy(dtype=object) if name_column in df
+             else np.full(len(df), '', dtype=object))
+    meta = {'scaler_sha256': file_sha256(os.path.join(model.model_dir, f'{model.model_type}_scaler.pkl')),
+            'source': os.path.basename(filepath), 'num_cols': list(model.plan.num_cols)}
+    return SimilarityIndex.build(X, model.star_ids(df), names, meta)
+
+
+def build_mission(mission, filepath, model_dir, confirmed=None):
+    from model import ExoplanetModel
+    from train_models import MISSIONS
+
+    index = build_index(ExoplanetModel(mission, model_dir), MISSIONS[mission], filepath, confirmed)
+    index.save(index_path(model_dir, mission))
+    return index
+
+
+def main(argv=None):
+    from model import BASE_DIR, MODEL_DIR
+    from train_models import MISSIONS
+
+    parser = argparse.ArgumentParser(description='Build the similar-object indexes of the mission models')
+    parser.add_argument('missions', nargs='*', help=f"default: {' '.join(MISSIONS)}")
+    parser.add_argument('--data-dir', default=os.path.join(BASE_DIR, 'data'))
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    args = parser.parse_args(argv)
+    unknown = [m for m in args.missions if m not in MISSIONS]
+    if unknown:
+        parser.error(f"unknown mission {', '.join(unknown)}")
+
+    for mission in args.missions or list(MISSIONS):
+        filepath = os.path.join(args.data_dir, MISSIONS[mission]['filename'])
+        if not os.path.exists(filepath):
+            print(f'{mission}: {filepath} not found, skipped')
+            continue
+        index = build_mission(mission, filepath, args.model_dir)
+        print(f'{mission}: indexed {index.size} confirmed objects '
+              f'({type(index.tree).__name__}, {index.tree.get_arrays()[0].shape[1]} features)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import ClientClosedRequest, DeadlineExceeded, InferenceExecutor, Overloaded  # noqa: E402
+
+
+@pytest.fixture
+def busy():
+    """An executor with its only worker held by a call until the test ends"""
+    executor = InferenceExecutor(max_workers=1, max_queue=1)
+    release, started = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(10)
+        return 'held'
+
+    future = executor.submit(hold)
+    started.wait(10)
+    yield executor
+    release.set()
+    future.result(10)
+
+
+def test_full_queue_is_rejected_with_retry_after(busy):
+    queued = busy.submit(lambda: 'queued')
+
+    with pytest.raises(Overloaded) as info:
+        busy.submit(lambda: 'rejected')
+    assert info.value.code == 429
+    assert info.value.retry_after > 0
+    assert int(dict(info.value.get_headers())['Retry-After']) > 0
+    with pytest.raises(Overloaded):
+        busy.check()
+    stats = busy.stats()
+    assert (stats['running'], stats['queued'], stats['rejected']) == (1, 1, 2)
+    queued.cancel()
+
+
+def test_queued_call_past_its_deadline_never_runs(busy):
+    ran = []
+
+    with pytest.raises(DeadlineExceeded) as info:
+        busy.run(ran.append, 1, deadline=time.monotonic() + 0.2)
+    assert info.value.code == 503
+    assert busy.stats()['cancelled'] == 1
+    assert not ran
+
+
+def test_expired_call_is_skipped_when_a_worker_frees_up():
+    executor = InferenceExecutor(max_workers=1, max_queue=1)
+    release = threading.Event()
+    executor.submit(release.wait, 10)
+    ran = []
+    future = executor.submit(ran.append, 1, deadline=time.monotonic() + 0.05)
+    time.sleep(0.1)
+    release.set()
+
+    with pytest.raises(DeadlineExceeded):
+        future.result(10)
+    assert not ran
+    assert executor.stats()['expired'] == 1
+
+
+def test_blocking_submit_gives_up_at_its_deadline(busy):
+    busy.submit(lambda: 'queued')
+
+    with pytest.raises(DeadlineExceeded):
+        busy.submit(lambda: 'late', block=True, deadline=time.monotonic() + 0.05)
+
+
+def test_disconnected_client_cancels_its_queued_call(busy):
+    ran = []
+
+    with pytest.raises(ClientClosedRequest) as info:
+        busy.run(ran.append, 1, disconnected=lambda: True)
+    assert info.value.code == 499
+    assert not ran
@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_score  # noqa: E402
+from batch_score import Checkpoint  # noqa: E402
+from model import K2_FEATURES  # noqa: E402
+
+IDENTITY = {'input': 'a.csv', 'mission': 'k2', 'model_version': 'abc'}
+
+
+def test_checkpoint_refuses_a_folder_with_other_files(tmp_path):
+    folder = tmp_path / 'catalog'
+    folder.mkdir()
+    (folder / 'notes.txt').write_text('keep me')
+
+    for restart in (False, True):
+        with pytest.raises(ValueError):
+            Checkpoint(str(folder), IDENTITY, 3, restart=restart)
+    assert (folder / 'notes.txt').read_text() == 'keep me'
+
+
+def test_checkpoint_restart_only_removes_its_own_files(tmp_path):
+    folder = tmp_path / 'catalog'
+    checkpoint = Checkpoint(str(folder), IDENTITY, 3)
+    checkpoint.mark(0, 10)
+    (folder / 'part-00000.csv').write_text('star_id\n')
+    (folder / 'notes.txt').write_text('keep me')
+
+    with pytest.raises(ValueError):
+        Checkpoint(str(folder), dict(IDENTITY, model_version='def'), 3)
+
+    checkpoint = Checkpoint(str(folder), dict(IDENTITY, model_version='def'), 3, restart=True)
+    assert checkpoint.done == set()
+    assert sorted(os.listdir(folder)) == ['_checkpoint.json', 'notes.txt']
+    with open(folder / '_checkpoint.json') as f:
+        assert json.load(f)['identity']['model_version'] == 'def'
+
+
+def _k2_catalog(path, n=60):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({col: rng.normal(1.0, 0.5, n) for col in K2_FEATURES})
+    df.insert(0, 'hostname', [f'K2-{i}' for i in range(n)])
+    df.to_csv(path, index=False)
+
+
+def test_resume_only_scores_unfinished_shards(tmp_path, capsys):
+    source = tmp_path / 'k2.csv'
+    _k2_catalog(source)
+    folder = tmp_path / 'scored' / 'k2'
+    # Shards of a few rows each, scored by one worker
+    argv = ['k2', str(source), '--output-dir', str(tmp_path / 'scored'), '--format', 'csv',
+            '--workers', '1', '--shard-mb', '0.005']
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        assert batch_score.main(argv) == 0
+    with open(folder / '_checkpoint.json') as f:
+        state = json.load(f)
+    assert state['shards'] > 2 and len(state['done']) == state['shards']
+    parts = sorted(name for name in os.listdir(folder) if name.startswith('part-'))
+    assert len(parts) == state['shards']
+
+    # An interrupted run: the last shard never finished
+    last = str(state['shards'] - 1)
+    rows = state['done'].pop(last)
+    with open(folder / '_checkpoint.json', 'w') as f:
+        json.dump(state, f)
+    os.remove(folder / parts[-1])
+    mtimes = {name: os.stat(folder / name).st_mtime_ns for name in parts[:-1]}
+    capsys.readouterr()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        assert batch_score.main(argv + ['--merge']) == 0
+
+    out = capsys.readouterr().out
+    assert f'resuming, {len(parts) - 1}/{len(parts)} shards already scored' in out
+    assert f'Scored {rows:,} rows' in out
+    assert {name: os.stat(folder / name).st_mtime_ns for name in parts[:-1]} == mtimes
+    merged = pd.read_csv(tmp_path / 'scored' / 'k2.csv')
+    assert list(merged['star_id']) == [f'K2-{i}' for i in range(60)]
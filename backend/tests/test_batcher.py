@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batcher import MicroBatcher  # noqa: E402
+from ingest import MissingColumnsError  # noqa: E402
+
+
+class FakeModel:
+    """Scores a row as twice its 'a' and rejects batches holding a negative 'a'"""
+    id_column = 'tid'
+    plan = SimpleNamespace(num_cols=['a', 'b'], cat_cols=[], dtype=np.dtype(np.float64))
+
+    def __init__(self):
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def predict_columns(self, df):
+        with self._lock:
+            self.batches.append((list(df.columns), len(df)))
+        if (df['a'] < 0).any():
+            raise ValueError('negative a')
+        return {'score': df['a'].to_numpy() * 2}
+
+
+def _rows(*values, **extra):
+    return [dict({'tid': i, 'a': a, 'b': 1.0}, **extra) for i, a in enumerate(values)]
+
+
+def _batcher(model, **kwargs):
+    return MicroBatcher(lambda mission: model, **kwargs)
+
+
+def test_concurrent_requests_are_scored_in_one_batch():
+    model = FakeModel()
+    batcher = _batcher(model, max_batch_rows=100, max_wait_ms=300)
+    futures = [batcher.submit('tess', _rows(i, i + 0.5)) for i in range(3)]
+
+    results = [future.result(10) for future in futures]
+
+    assert model.batches == [(['tid', 'a', 'b'], 6)]
+    for i, (df, columns) in enumerate(results):
+        assert df['a'].tolist() == [i, i + 0.5]
+        assert columns['score'].tolist() == [2 * i, 2 * i + 1]
+    assert batcher.stats()['batches'] == 1 and batcher.stats()['requests'] == 3
+
+
+def test_batches_stop_at_max_batch_rows():
+    model = FakeModel()
+    batcher = _batcher(model, max_batch_rows=4, max_wait_ms=300)
+    futures = [batcher.submit('tess', _rows(i, i)) for i in range(3)]
+
+    for i, future in enumerate(futures):
+        assert future.result(10)[1]['score'].tolist() == [2 * i, 2 * i]
+    assert [rows for _, rows in model.batches] == [4, 2]
+
+
+def test_failing_batch_falls_back_to_one_request_at_a_time():
+    model = FakeModel()
+    batcher = _batcher(model, max_batch_rows=100, max_wait_ms=300)
+    good, bad, other = (batcher.submit('tess', _rows(1)), batcher.submit('tess', _rows(-1)),
+                        batcher.submit('tess', _rows(3)))
+
+    assert good.result(10)[1]['score'].tolist() == [2]
+    assert other.result(10)[1]['score'].tolist() == [6]
+    with pytest.raises(ValueError):
+        bad.result(10)
+    assert [rows for _, rows in model.batches] == [3, 1, 1, 1]
+
+
+def test_fields_the_model_ignores_do_not_split_batches():
+    model = FakeModel()
+    batcher = _batcher(model, max_batch_rows=100, max_wait_ms=300)
+    plain, extra = batcher.submit('tess', _rows(1)), batcher.submit('tess', _rows(2, note='x'))
+
+    assert plain.result(10)[1]['score'].tolist() == [2]
+    assert extra.result(10)[1]['score'].tolist() == [4]
+    assert model.batches == [(['tid', 'a', 'b'], 2)]
+
+
+def test_requests_with_other_model_columns_are_not_merged():
+    model = FakeModel()
+    batcher = _batcher(model, max_batch_rows=100, max_wait_ms=300)
+    with_id = batcher.submit('tess', _rows(1))
+    without_id = batcher.submit('tess', [{'a': 2, 'b': 1.0}])
+    missing = batcher.submit('tess', [{'a': 3}])
+
+    assert with_id.result(10)[1]['score'].tolist() == [2]
+    assert without_id.result(10)[1]['score'].tolist() == [4]
+    with pytest.raises(MissingColumnsError):
+        missing.result(10)
+    assert sorted(model.batches) == [(['a', 'b'], 1), (['tid', 'a', 'b'], 1)]
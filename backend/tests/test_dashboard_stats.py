@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dashboard_stats import CONFIDENCE_BINS, DashboardStats  # noqa: E402
+
+# Flushing drops window buckets older than the wall clock allows
+NOW = int(time.time())
+
+
+def test_record_builds_class_counts_and_histograms():
+    stats = DashboardStats()
+    stats.record('k2', ['CONFIRMED', 'CANDIDATE', 'CONFIRMED'], [97.0, 12.5, 100.0], now=NOW)
+
+    snapshot = stats.snapshot(['k2', 'tess'], now=NOW)['k2']
+    assert snapshot['rows_scored'] == 3 and snapshot['requests'] == 1
+    assert snapshot['classification_distribution'] == {'CANDIDATE': 1, 'CONFIRMED': 2}
+    counts = snapshot['confidence_histogram']['counts']
+    # 100 falls in the last bin rather than past it
+    assert counts['CONFIRMED'][CONFIDENCE_BINS - 1] == 2 and sum(counts['CONFIRMED']) == 2
+    assert counts['CANDIDATE'][2] == 1
+    assert snapshot['rows_per_window']['minute'][-1] == {'start': NOW // 60 * 60, 'rows': 3}
+
+
+def test_counters_of_two_instances_merge_in_one_file(tmp_path):
+    path = str(tmp_path / 'stats.db')
+    first = DashboardStats(path, flush_interval=3600)
+    second = DashboardStats(path, flush_interval=3600)
+
+    first.record('k2', ['CONFIRMED', 'CANDIDATE'], [90.0, 40.0], now=NOW)
+    second.record('k2', ['CONFIRMED'], [91.0], now=NOW)
+    second.record('tess', ['FALSE POSITIVE'], [5.0], now=NOW)
+    # Each instance sees its own pending updates before they are flushed
+    assert first.snapshot(['k2'], now=NOW)['k2']['rows_scored'] == 2
+    first.flush()
+    second.flush()
+
+    for stats in (first, second, DashboardStats(path)):
+        snapshot = stats.snapshot(['k2', 'tess'], now=NOW)
+        assert snapshot['k2']['rows_scored'] == 3 and snapshot['k2']['requests'] == 2
+        assert snapshot['k2']['classification_distribution'] == {'CANDIDATE': 1, 'CONFIRMED': 2}
+        assert snapshot['k2']['confidence_histogram']['counts']['CONFIRMED'][18] == 2
+        assert snapshot['k2']['rows_per_window']['hour'][-1]['rows'] == 3
+        assert snapshot['tess']['classification_distribution'] == {'FALSE POSITIVE': 1}
+
+
+def test_flush_adds_to_the_stored_counters(tmp_path):
+    path = str(tmp_path / 'stats.db')
+    stats = DashboardStats(path, flush_interval=3600)
+    for _ in range(3):
+        stats.record('kepler', ['CANDIDATE'], [50.0], now=NOW)
+        stats.flush()
+
+    snapshot = DashboardStats(path).snapshot(['kepler'], now=NOW)['kepler']
+    assert snapshot['rows_scored'] == 3 and snapshot['requests'] == 3
+    assert snapshot['confidence_histogram']['counts']['CANDIDATE'][10] == 3
@@ -0,0 +1,81 @@
+import io
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest  # noqa: E402
+from ingest import MissingColumnsError, read_upload, select_columns  # noqa: E402
+
+
+def _model(dtype=np.float64):
+    return SimpleNamespace(id_column='tid',
+                           plan=SimpleNamespace(num_cols=['a', 'b'], cat_cols=['kind'], dtype=np.dtype(dtype)))
+
+
+def _upload():
+    # Archive exports carry many columns the mission never reads
+    return pd.DataFrame({'extra': ['x', 'y', 'z'], 'b': [1.5, np.nan, 3.0], 'tid': ['7', '8', '9'],
+                         'kind': ['p', None, 'q'], 'a': [0.25, 0.5, 0.75], 'comment': ['', 'n', 'm']})
+
+
+def _csv(df):
+    return io.BytesIO(df.to_csv(index=False).encode())
+
+
+def _parquet(df):
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def test_select_columns_projects_to_the_mission_columns():
+    assert select_columns(_model(), ['extra', 'b', 'tid', 'kind', 'a']) == ['tid', 'kind', 'a', 'b']
+    # The id column is optional
+    assert select_columns(_model(), ['a', 'b', 'kind']) == ['kind', 'a', 'b']
+
+
+def test_select_columns_lists_every_missing_column():
+    with pytest.raises(MissingColumnsError) as info:
+        select_columns(_model(), ['tid', 'b', 'extra'])
+    assert info.value.missing == ['a', 'kind']
+    assert isinstance(info.value, ValueError)
+
+
+@pytest.mark.parametrize('upload_fmt, encode', [('csv', _csv), ('parquet', _parquet)])
+def test_read_upload_reads_only_the_mission_columns(upload_fmt, encode):
+    if upload_fmt == 'parquet' and not ingest.available('parquet'):
+        pytest.skip('pyarrow is not installed')
+    df = read_upload(encode(_upload()), upload_fmt, _model(np.float32))
+
+    assert sorted(df.columns) == ['a', 'b', 'kind', 'tid']
+    assert df['a'].dtype == np.float32 and df['b'].dtype == np.float32
+    np.testing.assert_array_equal(df['a'], np.float32([0.25, 0.5, 0.75]))
+    assert np.isnan(df['b'][1])
+    assert list(df['tid']) == ['7', '8', '9']
+    assert df['kind'][0] == 'p' and pd.isna(df['kind'][1])
+
+
+@pytest.mark.parametrize('upload_fmt, encode', [('csv', _csv), ('parquet', _parquet)])
+def test_read_upload_rejects_missing_columns(upload_fmt, encode):
+    if upload_fmt == 'parquet' and not ingest.available('parquet'):
+        pytest.skip('pyarrow is not installed')
+    with pytest.raises(MissingColumnsError) as info:
+        read_upload(encode(_upload().drop(columns=['a'])), upload_fmt, _model())
+    assert info.value.missing == ['a']
+
+
+def test_csv_without_pyarrow_reads_the_same_columns(monkeypatch):
+    expected = read_upload(_csv(_upload()), 'csv', _model())
+    monkeypatch.setattr(ingest, 'pa', None)
+    df = read_upload(_csv(_upload()), 'csv', _model())
+
+    assert sorted(df.columns) == sorted(expected.columns)
+    pd.testing.assert_frame_equal(df[['tid', 'a', 'b']], expected[['tid', 'a', 'b']])
+    assert list(df['kind'].isna()) == list(expected['kind'].isna())
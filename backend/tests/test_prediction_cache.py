@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prediction_cache  # noqa: E402
+from model import K2_FEATURES, ExoplanetModel  # noqa: E402
+from prediction_cache import PredictionCache  # noqa: E402
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
+
+
+def _rows(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, 4))
+
+
+def _proba(n, seed=1):
+    p = np.random.default_rng(seed).random((n, 3))
+    return p / p.sum(axis=1, keepdims=True)
+
+
+def test_hits_and_misses():
+    cache = PredictionCache(max_rows=100)
+    X, proba = _rows(10), _proba(10)
+    keys = cache.keys('tess:v1', X)
+    cache.store(keys[:6], proba[:6])
+
+    found, missing = cache.lookup(keys, 3)
+
+    np.testing.assert_array_equal(missing, np.arange(6, 10))
+    np.testing.assert_array_equal(found[:6], proba[:6])
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (6, 4, 0.6)
+
+
+def test_keys_depend_on_namespace_and_dtype():
+    X = _rows(3)
+    keys = PredictionCache.keys('tess:v1', X)
+    assert keys == PredictionCache.keys('tess:v1', X.copy())
+    assert not set(keys) & set(PredictionCache.keys('tess:v2', X))
+    assert not set(keys) & set(PredictionCache.keys('k2:v1', X))
+    assert not set(keys) & set(PredictionCache.keys('tess:v1', X.astype(np.float32)))
+
+
+def test_new_model_version_never_hits_old_entries(tmp_path):
+    cache = PredictionCache(max_rows=100, disk_path=str(tmp_path / 'predictions.sqlite'))
+    X = _rows(5)
+    cache.store(cache.keys('tess:v1', X), _proba(5))
+
+    _, missing = cache.lookup(cache.keys('tess:v2', X), 3)
+    assert len(missing) == 5
+    cache.clear()
+    _, missing = cache.lookup(cache.keys('tess:v2', X), 3)
+    assert len(missing) == 5
+
+
+def test_lru_evicts_least_recently_used_rows():
+    cache = PredictionCache(max_rows=3)
+    keys = cache.keys('tess:v1', _rows(4))
+    proba = _proba(4)
+    cache.store(keys[:3], proba[:3])
+    cache.lookup(keys[:1], 3)  # row 0 becomes the most recently used
+    cache.store(keys[3:], proba[3:])
+
+    _, missing = cache.lookup(keys, 3)
+    np.testing.assert_array_equal(missing, [1])
+    assert cache.stats()['entries'] == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_disk_tier_serves_other_instances_and_stays_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(prediction_cache, '_TRIM_EVERY', 1)
+    path = str(tmp_path / 'predictions.sqlite')
+    writer = PredictionCache(max_rows=0, disk_path=path, max_disk_rows=4)
+    keys, proba = writer.keys('tess:v1', _rows(6)), _proba(6)
+    for i in range(6):
+        writer.store(keys[i:i + 1], proba[i:i + 1])
+
+    count = sqlite3.connect(path).execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+    assert count == 4
+
+    reader = PredictionCache(max_rows=10, disk_path=path)
+    found, missing = reader.lookup(keys, 3)
+    np.testing.assert_array_equal(missing, [0, 1])
+    np.testing.assert_array_equal(found[2:], proba[2:])
+    assert reader.stats()['disk_hits'] == 4
+    # Promoted into the in-process tier
+    reader.lookup(keys[2:], 3)
+    assert reader.stats()['hits'] == 4
+
+
+@pytest.fixture(scope='module')
+def k2_model():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return ExoplanetModel('k2', MODEL_DIR)
+
+
+def test_early_exit_rows_are_never_cached(k2_model):
+    rng = np.random.default_rng(0)
+    scaler = k2_model.scaler
+    df = pd.DataFrame({col: rng.normal(scaler.mean_[j], scaler.scale_[j], 300)
+                       for j, col in enumerate(K2_FEATURES)})
+    X = k2_model.preprocess_data(df)
+    k2_model.cache = PredictionCache(max_rows=1000)
+
+    proba, exited, _ = k2_model.predict_proba_early_exit(X)
+    assert exited.any() and not exited.all()
+
+    keys = k2_model.cache.keys(f'k2:{k2_model.version}', X)
+    cached, missing = k2_model.cache.lookup(keys, 3)
+    np.testing.assert_array_equal(missing, np.flatnonzero(exited))
+    np.testing.assert_allclose(cached[~exited], k2_model.model.predict_proba(X[~exited]), rtol=0, atol=1e-12)
+
+    # A repeat serves the full rows from the cache and estimates the others again
+    again, exited_again, _ = k2_model.predict_proba_early_exit(X)
+    np.testing.assert_array_equal(exited_again, exited)
+    np.testing.assert_array_equal(again, proba)
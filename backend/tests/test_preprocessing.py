@@ -0,0 +1,105 @@
+import os
+import sys
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import (K2_FEATURES, KEPLER_CAT_COLS, KEPLER_NUM_COLS, TESS_FEATURES,  # noqa: E402
+                   TESS_LOG_FEATURES, ExoplanetModel)
+from preprocessing import PreprocessingPlan  # noqa: E402
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
+
+
+def _catalog(columns, n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    # Every column on its own scale, so swapped statistics cannot go unnoticed
+    df = pd.DataFrame({col: rng.normal(10.0 * (i + 1), i + 1.0, n) for i, col in enumerate(columns)})
+    df.iloc[::7, 1] = np.nan
+    return df
+
+
+def _load(mission, name):
+    with warnings.catch_warnings():
+        # The bundled pickles come from an older scikit-learn
+        warnings.simplefilter('ignore')
+        return joblib.load(os.path.join(MODEL_DIR, f'{mission}_{name}.pkl'))
+
+
+def _rows(scaler, num_cols, log_features=(), n=500, seed=0):
+    """Complete rows drawn from the distribution the scaler was fitted on"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({col: rng.normal(scaler.mean_[j], scaler.scale_[j], n) for j, col in enumerate(num_cols)})
+    for col in log_features:
+        df[col] = np.expm1(df[col])
+    return df
+
+
+def test_plan_pairs_scaler_statistics_by_position():
+    num_cols = ['a', 'b', 'c', 'd']
+    df = _catalog(num_cols)
+    medians = df.median()
+    imputed = df.fillna(medians)
+    # Named columns in another order than the plan's still pair by position
+    scaler = StandardScaler().fit(imputed[['c', 'a', 'd', 'b']])
+
+    plan = PreprocessingPlan.from_artifacts(num_cols, medians, scaler)
+
+    np.testing.assert_allclose(plan.transform(df), scaler.transform(imputed[num_cols].to_numpy()))
+    assert plan.num_cols == num_cols
+
+
+# The baseline preprocess_data of each mission, for rows without missing values
+# (its fillna ran on a copy and never imputed anything)
+
+def test_tess_plan_matches_baseline_preprocessing():
+    scaler = _load('tess', 'scaler')
+    df = _rows(scaler, TESS_FEATURES, TESS_LOG_FEATURES)
+    plan = PreprocessingPlan.from_artifacts(TESS_FEATURES, _load('tess', 'medians'), scaler,
+                                            log_features=TESS_LOG_FEATURES)
+
+    X = df[TESS_FEATURES].copy()
+    for col in TESS_LOG_FEATURES:
+        X.loc[:, col] = np.log1p(X.loc[:, col])
+    np.testing.assert_allclose(plan.transform(df), scaler.transform(X.values), rtol=1e-12, atol=1e-12)
+
+
+def test_kepler_plan_matches_baseline_preprocessing():
+    scaler, encoder = _load('kepler', 'scaler'), _load('kepler', 'encoder')
+    df = _rows(scaler, KEPLER_NUM_COLS)
+    rng = np.random.default_rng(1)
+    for col, cats in zip(KEPLER_CAT_COLS, encoder.categories_):
+        df[col] = rng.choice(np.asarray([c for c in cats if not pd.isna(c)], dtype=object), len(df))
+    plan = PreprocessingPlan.from_artifacts(KEPLER_NUM_COLS, _load('kepler', 'medians'), scaler,
+                                            cat_cols=KEPLER_CAT_COLS, encoder=encoder)
+
+    X = df[KEPLER_NUM_COLS + KEPLER_CAT_COLS]
+    encoded = pd.DataFrame(encoder.transform(X[KEPLER_CAT_COLS]),
+                           columns=encoder.get_feature_names_out(KEPLER_CAT_COLS), index=X.index)
+    X_ohe = pd.concat([X[KEPLER_NUM_COLS], encoded], axis=1)
+    np.testing.assert_allclose(plan.transform(df), scaler.transform(X_ohe), rtol=1e-12, atol=1e-12)
+
+
+def test_k2_model_matches_baseline_preprocessing():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        model = ExoplanetModel('k2', MODEL_DIR)
+    df = _rows(model.scaler, K2_FEATURES)
+
+    baseline = model.scaler.transform(df[K2_FEATURES].values)
+    np.testing.assert_allclose(model.preprocess_data(df), baseline, rtol=1e-12, atol=1e-12)
+    assert (model.model.predict(model.preprocess_data(df)) == model.model.predict(baseline)).all()
+
+
+def test_plan_rejects_scaler_of_another_width():
+    df = _catalog(['a', 'b', 'c'])
+    scaler = StandardScaler().fit(df.fillna(0)[['a', 'b']])
+
+    with pytest.raises(ValueError):
+        PreprocessingPlan.from_artifacts(['a', 'b', 'c'], df.median(), scaler)
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import model as model_module  # noqa: E402
+import model_store  # noqa: E402
+import registry  # noqa: E402
+from registry import ModelRegistry  # noqa: E402
+
+
+class FakeModel:
+    """Stands in for ExoplanetModel; remembers which directory it came from"""
+
+    def __init__(self, mission, model_dir):
+        self.mission = mission
+        self.model_dir = model_dir
+        self.version = os.path.basename(model_dir)
+
+
+def _write_artifacts(folder, mission, size):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, f'{mission}_model.pkl'), 'wb') as f:
+        f.write(os.urandom(size))
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_module, 'MODEL_DIR', str(tmp_path))
+    monkeypatch.setattr(registry, 'ExoplanetModel', FakeModel)
+    # Size models by their artifacts, not by the RSS growth of the test process
+    monkeypatch.setattr(registry, '_rss_bytes', lambda: None)
+    for mission in registry.MISSIONS:
+        _write_artifacts(str(tmp_path), mission, 1000)
+    return str(tmp_path)
+
+
+def test_least_recently_used_mission_is_evicted_over_budget(model_dir):
+    models = ModelRegistry(memory_budget=2500)
+    kepler = models.get('kepler')
+    models.get('k2')
+    assert models.get('kepler') is kepler
+
+    models.get('tess')
+
+    assert [m for m in registry.MISSIONS if models.is_loaded(m)] == ['kepler', 'tess']
+    stats = models.stats()
+    assert stats['resident_bytes'] == 2000
+    assert stats['missions']['k2']['evictions'] == 1
+    assert stats['missions']['k2']['size_bytes'] == 1000
+
+    # An evicted mission is loaded again on its next use, evicting the next in line
+    models.get('k2')
+    assert [m for m in registry.MISSIONS if models.is_loaded(m)] == ['k2', 'tess']
+    assert models.stats()['missions']['k2']['loads'] == 2
+
+
+def test_a_single_model_over_budget_stays_loaded(model_dir):
+    models = ModelRegistry(memory_budget=500)
+    models.get('kepler')
+    models.get('k2')
+
+    assert not models.is_loaded('kepler') and models.is_loaded('k2')
+
+
+def test_no_budget_keeps_every_mission(model_dir):
+    models = ModelRegistry()
+    for mission in registry.MISSIONS:
+        models.get(mission)
+
+    assert all(models.is_loaded(m) for m in registry.MISSIONS)
+
+
+def test_release_change_is_hot_reloaded(model_dir, tmp_path):
+    first = model_store.publish('tess', model_dir)
+    models = ModelRegistry(poll_interval=0.01)
+    old = models.get('tess')
+    assert old.release == first and old.model_dir == model_store.release_dir('tess', first)
+
+    _write_artifacts(str(tmp_path / 'retrained'), 'tess', 1200)
+    second = model_store.publish('tess', str(tmp_path / 'retrained'))
+    assert second != first
+
+    deadline = time.monotonic() + 10
+    model = old
+    while model.release != second and time.monotonic() < deadline:
+        time.sleep(0.02)
+        model = models.get('tess')
+
+    assert model.release == second and model.model_dir == model_store.release_dir('tess', second)
+    assert models.stats()['missions']['tess']['reloads'] == 1
+    # Requests that already had the old model keep it
+    assert old.release == first
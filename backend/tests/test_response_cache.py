@@ -0,0 +1,89 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import ResponseCache, response_key  # noqa: E402
+
+DIGEST = b'\x01' * 16
+
+
+def test_workers_on_different_versions_keep_each_others_disk_entries(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    old, new = ResponseCache(max_bytes=0, disk_path=path), ResponseCache(max_bytes=0, disk_path=path)
+    old_key, new_key = response_key(DIGEST, 'tess', 'v1', ()), response_key(DIGEST, 'tess', 'v2', ())
+
+    new.put(new_key, 'tess', 'v2', b'new', 'application/json', 1)
+    old.put(old_key, 'tess', 'v1', b'old', 'application/json', 1)
+    # A worker still on the previous version must not wipe the current one
+    assert old.get(old_key, 'tess', 'v1') == (b'old', 'application/json', 1)
+    assert new.get(new_key, 'tess', 'v2') == (b'new', 'application/json', 1)
+
+
+def test_new_version_drops_in_process_entries_of_the_old_one():
+    cache = ResponseCache(max_bytes=1 << 20)
+    old_key = response_key(DIGEST, 'tess', 'v1', ())
+    cache.put(old_key, 'tess', 'v1', b'old', 'application/json', 1)
+    cache.put(response_key(DIGEST, 'k2', 'v1', ()), 'k2', 'v1', b'k2', 'application/json', 1)
+
+    assert cache.get(response_key(DIGEST, 'tess', 'v2', ()), 'tess', 'v2') is None
+    assert cache.stats()['entries'] == 1
+    assert cache.get(old_key, 'tess', 'v2') is None
+
+
+def test_key_covers_upload_mission_version_and_options():
+    key = response_key(DIGEST, 'tess', 'v1', ('csv', 'json'))
+    assert key == response_key(DIGEST, 'tess', 'v1', ('csv', 'json'))
+    assert len({key, response_key(b'\x02' * 16, 'tess', 'v1', ('csv', 'json')),
+                response_key(DIGEST, 'k2', 'v1', ('csv', 'json')),
+                response_key(DIGEST, 'tess', 'v2', ('csv', 'json')),
+                response_key(DIGEST, 'tess', 'v1', ('csv', 'arrow'))}) == 5
+
+
+def test_hits_and_misses():
+    cache = ResponseCache(max_bytes=1 << 20)
+    key = response_key(DIGEST, 'tess', 'v1', ())
+    assert cache.get(key, 'tess', 'v1') is None
+    cache.put(key, 'tess', 'v1', b'body', 'text/csv', 3)
+
+    assert cache.get(key, 'tess', 'v1') == (b'body', 'text/csv', 3)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate'], stats['size_bytes']) == (1, 1, 0.5, 4)
+
+
+def test_lru_evicts_least_recently_used_bodies_over_max_bytes():
+    cache = ResponseCache(max_bytes=10)
+    keys = [response_key(bytes([i]) * 16, 'tess', 'v1', ()) for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, 'tess', 'v1', b'abcd', 'text/csv', 1)
+    assert cache.get(keys[1], 'tess', 'v1') is not None  # keys[0] is now the oldest
+    cache.put(keys[3], 'tess', 'v1', b'abcd', 'text/csv', 1)
+
+    assert [cache.get(key, 'tess', 'v1') is not None for key in keys] == [False, True, False, True]
+    stats = cache.stats()
+    assert stats['size_bytes'] == 8 and stats['evictions'] == 2
+    # A body over the whole budget is not kept
+    cache.put(keys[0], 'tess', 'v1', b'x' * 11, 'text/csv', 1)
+    assert cache.get(keys[0], 'tess', 'v1') is None
+
+
+def test_disk_tier_is_shared_and_bounded(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    writer = ResponseCache(max_bytes=0, disk_path=path, max_disk_bytes=10)
+    keys = [response_key(bytes([i]) * 16, 'tess', 'v1', ()) for i in range(3)]
+    for key in keys:
+        writer.put(key, 'tess', 'v1', b'abcd', 'text/csv', 1)
+
+    reader = ResponseCache(max_bytes=1 << 20, disk_path=path, max_disk_bytes=10)
+    assert [reader.get(key, 'tess', 'v1') for key in keys] == [None] + [(b'abcd', 'text/csv', 1)] * 2
+    assert reader.stats()['disk_hits'] == 2
+    # Promoted into the reader's in-process tier
+    reader.get(keys[2], 'tess', 'v1')
+    assert reader.stats()['hits'] == 1
+
+
+def test_new_model_version_is_never_served_old_responses(tmp_path):
+    cache = ResponseCache(max_bytes=1 << 20, disk_path=str(tmp_path / 'responses.sqlite'))
+    cache.put(response_key(DIGEST, 'tess', 'v1', ()), 'tess', 'v1', b'old', 'text/csv', 1)
+
+    assert cache.get(response_key(DIGEST, 'tess', 'v2', ()), 'tess', 'v2') is None
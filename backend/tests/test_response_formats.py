@@ -0,0 +1,66 @@
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import response_formats  # noqa: E402
+from response_formats import encode  # noqa: E402
+
+
+def _columns():
+    return {
+        'id': np.array(['a1', 'NaN', 'c3'], dtype=object),
+        'prediction': np.array(['CONFIRMED', 'FALSE POSITIVE', 'CANDIDATE'], dtype=object),
+        'confidence': np.array([0.9, np.nan, 0.25]),
+        'radius': np.array([np.inf, -np.inf, 1.5]),
+    }
+
+
+def test_columnar_output_replaces_missing_floats_with_null():
+    body, mimetype = encode(_columns(), 'columnar', {'mission': 'k2', 'count': 3})
+    # Strict parsing: NaN and Infinity are not JSON
+    data = json.loads(body, parse_constant=lambda token: pytest.fail(f'{token} in JSON output'))
+
+    assert mimetype == 'application/json'
+    assert data['mission'] == 'k2' and data['count'] == 3
+    assert data['columns']['confidence'] == [0.9, None, 0.25]
+    assert data['columns']['radius'] == [None, None, 1.5]
+    # String values that read like a float token are left alone
+    assert data['columns']['id'] == ['a1', 'NaN', 'c3']
+    assert data['columns']['prediction'] == ['CONFIRMED', 'FALSE POSITIVE', 'CANDIDATE']
+
+
+def test_columnar_output_of_finite_floats_round_trips():
+    values = np.random.default_rng(0).normal(size=50)
+    body, _ = encode({'score': values}, 'columnar', {})
+
+    assert json.loads(body)['columns']['score'] == values.tolist()
+
+
+def test_csv_output_leaves_missing_values_empty():
+    body, mimetype = encode(_columns(), 'csv', {})
+
+    assert mimetype == 'text/csv'
+    assert body.splitlines()[2] == 'NaN,FALSE POSITIVE,,-inf'
+
+
+@pytest.mark.skipif(response_formats.pa is None, reason='pyarrow is not installed')
+@pytest.mark.parametrize('output_format', ['arrow', 'parquet'])
+def test_binary_output_stores_missing_floats_as_nulls(output_format):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    body, _ = encode(_columns(), output_format, {})
+    if output_format == 'arrow':
+        table = pa.ipc.open_stream(body).read_all()
+    else:
+        table = pq.read_table(io.BytesIO(body))
+
+    assert table.column('confidence').to_pylist() == [0.9, None, 0.25]
+    pd.testing.assert_series_equal(table.column('radius').to_pandas(), pd.Series(_columns()['radius'], name='radius'))
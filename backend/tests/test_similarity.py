@@ -0,0 +1,58 @@
+import os
+import sys
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.neighbors import BallTree, KDTree
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity import KD_TREE_MAX_DIMS, SimilarityIndex, index_path, load_index  # noqa: E402
+from tree_engine import file_sha256  # noqa: E402
+
+
+def _catalog(n, dims, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, dims)), np.array([f'TIC {i}' for i in range(n)], dtype=object)
+
+
+@pytest.mark.parametrize('dims, tree', [(6, KDTree), (KD_TREE_MAX_DIMS + 50, BallTree)])
+def test_neighbors_match_brute_force(dims, tree):
+    X, ids = _catalog(300, dims)
+    index = SimilarityIndex.build(X, ids, ids)
+    assert isinstance(index.tree, tree)
+
+    queries = np.random.default_rng(1).normal(size=(20, dims))
+    queries[0, 0] = np.nan  # missing values sit at the scaled mean
+    result = index.neighbors(queries, 5)
+
+    filled = np.nan_to_num(queries)
+    distances = np.sqrt(((filled[:, None, :] - X[None, :, :]) ** 2).sum(axis=2))
+    nearest = np.argsort(distances, axis=1, kind='stable')[:, :5]
+    for row, expected, dist in zip(result, nearest, distances):
+        assert [hit['star_id'] for hit in row] == ids[expected].tolist()
+        np.testing.assert_allclose([hit['distance'] for hit in row], np.round(dist[expected], 4))
+
+
+def test_empty_batch_has_no_neighbors():
+    X, ids = _catalog(10, 3)
+    assert len(SimilarityIndex.build(X, ids, ids).neighbors(np.empty((0, 3)), 5)) == 0
+
+
+def test_load_index_ignores_an_index_of_another_scaler_or_column_order(tmp_path):
+    X, ids = _catalog(50, 3)
+    scaler_path = str(tmp_path / 'tess_scaler.pkl')
+    joblib.dump(StandardScaler().fit(X), scaler_path)
+    num_cols = ['a', 'b', 'c']
+    SimilarityIndex.build(X, ids, ids, {'scaler_sha256': file_sha256(scaler_path),
+                                        'num_cols': num_cols}).save(index_path(str(tmp_path), 'tess'))
+
+    loaded = load_index('tess', str(tmp_path), num_cols)
+    assert loaded is not None and loaded.size == 50
+    assert load_index('tess', str(tmp_path), ['b', 'a', 'c']) is None
+    assert load_index('k2', str(tmp_path)) is None
+
+    joblib.dump(StandardScaler().fit(X * 2), scaler_path)
+    assert load_index('tess', str(tmp_path), num_cols) is None
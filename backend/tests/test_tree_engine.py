@@ -0,0 +1,137 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from lightgbm import LGBMClassifier
+from sklearn.ensemble import RandomForestClassifier
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import FLAT_ENGINE_MAX_ROWS  # noqa: E402
+from tree_engine import EarlyExit, FlatTreeEnsemble, HybridEstimator, export_ensemble  # noqa: E402
+
+CLASSES = np.array(['CANDIDATE', 'CONFIRMED', 'FALSE POSITIVE'])
+
+
+def _dataset(n=600, n_features=6, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, n_features))
+    y = CLASSES[(X[:, 0] + 0.5 * X[:, 1] ** 2 + rng.normal(scale=0.5, size=n) > 0.3).astype(int)
+                + (X[:, 2] > 1.0)]
+    # Missing values and exact zeros exercise the missing-value routing
+    X[rng.random(X.shape) < 0.05] = np.nan
+    X[rng.random(X.shape) < 0.02] = 0.0
+    return X, y
+
+
+@pytest.fixture(scope='module')
+def lgbm():
+    X, y = _dataset()
+    return LGBMClassifier(n_estimators=40, num_leaves=15, random_state=0, verbose=-1).fit(X, y), X
+
+
+@pytest.fixture(scope='module')
+def forest():
+    X, y = _dataset()
+    model = RandomForestClassifier(n_estimators=20, max_depth=8, random_state=0).fit(np.nan_to_num(X), y)
+    return model, np.nan_to_num(X)
+
+
+@pytest.mark.parametrize('fitted', ['lgbm', 'forest'])
+def test_export_matches_native_model(fitted, request, tmp_path):
+    model, X = request.getfixturevalue(fitted)
+    expected = model.predict_proba(X)
+
+    flat = export_ensemble(model)
+    np.testing.assert_allclose(flat.predict_proba(X), expected, rtol=0, atol=1e-12)
+    assert (flat.predict(X) == model.predict(X)).all()
+
+    flat.save(str(tmp_path / 'flat'))
+    loaded = FlatTreeEnsemble.load(str(tmp_path / 'flat'))
+    assert isinstance(loaded.threshold, np.memmap)
+    np.testing.assert_allclose(loaded.predict_proba(X), expected, rtol=0, atol=1e-12)
+
+
+class _Native:
+    def __init__(self, model):
+        self.model = model
+        self.rows = []
+
+    def predict_proba(self, X):
+        self.rows.append(len(X))
+        return self.model.predict_proba(X)
+
+
+def test_hybrid_switches_to_native_above_max_flat_rows(lgbm):
+    model, X = lgbm
+    native = _Native(model)
+    loads = []
+
+    def load_native():
+        loads.append(1)
+        return native
+
+    hybrid = HybridEstimator(export_ensemble(model), load_native, FLAT_ENGINE_MAX_ROWS)
+
+    small = X[:FLAT_ENGINE_MAX_ROWS]
+    np.testing.assert_allclose(hybrid.predict_proba(small), model.predict_proba(small), rtol=0, atol=1e-12)
+    assert not loads
+
+    large = X[:FLAT_ENGINE_MAX_ROWS + 1]
+    hybrid.predict_proba(large)
+    hybrid.predict_proba(large)
+    assert native.rows == [FLAT_ENGINE_MAX_ROWS + 1] * 2
+    assert len(loads) == 1
+
+
+@pytest.mark.parametrize('min_confidence', [0.0, 0.7])
+@pytest.mark.parametrize('engine', ['flat', 'native'])
+def test_early_exit_keeps_full_labels_and_bounds_full_scores(lgbm, engine, min_confidence):
+    model, X = lgbm
+    full = model.predict_proba(X)
+    flat = export_ensemble(model)
+    early = (EarlyExit(flat, stages=10) if engine == 'flat'
+             else EarlyExit(flat, stages=10, load_native=lambda: model, max_flat_rows=0))
+
+    proba, trees, floor = early.predict_proba(X, min_confidence)
+
+    label = np.argmax(proba, axis=1)
+    np.testing.assert_array_equal(label, np.argmax(full, axis=1))
+    rows = np.arange(len(X))
+    assert (full[rows, label] >= floor - 1e-12).all()
+    assert (proba[rows, label] >= floor - 1e-12).all()
+    exited = trees < flat.n_trees
+    assert exited.any()
+    assert (floor[exited] >= min_confidence).all()
+    # Rows that ran every tree report the full probabilities
+    np.testing.assert_allclose(proba[~exited], full[~exited], rtol=0, atol=1e-12)
+
+
+def _around_thresholds(flat):
+    """float32 values on and next to every split threshold, with the node of each"""
+    internal = np.flatnonzero(flat.left != np.arange(len(flat.left)))
+    nearest = flat.threshold[internal].astype(np.float32)
+    values = np.stack([np.nextafter(nearest, np.float32(-np.inf)), nearest,
+                       np.nextafter(nearest, np.float32(np.inf))], axis=1)
+    return internal, values
+
+
+@pytest.mark.parametrize('fitted', ['lgbm', 'forest'])
+def test_compacted_ensemble_takes_the_float64_branches(fitted, request):
+    model, X = request.getfixturevalue(fitted)
+    flat = export_ensemble(model)
+    compact = flat.compacted()
+    assert compact.threshold.dtype == np.float32
+
+    # Every node, for float32 inputs on and around its threshold
+    nodes, values = _around_thresholds(flat)
+    assert not np.array_equal(values[:, 1].astype(np.float64), flat.threshold[nodes])
+    np.testing.assert_array_equal(values <= compact.threshold[nodes, None],
+                                  values.astype(np.float64) <= flat.threshold[nodes, None])
+
+    # Whole rows, with features set on and around the thresholds
+    X32 = np.array(X[:len(nodes)], dtype=np.float32)
+    for i, (node, around) in enumerate(zip(nodes, values)):
+        X32[i % len(X32), flat.feature[node]] = around[i % 3]
+    np.testing.assert_array_equal(compact._leaves(X32), flat._leaves(X32.astype(np.float64)))
@@ -1,139 +1,442 @@
 """
 Script to train ExoQuest models on actual NASA datasets.
 Place your Kepler, K2, and TESS CSV files in the data/ directory.
+
+Each mission is trained in its own process with a bounded number of cores.
+The parsed and preprocessed train/validation/test matrices, and the features
+of the confirmed objects, are cached under data/cache/ as .npy files, keyed
+by the dataset contents and the mission's inputs, so re-running (for example
+with a different search) skips parsing.
+The script writes the full set of files ExoplanetModel loads: scaler,
+medians, encoder (Kepler), model and the index of confirmed objects used by
+/api/similar (see similarity.py).
+
+Usage:
+    python train_models.py                               # all missions
+    python train_models.py --missions tess k2 --search-iter 30
+    python train_models.py --workers 3 --cores-per-job 2 --export
+    python train_models.py --publish stage               # new release to shadow first
 """
 
-import pandas as pd
-import numpy as np
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import accuracy_score, classification_report
-import joblib
+import argparse
+import hashlib
+import json
 import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import lightgbm
+import numpy as np
+import pandas as pd
+from lightgbm import LGBMClassifier
+from scipy.stats import loguniform, randint, uniform
+from sklearn.metrics import accuracy_score, classification_report, f1_score, roc_auc_score
+from sklearn.model_selection import ParameterSampler, train_test_split
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from model import (BASE_DIR, EARLY_EXIT_STAGES, K2_FEATURES, KEPLER_CAT_COLS, KEPLER_NUM_COLS,
+                   TESS_FEATURES, TESS_LOG_FEATURES)
+from preprocessing import PreprocessingPlan
+from similarity import NAME_COLUMNS, build_mission
+
+CLASSES = ['CANDIDATE', 'CONFIRMED', 'FALSE POSITIVE']
+
+TESS_DISPOSITIONS = {
+    'APC': 'CANDIDATE',
+    'CP': 'CONFIRMED',
+    'FA': 'FALSE POSITIVE',
+    'FP': 'FALSE POSITIVE',
+    'KP': 'CONFIRMED',
+    'PC': 'CANDIDATE',
+}
+
+# Inputs, target and notebook hyperparameters of each mission
+MISSIONS = {
+    'kepler': {
+        'filename': 'kepler_data.csv',
+        'target': 'koi_disposition',
+        'id_column': 'kepid',
+        'num_cols': KEPLER_NUM_COLS,
+        'cat_cols': KEPLER_CAT_COLS,
+        'log_features': [],
+        'params': {'colsample_bytree': 0.604, 'learning_rate': 0.0615, 'max_depth': 13,
+                   'min_child_samples': 5, 'n_estimators': 163, 'num_leaves': 144, 'subsample': 0.978},
+    },
+    'k2': {
+        'filename': 'k2_data.csv',
+        'target': 'disposition',
+        'id_column': 'hostname',
+        'num_cols': K2_FEATURES,
+        'cat_cols': [],
+        'log_features': [],
+        'params': {},
+    },
+    'tess': {
+        'filename': 'tess_data.csv',
+        'target': 'tfopwg_disp',
+        'id_column': 'tid',
+        'labels': TESS_DISPOSITIONS,
+        'num_cols': TESS_FEATURES,
+        'cat_cols': [],
+        'log_features': TESS_LOG_FEATURES,
+        'params': {'colsample_bytree': 0.836, 'learning_rate': 0.00509, 'max_depth': 22,
+                   'min_child_samples': 45, 'min_child_weight': 0.0086, 'n_estimators': 1458,
+                   'num_leaves': 82, 'reg_alpha': 0.0182, 'reg_lambda': 0.0001,
+                   'subsample': 0.869, 'subsample_freq': 2},
+    },
+}
+
+SEARCH_SPACE = {
+    'learning_rate': loguniform(0.005, 0.3),
+    'max_depth': randint(3, 31),
+    'num_leaves': randint(15, 256),
+    'min_child_samples': randint(5, 101),
+    'subsample': uniform(0.5, 0.5),
+    'subsample_freq': randint(1, 11),
+    'colsample_bytree': uniform(0.5, 0.5),
+    'reg_alpha': loguniform(1e-4, 10),
+    'reg_lambda': loguniform(1e-4, 10),
+}
+
+# Upper bound on boosting rounds during the search, early stopping picks the count
+SEARCH_MAX_ESTIMATORS = 2000
+
+# Bump when the preprocessing below changes, to invalidate cached matrices
+CACHE_VERSION = 3
+
+SPLITS = ('train', 'val', 'test')
+
+
+def dataset_key(mission, filepath, seed):
+    """Digest of the dataset contents and everything that shapes the matrices"""
+    spec = MISSIONS[mission]
+    h = hashlib.blake2b(digest_size=8)
+    h.update(json.dumps([CACHE_VERSION, mission, seed, spec['target'], spec.get('labels'), spec['id_column'],
+                         list(spec['num_cols']), list(spec['cat_cols']),
+                         list(spec['log_features'])]).encode())
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_dataset(mission, filepath):
+    """Parse a mission's dataset into raw rows and labels, dropping unknown labels.
+
+    The id and name columns are kept when the file has them, for the index
+    of confirmed objects (see similarity.py).
+    """
+    spec = MISSIONS[mission]
+    dtypes = {col: 'float64' for col in spec['num_cols']}
+    dtypes.update({col: object for col in list(spec['cat_cols']) + [spec['target']]})
+    # NASA archive exports start with '#' comment lines
+    header = pd.read_csv(filepath, nrows=0, comment='#').columns
+    dtypes.update({col: str for col in (spec['id_column'], NAME_COLUMNS[mission]) if col in header})
+    df = pd.read_csv(filepath, usecols=list(dtypes), dtype=dtypes, comment='#')
+
+    y = df[spec['target']].str.strip()
+    if 'labels' in spec:
+        y = y.map(spec['labels'])
+    keep = y.isin(CLASSES).to_numpy()
+    return df[keep].reset_index(drop=True), y[keep].to_numpy()
+
+
+def split_dataset(df, y, seed=42):
+    """Raw (rows, labels) train, validation and test splits.
+
+    The split follows the training notebooks (70% train, then the rest 67/33
+    into validation and test).
+    """
+    X_train, X_test, y_train, y_test = train_test_split(df, y, test_size=0.30, random_state=seed)
+    X_val, X_test, y_val, y_test = train_test_split(X_test, y_test, test_size=0.33, random_state=seed)
+    return (X_train, y_train), (X_val, y_val), (X_test, y_test)
+
+
+def load_and_preprocess(mission, filepath, seed=42):
+    """Parse a mission's dataset, split it and fit the serving preprocessing.
+
+    Medians are taken after the log transform, then the encoder and scaler
+    are fitted on the imputed training rows and every split goes through the
+    same PreprocessingPlan the server uses.
+    """
+    spec = MISSIONS[mission]
+    num_cols, cat_cols = list(spec['num_cols']), list(spec['cat_cols'])
+    df, y = read_dataset(mission, filepath)
+    (X_train, y_train), (X_val, y_val), (X_test, y_test) = split_dataset(df, y, seed)
+
+    logged = X_train[num_cols].copy()
+    for col in spec['log_features']:
+        logged[col] = np.log1p(logged[col])
+    medians = logged.median()
+
+    encoder = None
+    categories = ()
+    if cat_cols:
+        encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore').fit(X_train[cat_cols])
+        categories = encoder.categories_
+
+    n_features = len(num_cols) + sum(len(c) for c in categories)
+    unscaled = PreprocessingPlan(num_cols, medians.to_numpy(), np.zeros(n_features), np.ones(n_features),
+                                 spec['log_features'], cat_cols, categories)
+    scaler = StandardScaler().fit(unscaled.transform(X_train))
+    plan = PreprocessingPlan.from_artifacts(num_cols, medians, scaler, spec['log_features'],
+                                            cat_cols, encoder)
+
+    matrices = {}
+    for split, X, labels in zip(SPLITS, (X_train, X_val, X_test), (y_train, y_val, y_test)):
+        matrices[f'X_{split}'] = plan.transform(X)
+        matrices[f'y_{split}'] = np.searchsorted(CLASSES, labels).astype(np.int8)
+    # The validation rows parsed and preprocessed in float32, as the server
+    # does with EXOQUEST_COMPACT=1, for the compact mode report
+    compact = PreprocessingPlan.from_artifacts(num_cols, medians, scaler, spec['log_features'],
+                                               cat_cols, encoder, dtype=np.float32)
+    matrices['X_val_compact'] = compact.transform(X_val.astype({col: np.float32 for col in num_cols}))
+    # The confirmed objects go into the similarity index once the model is
+    # trained; their id and name columns ride along with the artifacts
+    confirmed = df[y == 'CONFIRMED'].reset_index(drop=True)
+    matrices['X_confirmed'] = plan.transform(confirmed)
+    artifacts = {'scaler': scaler, 'medians': medians, 'encoder': encoder,
+                 'confirmed': confirmed.drop(columns=num_cols + cat_cols + [spec['target']])}
+    return matrices, artifacts
+
+
+def load_cached(mission, filepath, cache_dir, seed=42, refresh=False):
+    """Preprocessed matrices and fitted artifacts, from the cache when possible"""
+    path = os.path.join(cache_dir, f'{mission}-{dataset_key(mission, filepath, seed)}')
+    if not refresh and os.path.exists(os.path.join(path, 'artifacts.pkl')):
+        matrices = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+                    for name in os.listdir(path) if name.endswith('.npy')}
+        return matrices, joblib.load(os.path.join(path, 'artifacts.pkl')), True
 
-def load_and_preprocess(filepath, target_col='koi_disposition'):
-    """Load and preprocess exoplanet dataset"""
-    df = pd.read_csv(filepath)
-    
-    # Feature columns
-    feature_cols = [
-        'koi_period', 'koi_duration', 'koi_depth', 
-        'koi_prad', 'koi_teq', 'koi_insol'
-    ]
-    
-    # Filter columns that exist
-    available_features = [col for col in feature_cols if col in df.columns]
-    
-    if target_col not in df.columns:
-        print(f"Warning: Target column {target_col} not found. Using mock data.")
-        return None, None, available_features
-    
-    # Prepare features and target
-    X = df[available_features].copy()
-    y = df[target_col].copy()
-    
-    # Handle missing values
-    X = X.fillna(X.mean())
-    
-    # Map target labels
-    label_mapping = {
-        'CONFIRMED': 'Confirmed',
-        'CANDIDATE': 'Candidate',
-        'FALSE POSITIVE': 'False Positive'
+    matrices, artifacts = load_and_preprocess(mission, filepath, seed)
+
+    # Write into a scratch directory and rename it, so a concurrent or
+    # interrupted run never sees a partial cache entry
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, values in matrices.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), values)
+    joblib.dump(artifacts, os.path.join(tmp_path, 'artifacts.pkl'))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return matrices, artifacts, False
+
+
+def fit_lgbm(params, data, n_jobs, seed, early_stopping_rounds):
+    """Fit on the training split, stopping when the validation loss stalls"""
+    model = LGBMClassifier(**params, random_state=seed, n_jobs=n_jobs, verbose=-1)
+    model.fit(data['X_train'], data['y_train'], eval_set=[(data['X_val'], data['y_val'])],
+              callbacks=[lightgbm.early_stopping(early_stopping_rounds, verbose=False)])
+    return model
+
+
+def search_params(mission, data, n_iter, n_jobs, seed, early_stopping_rounds):
+    """Random search over SEARCH_SPACE, scoring each draw by validation log loss"""
+    candidates = [MISSIONS[mission]['params']]
+    candidates += list(ParameterSampler(SEARCH_SPACE, n_iter, random_state=seed))
+
+    best = None
+    for i, params in enumerate(candidates):
+        params = dict(params, n_estimators=SEARCH_MAX_ESTIMATORS)
+        model = fit_lgbm(params, data, n_jobs, seed, early_stopping_rounds)
+        loss = model.best_score_['valid_0']['multi_logloss']
+        if best is None or loss < best[0]:
+            best = (loss, params, model.best_iteration_)
+        print(f'[{mission}] search {i + 1}/{len(candidates)}: loss {loss:.4f} '
+              f'({model.best_iteration_} rounds), best {best[0]:.4f}', flush=True)
+    loss, params, rounds = best
+    return dict(params, n_estimators=rounds)
+
+
+def _dump(obj, path):
+    """joblib.dump via a temporary file, so a running server never loads a partial file"""
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def early_exit_report(model, X, proba, stages=EARLY_EXIT_STAGES):
+    """How the early-exit mode compares with full evaluation on held-out rows"""
+    from tree_engine import EarlyExit, export_ensemble
+
+    engine = EarlyExit(export_ensemble(model), stages, lambda: model)
+    early, trees, floor = engine.predict_proba(X)
+    exited = trees < engine.n_trees
+    rows = np.arange(len(X))
+    best = np.argmax(proba, axis=1)
+    error = np.abs(proba[rows, best] - early[rows, best])[exited] * 100
+    gap = (proba[rows, best] - floor)[exited] * 100
+    return {
+        'stages': stages,
+        'exit_rate': round(float(exited.mean()), 4),
+        'trees_evaluated': round(float(trees.mean() / engine.n_trees), 4),
+        'label_agreement': round(float(np.mean(np.argmax(early, axis=1) == best)), 4),
+        # Early rows: estimated vs full score, and how far the bound sits below it (points)
+        'mean_score_error': round(float(error.mean()), 2) if len(error) else 0.0,
+        'max_score_error': round(float(error.max()), 2) if len(error) else 0.0,
+        'mean_bound_gap': round(float(gap.mean()), 2) if len(gap) else 0.0,
     }
-    y = y.map(label_mapping).fillna('Candidate')
-    
-    return X, y, available_features
-
-def train_model(X, y, model_name, model_type='random_forest'):
-    """Train a model and save it"""
-    print(f"\nTraining {model_name} model...")
-    
-    # Split data
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, stratify=y
-    )
-    
-    # Scale features
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
-    
-    # Initialize model
-    if model_type == 'random_forest':
-        model = RandomForestClassifier(
-            n_estimators=200,
-            max_depth=20,
-            min_samples_split=5,
-            min_samples_leaf=2,
-            random_state=42,
-            n_jobs=-1
-        )
+
+
+def compact_report(model, X, X_compact):
+    """How the float32 compact mode agrees with the float64 path.
+
+    ``X`` holds rows as preprocessed for training and ``X_compact`` the same
+    rows parsed and preprocessed in float32; the compact side runs the
+    float32 flat ensemble, as the server does with EXOQUEST_COMPACT=1.
+    """
+    from tree_engine import export_ensemble
+
+    ensemble = export_ensemble(model)
+    compact = ensemble.compacted()
+    full = model.predict_proba(X)
+    reduced = compact.predict_proba(X_compact)
+    best = np.argmax(full, axis=1)
+    rows_index = np.arange(len(X))
+    return {
+        'rows': len(X),
+        'label_agreement': round(float(np.mean(np.argmax(reduced, axis=1) == best)), 4),
+        'max_score_diff': round(float(np.max(np.abs(reduced[rows_index, best] - full[rows_index, best]),
+                                             initial=0.0) * 100), 4),
+        'feature_bytes': {'float64': int(X.nbytes), 'float32': int(X_compact.nbytes)},
+        'ensemble_bytes': {'float64': int(ensemble.threshold.nbytes + ensemble.value.nbytes),
+                           'float32': int(compact.threshold.nbytes + compact.value.nbytes)},
+    }
+
+
+def train_mission(mission, filepath, model_dir, cache_dir, n_jobs=1, search_iter=0,
+                  early_stopping_rounds=50, seed=42, refresh_cache=False, export=False, publish=None):
+    """Train one mission and write its serving artifacts; returns a summary"""
+    start = time.perf_counter()
+    data, artifacts, cached = load_cached(mission, filepath, cache_dir, seed, refresh_cache)
+    prepared = time.perf_counter()
+
+    if search_iter:
+        params = search_params(mission, data, search_iter, n_jobs, seed, early_stopping_rounds)
     else:
-        model = GradientBoostingClassifier(
-            n_estimators=200,
-            learning_rate=0.1,
-            max_depth=10,
-            random_state=42
-        )
-    
-    # Train
-    model.fit(X_train_scaled, y_train)
-    
-    # Evaluate
-    y_pred = model.predict(X_test_scaled)
-    accuracy = accuracy_score(y_test, y_pred)
-    
-    print(f"Accuracy: {accuracy:.4f}")
-    print("\nClassification Report:")
-    print(classification_report(y_test, y_pred))
-    
-    # Save model and scaler
-    os.makedirs('models', exist_ok=True)
-    joblib.dump(model, f'models/{model_name}_model.pkl')
-    joblib.dump(scaler, f'models/{model_name}_scaler.pkl')
-    
-    print(f"Model saved to models/{model_name}_model.pkl")
-    
-    return accuracy
-
-def main():
-    """Train all models"""
-    datasets = {
-        'kepler': 'data/kepler_data.csv',
-        'k2': 'data/k2_data.csv',
-        'tess': 'data/tess_data.csv'
+        params = dict(MISSIONS[mission]['params'])
+        probe = fit_lgbm(params, data, n_jobs, seed, early_stopping_rounds)
+        params['n_estimators'] = probe.best_iteration_ or params.get('n_estimators', 100)
+
+    # Refit with the chosen number of rounds so the saved model carries no
+    # trees past the early stopping point
+    model = LGBMClassifier(**params, random_state=seed, n_jobs=n_jobs, verbose=-1)
+    model.fit(np.asarray(data['X_train']), np.take(CLASSES, data['y_train']))
+    trained = time.perf_counter()
+
+    y_test = np.take(CLASSES, data['y_test'])
+    proba = model.predict_proba(np.asarray(data['X_test']))
+    y_pred = model.classes_[np.argmax(proba, axis=1)]
+    report = {
+        'mission': mission,
+        'rows': {split: len(data[f'y_{split}']) for split in SPLITS},
+        'params': params,
+        'accuracy': round(accuracy_score(y_test, y_pred), 4),
+        'f1_macro': round(f1_score(y_test, y_pred, average='macro'), 4),
+        'cached': cached,
+        'prepare_seconds': round(prepared - start, 2),
+        'train_seconds': round(trained - prepared, 2),
     }
-    
-    results = {}
-    
-    for name, filepath in datasets.items():
+    if len(set(y_test)) == len(model.classes_):
+        report['roc_auc_ovr'] = round(roc_auc_score(y_test, proba, multi_class='ovr', average='macro'), 4)
+    report['early_exit'] = early_exit_report(model, np.asarray(data['X_test']), proba)
+    report['compact'] = compact_report(model, np.asarray(data['X_val']), np.asarray(data['X_val_compact']))
+
+    os.makedirs(model_dir, exist_ok=True)
+    _dump(artifacts['scaler'], os.path.join(model_dir, f'{mission}_scaler.pkl'))
+    _dump(artifacts['medians'], os.path.join(model_dir, f'{mission}_medians.pkl'))
+    if artifacts['encoder'] is not None:
+        _dump(artifacts['encoder'], os.path.join(model_dir, f'{mission}_encoder.pkl'))
+    # The model goes last: its file is what marks the mission as available
+    _dump(model, os.path.join(model_dir, f'{mission}_model.pkl'))
+    confirmed = (artifacts['confirmed'], np.asarray(data['X_confirmed']))
+    report['similar_index_rows'] = build_mission(mission, filepath, model_dir, confirmed).size
+    with open(os.path.join(model_dir, f'{mission}_metrics.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if export:
+        from tree_engine import export_mission
+        export_mission(model_dir, mission)
+    if publish:
+        import model_store
+        report['release'] = model_store.publish(mission, model_dir, activate=publish == 'activate')
+
+    print(f'\n[{mission}] test classification report:')
+    print(classification_report(y_test, y_pred, zero_division=0))
+    return report
+
+
+def main(argv=None):
+    """Train all models"""
+    parser = argparse.ArgumentParser(description='Train the ExoQuest mission models')
+    parser.add_argument('--missions', nargs='+', default=list(MISSIONS), choices=list(MISSIONS))
+    parser.add_argument('--data-dir', default=os.path.join(BASE_DIR, 'data'))
+    parser.add_argument('--model-dir', default=os.path.join(BASE_DIR, 'models'))
+    parser.add_argument('--cache-dir', help='preprocessed matrix cache (default <data-dir>/cache)')
+    parser.add_argument('--workers', type=int, help='missions trained at once (default: all)')
+    parser.add_argument('--cores-per-job', type=int, help='LightGBM threads per mission '
+                        '(default: CPU count / workers)')
+    parser.add_argument('--search-iter', type=int, default=0,
+                        help='random hyperparameter draws per mission (default 0, notebook parameters)')
+    parser.add_argument('--early-stopping', type=int, default=50,
+                        help='stop after this many rounds without validation improvement')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--refresh-cache', action='store_true', help='re-parse the datasets')
+    parser.add_argument('--export', action='store_true',
+                        help='also export the flat ensembles served by tree_engine')
+    parser.add_argument('--publish', choices=['activate', 'stage'],
+                        help='copy the artifacts into a new release (see model_store.py) and '
+                             'make it current (activate) or leave it for shadowing (stage)')
+    args = parser.parse_args(argv)
+
+    jobs = {}
+    for name in args.missions:
+        filepath = os.path.join(args.data_dir, MISSIONS[name]['filename'])
         if os.path.exists(filepath):
-            X, y, features = load_and_preprocess(filepath)
-            if X is not None:
-                accuracy = train_model(X, y, name)
-                results[name] = accuracy
-            else:
-                print(f"Skipping {name} - insufficient data")
+            jobs[name] = filepath
         else:
             print(f"\nDataset not found: {filepath}")
             print(f"Please download the {name.upper()} dataset from NASA and place it in the data/ directory")
-    
-    if results:
-        print("\n" + "="*50)
-        print("TRAINING SUMMARY")
-        print("="*50)
-        for name, acc in results.items():
-            print(f"{name.upper()}: {acc:.2%}")
-    else:
-        print("\nNo datasets found. Creating demo models with synthetic data...")
-        # Create demo models
-        from model import ExoplanetModel
-        for name in ['kepler', 'k2', 'tess']:
-            model = ExoplanetModel(name)
-            model.save_model()
-            print(f"Created demo model: {name}")
+    if not jobs:
+        return 1
+
+    workers = max(1, min(args.workers or len(jobs), len(jobs)))
+    cores = args.cores_per_job or max(1, (os.cpu_count() or 1) // workers)
+    cache_dir = args.cache_dir or os.path.join(args.data_dir, 'cache')
+    print(f'Training {", ".join(jobs)} with {workers} worker(s), {cores} core(s) each')
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(train_mission, name, filepath, args.model_dir, cache_dir, cores,
+                        args.search_iter, args.early_stopping, args.seed,
+                        args.refresh_cache, args.export, args.publish): name
+            for name, filepath in jobs.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                print(f'\n{name} failed: {e}')
+
+    print("\n" + "="*50)
+    print("TRAINING SUMMARY")
+    print("="*50)
+    for name, report in results.items():
+        print(f"{name.upper()}: {report['accuracy']:.2%} accuracy, {report['f1_macro']:.4f} macro F1, "
+              f"{report['params']['n_estimators']} trees, prepared in {report['prepare_seconds']}s"
+              f"{' (cached)' if report['cached'] else ''}, trained in {report['train_seconds']}s"
+              + (f", release {report['release']}" if 'release' in report else ''))
+        early = report['early_exit']
+        print(f"  early exit: {early['exit_rate']:.0%} of test rows exit early, "
+              f"{early['trees_evaluated']:.0%} of trees evaluated, {early['label_agreement']:.2%} label agreement")
+        compact = report['compact']
+        print(f"  float32 compact mode: {compact['label_agreement']:.2%} label agreement on validation, "
+              f"max score difference {compact['max_score_diff']} points")
+    return 0 if len(results) == len(jobs) else 1
 
 if __name__ == '__main__':
-    main()
+    raise SystemExit(main())
@@ -0,0 +1,479 @@
+"""
+Flattened, array-backed inference for the mission tree ensembles.
+
+A fitted RandomForestClassifier or LGBMClassifier is exported into a
+structure of arrays (one row per node across all trees) and evaluated for a
+whole batch at once with NumPy. The arrays are stored as plain .npy files so
+they can be memory mapped instead of unpickling the estimator.
+
+Usage: python tree_engine.py [kepler k2 tess]
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+# Per-node handling of missing values, mirroring the two libraries:
+# MISSING_AS_ZERO   NaN is replaced by 0.0 before the comparison (LightGBM 'None')
+# MISSING_DEFAULT   NaN follows the node's default child (LightGBM 'NaN', sklearn)
+# ZERO_DEFAULT      NaN and zero follow the default child (LightGBM 'Zero')
+MISSING_AS_ZERO, MISSING_DEFAULT, ZERO_DEFAULT = 0, 1, 2
+
+# LightGBM's kZeroThreshold
+ZERO_THRESHOLD = 1e-35
+
+ARRAY_NAMES = ('feature', 'threshold', 'left', 'right', 'default_left', 'missing',
+               'value', 'roots', 'tree_class')
+
+# Number of (row, tree) node indices evaluated at once; bounds the working set
+BLOCK_CELLS = 1 << 18
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class FlatTreeEnsemble:
+    """A tree ensemble stored as flat node arrays.
+
+    Leaves point to themselves, so every row can be advanced ``max_depth``
+    times without checking which rows already reached a leaf. For a random
+    forest ``value`` holds each leaf's class probabilities and the output is
+    their mean; for LightGBM it holds the leaf score, ``tree_class`` gives the
+    class each tree contributes to and the summed scores go through softmax
+    (or sigmoid for binary models). A ``compacted`` ensemble keeps thresholds
+    and leaf values in float32 and is evaluated on float32 inputs.
+    """
+
+    def __init__(self, kind, classes, arrays, max_depth, objective=None, sigmoid=1.0, meta=None):
+        self.kind = kind
+        self.classes_ = np.asarray(classes)
+        self.n_classes_ = len(self.classes_)
+        self.max_depth = int(max_depth)
+        self.objective = objective
+        self.sigmoid = float(sigmoid)
+        self.meta = meta or {}
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.n_trees = len(self.roots)
+        self.compact = self.threshold.dtype == np.float32
+        # sklearn evaluates its trees on float32 inputs, LightGBM on float64
+        self.input_dtype = np.dtype(np.float32 if kind == 'forest' or self.compact else np.float64)
+
+        # Derived lookup tables, small next to the node arrays
+        self._children = np.column_stack([self.left, self.right]).astype(np.intp).ravel()
+        self._has_zero_default = bool(np.any(self.missing == ZERO_DEFAULT))
+        n_raw = 1 if self.n_classes_ == 2 else self.n_classes_
+        self._interleaved = (self.n_trees % n_raw == 0 and
+                             np.array_equal(self.tree_class, np.arange(self.n_trees) % n_raw))
+
+    @property
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAY_NAMES}
+
+    def _leaves(self, X, roots=None):
+        """Return the leaf node reached by every (row, tree) pair, for all trees or ``roots``"""
+        n, n_features = X.shape
+        flat_x = X.ravel()
+        offsets = (np.arange(n, dtype=np.intp) * n_features)[:, None]
+        idx = np.tile((self.roots if roots is None else roots).astype(np.intp), (n, 1))
+        for _ in range(self.max_depth):
+            x = flat_x.take(offsets + self.feature.take(idx))
+            # NaN compares False and goes right, fixed up below when needed
+            go_right = ~(x <= self.threshold.take(idx))
+
+            is_nan = np.isnan(x)
+            if is_nan.any():
+                nodes = idx[is_nan]
+                as_zero = self.missing.take(nodes) == MISSING_AS_ZERO
+                go_right[is_nan] = np.where(as_zero, ~(0.0 <= self.threshold.take(nodes)),
+                                            ~self.default_left.take(nodes))
+            if self._has_zero_default:
+                is_zero = (x > -ZERO_THRESHOLD) & (x <= ZERO_THRESHOLD)
+                is_zero &= self.missing.take(idx) == ZERO_DEFAULT
+                if is_zero.any():
+                    go_right[is_zero] = ~self.default_left.take(idx[is_zero])
+
+            idx = self._children.take(idx * 2 + go_right)
+        return idx
+
+    def _predict_block(self, X):
+        leaves = self._leaves(X)
+        if self.kind == 'forest':
+            # Summing over the middle axis adds the trees one after another,
+            # in the same order as sklearn
+            proba = self.value.take(leaves, axis=0).sum(axis=1, dtype=np.float64)
+            proba /= self.n_trees
+            return proba
+
+        scores = self.value.take(leaves)
+        n_raw = 1 if self.n_classes_ == 2 else self.n_classes_
+        if self._interleaved:
+            # Trees are stored iteration by iteration, one per class
+            raw = scores.reshape(len(X), -1, n_raw).sum(axis=1, dtype=np.float64)
+        else:
+            raw = np.column_stack([scores[:, self.tree_class == c].sum(axis=1, dtype=np.float64)
+                                   for c in range(n_raw)])
+        if n_raw == 1:
+            positive = 1.0 / (1.0 + np.exp(-self.sigmoid * raw[:, 0]))
+            return np.column_stack([1.0 - positive, positive])
+        raw -= raw.max(axis=1, keepdims=True)
+        np.exp(raw, out=raw)
+        raw /= raw.sum(axis=1, keepdims=True)
+        return raw
+
+    def predict_proba(self, X):
+        X = np.ascontiguousarray(X, dtype=self.input_dtype)
+        block = max(1, BLOCK_CELLS // max(self.n_trees, 1))
+        if X.shape[0] <= block:
+            return self._predict_block(X)
+        return np.concatenate([self._predict_block(X[i:i + block])
+                               for i in range(0, X.shape[0], block)])
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def raw_scores(self, X, start, stop):
+        """Summed leaf scores of trees ``start`` to ``stop`` of a multiclass
+        LightGBM ensemble, one column per class"""
+        X = np.ascontiguousarray(X, dtype=self.input_dtype)
+        roots = self.roots[start:stop]
+        tree_class = self.tree_class[start:stop]
+        block = max(1, BLOCK_CELLS // max(len(roots), 1))
+        raw = np.empty((len(X), self.n_classes_))
+        for i in range(0, len(X), block):
+            scores = self.value.take(self._leaves(X[i:i + block], roots))
+            for c in range(self.n_classes_):
+                raw[i:i + block, c] = scores[:, tree_class == c].sum(axis=1, dtype=np.float64)
+        return raw
+
+    def leaf_bounds(self):
+        """Smallest and largest leaf value of every tree"""
+        is_leaf = self.left == np.arange(len(self.left))
+        # The nodes of each tree are stored contiguously, starting at its root
+        roots = self.roots.astype(np.intp)
+        low = np.minimum.reduceat(np.where(is_leaf, self.value, np.inf), roots)
+        high = np.maximum.reduceat(np.where(is_leaf, self.value, -np.inf), roots)
+        return low, high
+
+    def compacted(self):
+        """A copy with float32 thresholds and leaf values, for float32 inputs.
+
+        Thresholds are rounded down to the nearest float32: a float32 input is
+        at most a threshold exactly when it is at most the rounded one, so the
+        split decisions for float32 inputs do not change. What can differ
+        from the float64 path is the inputs' own rounding and the leaf values.
+        """
+        if self.compact:
+            return self
+        with np.errstate(over='ignore'):
+            threshold = self.threshold.astype(np.float32)
+        above = threshold > self.threshold
+        threshold[above] = np.nextafter(threshold[above], np.float32(-np.inf))
+        arrays = dict(self.arrays, threshold=threshold, value=np.asarray(self.value, dtype=np.float32))
+        return FlatTreeEnsemble(self.kind, self.classes_, arrays, self.max_depth, self.objective,
+                                self.sigmoid, self.meta)
+
+    def split_counts(self, n_features):
+        """Number of splits on each feature, LightGBM's 'split' importance"""
+        internal = self.left != np.arange(len(self.left))
+        return np.bincount(self.feature[internal], minlength=n_features)
+
+    def save(self, path):
+        """Write the ensemble as one .npy file per array plus meta.json"""
+        os.makedirs(path, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(array))
+        meta = dict(self.meta, kind=self.kind, classes=self.classes_.tolist(),
+                    max_depth=self.max_depth, objective=self.objective, sigmoid=self.sigmoid)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None)
+                  for name in ARRAY_NAMES}
+        return cls(meta['kind'], meta['classes'], arrays, meta['max_depth'],
+                   objective=meta.get('objective'), sigmoid=meta.get('sigmoid', 1.0), meta=meta)
+
+
+class HybridEstimator:
+    """Runs small batches on a flat ensemble and large ones on the native model.
+
+    The NumPy traversal wins on latency for a handful of rows while the
+    compiled library wins on throughput for big batches, so the native
+    estimator is only loaded, via ``load_native``, once a batch larger than
+    ``max_flat_rows`` arrives.
+    """
+
+    def __init__(self, flat, load_native, max_flat_rows):
+        self.flat = flat
+        self.classes_ = flat.classes_
+        self.max_flat_rows = max_flat_rows
+        self._load_native = load_native
+        self._native = None
+        self._lock = threading.Lock()
+
+    @property
+    def native(self):
+        if self._native is None:
+            with self._lock:
+                if self._native is None:
+                    self._native = self._load_native()
+        return self._native
+
+    def predict_proba(self, X):
+        if len(X) <= self.max_flat_rows:
+            return self.flat.predict_proba(X)
+        return self.native.predict_proba(X)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def _softmax(raw):
+    raw = raw - raw.max(axis=1, keepdims=True)
+    np.exp(raw, out=raw)
+    raw /= raw.sum(axis=1, keepdims=True)
+    return raw
+
+
+class EarlyExit:
+    """Evaluates a multiclass LightGBM ensemble in stages, letting rows stop early.
+
+    Each tree can move a class's raw score by at most its largest (or least)
+    leaf value, so after every stage the raw scores the remaining trees could
+    still reach are bounded. A row stops once its leading class wins even
+    when every remaining tree takes its largest value for the other classes
+    and its least for the leader: its label is then the one full evaluation
+    gives. ``min_confidence`` additionally requires the leader's probability
+    in that worst case, a floor under its full-evaluation probability, to
+    reach the bound. The probabilities reported for a stopped row estimate
+    the full ones from the scores so far plus the midpoint of what the
+    remaining trees could add, which keeps the leading class; the floor is
+    returned separately.
+
+    Stages run on the flat ensemble, or on the native LightGBM booster's
+    iteration ranges (``load_native``) for batches larger than ``max_flat_rows``.
+    """
+
+    def __init__(self, flat, stages=20, load_native=None, max_flat_rows=0):
+        if flat.kind != 'gbdt' or flat.n_classes_ < 3 or not flat._interleaved:
+            raise NotImplementedError('Early exit needs a multiclass LightGBM ensemble')
+        self.flat = flat
+        self.classes_ = flat.classes_
+        self.n_classes = flat.n_classes_
+        self.n_trees = flat.n_trees
+        self.load_native = load_native
+        self.max_flat_rows = max_flat_rows
+
+        # remaining_*[i]: per class, the sums of the least and largest leaf of
+        # the trees from iteration i on
+        n_iterations = flat.n_trees // self.n_classes
+        low, high = (bound.reshape(n_iterations, self.n_classes) for bound in flat.leaf_bounds())
+        zero = np.zeros((1, self.n_classes))
+        self.remaining_low = np.vstack([np.cumsum(low[::-1], axis=0)[::-1], zero])
+        self.remaining_high = np.vstack([np.cumsum(high[::-1], axis=0)[::-1], zero])
+        step = max(1, -(-n_iterations // stages))
+        self.boundaries = list(range(0, n_iterations, step)) + [n_iterations]
+
+    def _raw(self, X, start, stop):
+        """Raw class scores of boosting iterations ``start`` to ``stop``"""
+        if self.load_native is not None and len(X) > self.max_flat_rows:
+            return self.load_native().booster_.predict(X, raw_score=True, start_iteration=start,
+                                                       num_iteration=stop - start)
+        return self.flat.raw_scores(X, start * self.n_classes, stop * self.n_classes)
+
+    def predict_proba(self, X, min_confidence=0.0):
+        """Class probabilities, the number of trees evaluated and the lower
+        bound on the predicted class's full probability, for each row"""
+        X = np.ascontiguousarray(X, dtype=self.flat.input_dtype)
+        n = len(X)
+        raw = np.zeros((n, self.n_classes))
+        proba = np.empty((n, self.n_classes))
+        floor = np.empty(n)
+        trees = np.full(n, self.n_trees)
+        active = np.arange(n)
+        last = self.boundaries[-1]
+        for start, stop in zip(self.boundaries, self.boundaries[1:]):
+            raw[active] += self._raw(X[active], start, stop)
+            if stop == last:
+                break
+            current = raw[active]
+            rows = np.arange(len(active))
+            leader = np.argmax(current, axis=1)
+            # The remaining trees at their worst for the leader
+            worst = current + self.remaining_high[stop]
+            worst[rows, leader] = current[rows, leader] + self.remaining_low[stop][leader]
+            others = worst.copy()
+            others[rows, leader] = -np.inf
+            settled = worst[rows, leader] > others.max(axis=1)
+            worst_floor = _softmax(worst)[rows, leader]
+            done = settled & (worst_floor >= min_confidence)
+            if done.any():
+                stopped = active[done]
+                midpoint = (self.remaining_low[stop] + self.remaining_high[stop]) / 2
+                proba[stopped] = _softmax(current[done] + midpoint)
+                floor[stopped] = worst_floor[done]
+                trees[stopped] = stop * self.n_classes
+                active = active[~done]
+                if not len(active):
+                    break
+        if len(active):
+            proba[active] = _softmax(raw[active])
+            floor[active] = proba[active].max(axis=1)
+        return proba, trees, floor
+
+
+class _NodeBuffer:
+    """Collects the nodes of several trees into growing Python lists"""
+
+    def __init__(self, value_width=None):
+        self.columns = {name: [] for name in ('feature', 'threshold', 'left', 'right',
+                                              'default_left', 'missing', 'value')}
+        self.value_width = value_width
+
+    def __len__(self):
+        return len(self.columns['feature'])
+
+    def add(self, feature=0, threshold=np.nan, default_left=False, missing=MISSING_DEFAULT, value=None):
+        node = len(self)
+        c = self.columns
+        c['feature'].append(feature)
+        c['threshold'].append(threshold)
+        c['left'].append(node)
+        c['right'].append(node)
+        c['default_left'].append(default_left)
+        c['missing'].append(missing)
+        c['value'].append(value if value is not None else
+                          (np.zeros(self.value_width) if self.value_width else 0.0))
+        return node
+
+    def arrays(self, roots, tree_class):
+        c = self.columns
+        return {
+            'feature': np.asarray(c['feature'], dtype=np.int32),
+            'threshold': np.asarray(c['threshold'], dtype=np.float64),
+            'left': np.asarray(c['left'], dtype=np.int32),
+            'right': np.asarray(c['right'], dtype=np.int32),
+            'default_left': np.asarray(c['default_left'], dtype=bool),
+            'missing': np.asarray(c['missing'], dtype=np.int8),
+            'value': np.asarray(c['value'], dtype=np.float64),
+            'roots': np.asarray(roots, dtype=np.int32),
+            'tree_class': np.asarray(tree_class, dtype=np.int32)
+        }
+
+
+def _export_forest(model):
+    nodes = _NodeBuffer(value_width=len(model.classes_))
+    roots, max_depth = [], 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        offset = len(nodes)
+        roots.append(offset)
+        max_depth = max(max_depth, tree.max_depth)
+        go_left = getattr(tree, 'missing_go_to_left', None)
+        # Normalise leaf values exactly as DecisionTreeClassifier.predict_proba
+        value = tree.value[:, 0, :len(model.classes_)]
+        normalizer = value.sum(axis=1)[:, None]
+        normalizer[normalizer == 0.0] = 1.0
+        proba = value / normalizer
+        for i in range(tree.node_count):
+            if tree.children_left[i] == -1:
+                nodes.add(value=proba[i])
+            else:
+                nodes.add(feature=int(tree.feature[i]), threshold=float(tree.threshold[i]),
+                          default_left=bool(go_left[i]) if go_left is not None else False)
+                nodes.columns['left'][-1] = offset + int(tree.children_left[i])
+                nodes.columns['right'][-1] = offset + int(tree.children_right[i])
+    return FlatTreeEnsemble('forest', model.classes_, nodes.arrays(roots, [0] * len(roots)), max_depth)
+
+
+def _export_lightgbm(model):
+    dump = model.booster_.dump_model()
+    objective = dump['objective'].split()
+    if objective[0] not in ('multiclass', 'binary') or dump.get('average_output'):
+        raise NotImplementedError(f"Unsupported LightGBM objective: {dump['objective']}")
+    sigmoid = 1.0
+    for part in objective[1:]:
+        if part.startswith('sigmoid:'):
+            sigmoid = float(part.split(':', 1)[1])
+
+    missing_kinds = {'None': MISSING_AS_ZERO, 'NaN': MISSING_DEFAULT, 'Zero': ZERO_DEFAULT}
+    nodes = _NodeBuffer()
+    roots, tree_class = [], []
+    max_depth = 0
+    per_iteration = dump['num_tree_per_iteration']
+
+    def add(node, depth):
+        nonlocal max_depth
+        max_depth = max(max_depth, depth)
+        if 'leaf_value' in node:
+            return nodes.add(value=float(node['leaf_value']))
+        if node['decision_type'] != '<=':
+            raise NotImplementedError('Categorical LightGBM splits are not supported')
+        index = nodes.add(feature=int(node['split_feature']), threshold=float(node['threshold']),
+                          default_left=bool(node['default_left']),
+                          missing=missing_kinds[node['missing_type']])
+        left = add(node['left_child'], depth + 1)
+        right = add(node['right_child'], depth + 1)
+        nodes.columns['left'][index] = left
+        nodes.columns['right'][index] = right
+        return index
+
+    for tree in dump['tree_info']:
+        roots.append(add(tree['tree_structure'], 0))
+        tree_class.append(tree['tree_index'] % per_iteration)
+    return FlatTreeEnsemble('gbdt', model.classes_, nodes.arrays(roots, tree_class), max_depth,
+                            objective=objective[0], sigmoid=sigmoid)
+
+
+def export_ensemble(model):
+    """Convert a fitted RandomForestClassifier or LGBMClassifier"""
+    if hasattr(model, 'booster_'):
+        return _export_lightgbm(model)
+    if hasattr(model, 'estimators_') and hasattr(model.estimators_[0], 'tree_'):
+        return _export_forest(model)
+    raise NotImplementedError(f'Cannot export {type(model).__name__}')
+
+
+def ensemble_dir(model_dir, mission):
+    return os.path.join(model_dir, f'{mission}_ensemble')
+
+
+def export_mission(model_dir, mission):
+    """Export ``<mission>_model.pkl`` to ``<mission>_ensemble/``"""
+    import joblib
+
+    source = os.path.join(model_dir, f'{mission}_model.pkl')
+    model = joblib.load(source)
+    ensemble = export_ensemble(model)
+    ensemble.meta['source_sha256'] = file_sha256(source)
+    ensemble.save(ensemble_dir(model_dir, mission))
+    return ensemble
+
+
+def main(missions):
+    from model import MODEL_DIR
+
+    for mission in missions:
+        if not os.path.exists(os.path.join(MODEL_DIR, f'{mission}_model.pkl')):
+            print(f'Skipping {mission} - no model file')
+            continue
+        ensemble = export_mission(MODEL_DIR, mission)
+        print(f'Exported {mission}: {ensemble.n_trees} trees, {len(ensemble.feature)} nodes, '
+              f'depth {ensemble.max_depth}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or ['kepler', 'k2', 'tess'])